@@ -0,0 +1,125 @@
+"""
+Corpus statistics of question pairs from corpus_stats notebook.
+
+Texts are tokenized and parsed once by ``MorphCache.analyze_column``, sentence properties
+are computed from the cached parses.
+
+Example:
+    python -m analysis.corpus_stats dev.tsv test.tsv
+"""
+import pandas as pd
+import numpy as np
+
+import argparse
+from enum import Flag, auto
+from itertools import chain
+from typing import List, MutableMapping, Optional, Sequence, Tuple
+
+from utils.morphology import MorphCache, Parse, is_word
+
+try:
+    from lexical_diversity import lex_div as ld
+except ModuleNotFoundError:
+    ld = None
+
+NUMBER_TAGS = frozenset({'NUMB', 'intg', 'real', 'ROMN'})
+
+
+class Prop(Flag):
+    ENG = auto()
+    NUMBR = auto()
+    NUM_WORD = auto()
+    GRND = auto()
+    NEGATION = auto()
+    DBL_NEGATION = auto()
+    COMP_SENT = auto()
+
+
+def analyze(tokens: Sequence[str], parsed: Sequence[Parse]) -> Tuple[int, Prop]:
+    """Number of words and properties of a sentence"""
+    sent_len = sum(1 for token in tokens if is_word(token))
+    tags = set()
+    for p in parsed:
+        tags |= p.tags
+
+    properties = Prop(0)
+    if 'LATN' in tags:
+        properties |= Prop.ENG
+    if len(NUMBER_TAGS & tags) > 0:
+        properties |= Prop.NUMBR
+    if 'NUMR' in tags:
+        properties |= Prop.NUM_WORD
+    if 'GRND' in tags:
+        properties |= Prop.GRND
+
+    neg_cnt = 0
+    for p in parsed:
+        if p.pos == 'PRCL' and p.normal_form in ('не', 'ни'):
+            neg_cnt += 1
+        if p.pos in ('ADVB', 'NPRO') and p.normal_form.startswith('ни'):
+            neg_cnt += 1
+        if p.pos == 'PRED' and p.normal_form.startswith('не'):
+            neg_cnt += 1
+
+    if neg_cnt > 0:
+        properties |= Prop.NEGATION
+    if neg_cnt == 2:
+        properties |= Prop.DBL_NEGATION
+    return sent_len, properties
+
+
+def get_corpus_lemmas(parsed: Sequence[Sequence[Parse]]) -> List[str]:
+    """Lemmas of all words of the corpus (punctuation is dropped)"""
+    return [p.normal_form for p in chain.from_iterable(parsed) if 'PNCT' not in p.tags]
+
+
+def corpus_stat(df: pd.DataFrame, morph: Optional[MorphCache] = None) -> MutableMapping[str, float]:
+    """Statistics of question pairs
+
+    Args:
+        df: DataFrame with 'left_text', 'right_text' and 'class' columns
+        morph: morphological analyzer, new one is created if None
+
+    Returns:
+        Fraction of pairs with every property (``Prop``), mean question length, mean length difference,
+        fraction of positive pairs and MTLD lexical diversity (if lexical_diversity is installed)
+    """
+    if morph is None:
+        morph = MorphCache()
+    left_tokens, left_parsed = morph.analyze_column(df['left_text'])
+    right_tokens, right_parsed = morph.analyze_column(df['right_text'])
+
+    len_s = 0
+    len_diff_s = 0
+    stats = {item.name: 0 for item in list(Prop)}
+    for l_tok, l_parsed, r_tok, r_parsed in zip(left_tokens, left_parsed, right_tokens, right_parsed):
+        left_len, left_props = analyze(l_tok, l_parsed)
+        right_len, right_props = analyze(r_tok, r_parsed)
+        len_s += left_len + right_len
+        len_diff_s += abs(left_len - right_len)
+        props = left_props | right_props
+        for item in list(Prop):
+            if item in props:
+                stats[item.name] += 1
+
+    cnt = len(df)
+    stats = {key: val / cnt for key, val in stats.items()}
+    stats['mean_len'] = len_s / (2 * cnt)
+    stats['mean_diff'] = len_diff_s / cnt
+    stats['pos_frac'] = df['class'].astype(np.float64).mean()
+    if ld is not None:
+        stats['diversity'] = ld.mtld(get_corpus_lemmas(chain(left_parsed, right_parsed)))
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Morphological statistics of question pair sets')
+    parser.add_argument('files', nargs='+', help="TSV files with 'left_text', 'right_text' and 'class' columns")
+    args = parser.parse_args()
+
+    morph_cache = MorphCache()
+    for file_path in args.files:
+        print(file_path)
+        for name, value in corpus_stat(pd.read_csv(file_path, sep='\t').dropna(), morph_cache).items():
+            print(f'\t{name}: {value:.4f}')
+    print(morph_cache.cache_info())
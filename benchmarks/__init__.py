@@ -0,0 +1,8 @@
+"""
+Offline benchmarks of preprocessing, scraping and labeling code on synthetic data.
+"""
+from os import path
+
+REPO_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+# Scrapy project package 'scraping' is in scraping/ directory of the repository
+SCRAPY_PROJECT_DIR = path.join(REPO_DIR, 'scraping')
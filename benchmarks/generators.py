@@ -0,0 +1,113 @@
+"""
+Synthetic data for offline benchmarks: Russian questions, scraped items, question pages and Toloka assignments.
+
+All generators are deterministic for a given seed.
+"""
+import pandas as pd
+import numpy as np
+
+from datetime import datetime, timedelta
+from random import Random
+from typing import Dict, List, Tuple
+
+from scraping.benchmark import synthetic_page
+
+WORDS = [
+    'как', 'почему', 'зачем', 'где', 'когда', 'можно', 'нужно', 'ли', 'сделать', 'купить', 'выбрать', 'научиться',
+    'играть', 'гитара', 'небо', 'голубой', 'человек', 'время', 'год', 'работа', 'деньги', 'кошка', 'собака', 'дом',
+    'машина', 'зимой', 'летом', 'быстро', 'самостоятельно', 'лучше', 'хороший', 'новый', 'старый', 'город', 'школа',
+    'книга', 'читать', 'писать', 'программа', 'компьютер', 'телефон', 'вода', 'еда', 'спать', 'ночью', 'утром',
+]
+TAGS = ['наука', 'физика', 'музыка', 'спорт', 'животные', 'техника', 'образование', 'здоровье', 'путешествия', 'еда']
+# Characters handled by sanitize_unicode: no-break and zero-width spaces, quotes, dashes, combining accent
+NOISE = ['\xa0', '\u200b', '«', '»', '—', '–', '\u0301', '’', '\xad']
+
+
+def synthetic_questions(n: int, seed: int = 0, noise: float = 0.1) -> List[str]:
+    """Questions of 3-15 words with unicode noise inserted after ``noise`` share of words"""
+    rnd = Random(seed)
+    questions = []
+    for _ in range(n):
+        words = []
+        for word in rnd.choices(WORDS, k=rnd.randint(3, 15)):
+            if rnd.random() < noise:
+                word += rnd.choice(NOISE)
+            words.append(word)
+        questions.append(' '.join(words).capitalize() + '?')
+    return questions
+
+
+def synthetic_lemmas(n: int, seed: int = 0) -> List[List[str]]:
+    """Lemmatized questions as token lists with spaces and punctuation, like Mystem output"""
+    rnd = Random(seed)
+    result = []
+    for _ in range(n):
+        tokens = []
+        for word in rnd.choices(WORDS, k=rnd.randint(3, 15)):
+            tokens.extend([word, ' '])
+        tokens[-1] = '?'
+        result.append(tokens)
+    return result
+
+
+def question_items(n: int, seed: int = 0, n_answers: int = 5) -> List[Dict]:
+    """Items of question spider with tags and answers"""
+    rnd = Random(seed)
+    texts = synthetic_questions(n, seed, noise=0.)
+    return [{
+        'question': text,
+        'question_id': f'q{seed}-{i}',
+        'parent_id': None,
+        'tags': rnd.sample(TAGS, rnd.randint(0, 3)),
+        'answers': [
+            {'text': ' '.join(rnd.choices(WORDS, k=30)), 'pluses': rnd.randint(0, 100), 'minuses': rnd.randint(0, 10)}
+            for _ in range(rnd.randint(0, n_answers))
+        ],
+        'url': f'https://yandex.ru/q/question/q{seed}-{i}/',
+    } for i, text in enumerate(texts)]
+
+
+def question_pages(n: int, seed: int = 0, n_answers: int = 20) -> List[Tuple[str, bytes]]:
+    """Question pages in Yandex Q layout as (question id, HTML) pairs"""
+    return [
+        (f'{seed}-{i}', synthetic_page(f'{seed}-{i}', n_answers=n_answers, seed=seed + i).encode('utf-8'))
+        for i in range(n)
+    ]
+
+
+def toloka_assignments(n_assignments: int, tasks_per_assignment: int = 10, n_workers: int = 50,
+                       golden_share: float = 0.2, error_rate: float = 0.1, seed: int = 0) -> pd.DataFrame:
+    """Assignments export of question pairs labeling project in Toloka TSV format
+
+    Every assignment is a page of tasks done by one worker, ``golden_share`` of tasks are control ones,
+    workers answer incorrectly with probability ``error_rate``.
+    """
+    rnd = np.random.RandomState(seed)
+    n = n_assignments * tasks_per_assignment
+    assignment = np.repeat(np.arange(n_assignments), tasks_per_assignment)
+    worker = rnd.randint(0, n_workers, size=n_assignments)[assignment]
+    submitted = datetime(2021, 5, 1) + np.cumsum(rnd.exponential(30., size=n_assignments))[assignment] * timedelta(
+        seconds=1
+    )
+    true_class = rnd.randint(0, 2, size=n)
+    output_class = np.where(rnd.random_sample(n) < error_rate, 1 - true_class, true_class)
+    is_golden = rnd.random_sample(n) < golden_share
+    left_id = rnd.randint(0, 10 ** 6, size=n)
+    right_id = rnd.randint(0, 10 ** 6, size=n)
+    verdict = np.where(rnd.random_sample(n) < error_rate, '-', None)
+    return pd.DataFrame({
+        'INPUT:question_1_id': left_id,
+        'INPUT:question_2_id': right_id,
+        'INPUT:question_1_url': [f'https://yandex.ru/q/question/{q_id:x}/' for q_id in left_id],
+        'INPUT:question_2_url': [f'https://yandex.ru/q/question/{q_id:x}/' for q_id in right_id],
+        'OUTPUT:class': output_class,
+        'OUTPUT:q_1_error': rnd.random_sample(n) < 0.01,
+        'OUTPUT:q_2_error': rnd.random_sample(n) < 0.01,
+        'GOLDEN:class': np.where(is_golden, true_class, np.nan),
+        'ASSIGNMENT:assignment_id': [f'a{i:08d}' for i in assignment],
+        'ASSIGNMENT:worker_id': [f'w{i:04d}' for i in worker],
+        'ASSIGNMENT:submitted': submitted,
+        'ASSIGNMENT:status': 'SUBMITTED',
+        'ACCEPT:verdict': verdict,
+        'ACCEPT:comment': np.where(verdict == '-', 'Неправильный ответ', None),
+    })
@@ -0,0 +1,350 @@
+"""
+Offline benchmark suite: unicode sanitizing and filters of preprocessing, question text download,
+question page parsing, database pipeline and Toloka answers acceptance rules on synthetic data.
+
+Every benchmark runs at several scales (multipliers of its base size), every run is repeated
+and wall time of repeats is saved to JSON. Results are compared with a baseline by median time,
+benchmarks slower than the baseline by more than tolerance are reported as regressions.
+
+Example:
+    python -m benchmarks.suite --out results.json --scales 1 10 100
+    python -m benchmarks.suite --compare results.json --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from benchmarks import REPO_DIR, SCRAPY_PROJECT_DIR
+from benchmarks import generators
+from utils.atomic_write import atomic_write_json
+
+SCALES = (1, 10)
+REPEAT = 3
+TOLERANCE = 0.2
+SEED = 0
+
+
+class BenchmarkSpec(NamedTuple):
+    """
+    ``prepare(n, seed)`` builds inputs once per scale, ``setup(inputs)`` builds state of every repeat,
+    only ``run(state)`` is timed, ``teardown(state)`` releases the state
+    """
+    prepare: Callable[[int, int], Any]
+    run: Callable[[Any], Any]
+    base_size: int
+    unit: str
+    setup: Optional[Callable[[Any], Any]] = None
+    teardown: Optional[Callable[[Any], None]] = None
+
+
+def _preprocessing():
+    from preprocessing import preprocessing
+    return preprocessing
+
+
+def _prepare_texts(n: int, seed: int):
+    return _preprocessing(), generators.synthetic_questions(n, seed)
+
+
+def _run_sanitize(inputs) -> None:
+    module, texts = inputs
+    for text in texts:
+        module.sanitize_unicode(text, mode='hard')
+
+
+def _prepare_sanitized(n: int, seed: int):
+    module, texts = _prepare_texts(n, seed)
+    return module, [module.sanitize_unicode(text, mode='hard') for text in texts]
+
+
+def _run_unicode_range(inputs) -> None:
+    module, texts = inputs
+    for text in texts:
+        module.is_valid_unicode_range(text)
+
+
+def _prepare_lemmas(n: int, seed: int):
+    return _preprocessing(), generators.synthetic_lemmas(n, seed)
+
+
+def _run_obscene_filter(inputs) -> None:
+    module, lemmas = inputs
+    for tokens in lemmas:
+        module.obscene_filter(tokens, is_input_lemmatized=True)
+
+
+def _prepare_ipm(n: int, seed: int):
+    module, lemmas = _prepare_lemmas(n, seed)
+    return module, lemmas, module.load_ipm(path.join(REPO_DIR, 'preprocessing', 'freqrnc2011.csv'))
+
+
+def _run_ipm_filter(inputs) -> None:
+    module, lemmas, ipm = inputs
+    for tokens in lemmas:
+        module.ipm_filter(tokens, ipm, module.IPM_LOWER_THRESHOLD)
+
+
+class _PageServer(object):
+    """
+    Local HTTP server of question pages, stand-in of Yandex Q for ``get_q_text``
+    """
+    def __init__(self, pages: Sequence):
+        bodies = {f'/q/question/{q_id}/': body for q_id, body in pages}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = bodies.get(self.path)
+                self.send_response(200 if body is not None else 404)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body or b'')))
+                self.end_headers()
+                self.wfile.write(body or b'')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.urls = [f'http://127.0.0.1:{self.server.server_port}{url}' for url in bodies]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _run_get_q_text(server: _PageServer) -> None:
+    from utils.download import get_q_text
+    for url in server.urls:
+        get_q_text(url)
+
+
+def _prepare_spider(n: int, seed: int):
+    from scraping.spiders.yandex_q import YandexQuestionsSpider
+    return YandexQuestionsSpider(), generators.question_pages(n, seed)
+
+
+def _run_spider_parse(inputs) -> None:
+    from scrapy.http import HtmlResponse
+    from scraping.benchmark import PAGE_URL
+    spider, pages = inputs
+    for q_id, body in pages:
+        # New response every time, otherwise parsed DOM is cached in the response selector
+        response = HtmlResponse(PAGE_URL.format(q_id=q_id), body=body, encoding='utf-8')
+        for _ in spider.parse(response, q_id):
+            pass
+
+
+def _setup_pipeline(items):
+    from scrapy import Spider
+    from scraping.pipelines import DatabaseSQLPipeline
+    tmp_dir = tempfile.mkdtemp()
+    pipeline = DatabaseSQLPipeline(f'sqlite:///{path.join(tmp_dir, "questions.db")}')
+    spider = Spider(name='benchmark')
+    pipeline.open_spider(spider)
+    return pipeline, spider, items, tmp_dir
+
+
+def _run_pipeline(state) -> None:
+    pipeline, spider, items, _ = state
+    for item in items:
+        pipeline.process_item(item, spider)
+
+
+def _teardown_pipeline(state) -> None:
+    pipeline, spider, _, tmp_dir = state
+    pipeline.close_spider(spider)
+    shutil.rmtree(tmp_dir)
+
+
+def _prepare_assignments(n: int, seed: int):
+    return generators.toloka_assignments(n, seed=seed)
+
+
+def _run_last_ctrl_good_ts(assignments) -> None:
+    from labeling.accept_labels import last_ctrl_good_ts
+    assignments.groupby('ASSIGNMENT:worker_id').apply(
+        lambda df: last_ctrl_good_ts(df, 'ASSIGNMENT:submitted', 0.75)
+    )
+
+
+def _run_propagate_verdict(assignments) -> None:
+    from labeling.accept_labels import propagate_verdict
+    assignments.groupby('ASSIGNMENT:assignment_id').apply(propagate_verdict)
+
+
+BENCHMARKS: Dict[str, BenchmarkSpec] = {
+    'sanitize_unicode': BenchmarkSpec(_prepare_texts, _run_sanitize, 1000, 'question'),
+    'is_valid_unicode_range': BenchmarkSpec(_prepare_sanitized, _run_unicode_range, 1000, 'question'),
+    'obscene_filter': BenchmarkSpec(_prepare_lemmas, _run_obscene_filter, 1000, 'question'),
+    'ipm_filter': BenchmarkSpec(_prepare_ipm, _run_ipm_filter, 1000, 'question'),
+    'get_q_text': BenchmarkSpec(
+        generators.question_pages, _run_get_q_text, 10, 'page',
+        setup=_PageServer, teardown=_PageServer.close
+    ),
+    'spider_parse': BenchmarkSpec(_prepare_spider, _run_spider_parse, 10, 'page'),
+    'database_pipeline': BenchmarkSpec(
+        generators.question_items, _run_pipeline, 50, 'item',
+        setup=_setup_pipeline, teardown=_teardown_pipeline
+    ),
+    'last_ctrl_good_ts': BenchmarkSpec(_prepare_assignments, _run_last_ctrl_good_ts, 100, 'assignment'),
+    'propagate_verdict': BenchmarkSpec(_prepare_assignments, _run_propagate_verdict, 100, 'assignment'),
+}
+
+
+def time_benchmark(spec: BenchmarkSpec, n: int, repeat: int = REPEAT, seed: int = SEED) -> Dict:
+    """Wall time of ``repeat`` runs of benchmark on n items"""
+    inputs = spec.prepare(n, seed)
+    seconds = []
+    for _ in range(repeat):
+        state = spec.setup(inputs) if spec.setup is not None else inputs
+        try:
+            start = time.perf_counter()
+            spec.run(state)
+            seconds.append(time.perf_counter() - start)
+        finally:
+            if spec.teardown is not None:
+                spec.teardown(state)
+    median = statistics.median(seconds)
+    return {
+        'n': n,
+        'unit': spec.unit,
+        'seconds': seconds,
+        'min': min(seconds),
+        'median': median,
+        'per_second': n / max(median, 1e-9),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names: Optional[Sequence[str]] = None, scales: Sequence[int] = SCALES, repeat: int = REPEAT,
+              seed: int = SEED, silent: bool = False) -> Dict:
+    """Run benchmarks at every scale
+
+    Benchmarks, which dependencies can't be imported, are saved as skipped.
+
+    Returns:
+        Results with 'meta' (environment) and 'results' ('<benchmark>/<n>' -> timings) keys
+    """
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    for name in names:
+        spec = BENCHMARKS[name]
+        for scale in scales:
+            n = spec.base_size * scale
+            key = f'{name}/{n}'
+            try:
+                results[key] = time_benchmark(spec, n, repeat, seed)
+            except ImportError as e:
+                results[key] = {'n': n, 'unit': spec.unit, 'skipped': str(e)}
+            if not silent:
+                res = results[key]
+                if 'skipped' in res:
+                    print(f'{key}: skipped ({res["skipped"]})')
+                else:
+                    print(f'{key}: {res["median"] * 1000:.1f} ms, {res["per_second"]:.0f} {spec.unit}/s')
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: Dict, results: Dict, tolerance: float = TOLERANCE) -> List[Dict]:
+    """Median time of benchmarks present in both results relative to the baseline
+
+    Returns:
+        Rows with 'key', 'baseline', 'current' (median seconds), 'ratio' and 'regression' flag,
+        which is set when current time exceeds baseline one by more than ``tolerance`` share
+    """
+    rows = []
+    for key, res in results['results'].items():
+        base = baseline['results'].get(key)
+        if base is None or 'skipped' in base or 'skipped' in res:
+            continue
+        ratio = res['median'] / max(base['median'], 1e-9)
+        rows.append({
+            'key': key,
+            'baseline': base['median'],
+            'current': res['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + tolerance,
+        })
+    return rows
+
+
+def format_comparison(rows: Sequence[Dict]) -> str:
+    lines = [f'{"benchmark":<32} {"baseline, ms":>12} {"current, ms":>12} {"ratio":>7}']
+    for row in rows:
+        mark = '  REGRESSION' if row['regression'] else ''
+        lines.append(f'{row["key"]:<32} {row["baseline"] * 1000:>12.2f} {row["current"] * 1000:>12.2f} '
+                     f'{row["ratio"]:>7.2f}{mark}')
+    return '\n'.join(lines)
+
+
+def save_results(results: Dict, file_path: str) -> None:
+    atomic_write_json(file_path, results, indent=2)
+
+
+def load_results(file_path: str) -> Dict:
+    with open(file_path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    if SCRAPY_PROJECT_DIR not in sys.path:
+        sys.path.append(SCRAPY_PROJECT_DIR)
+    parser = argparse.ArgumentParser(description='Offline benchmarks on synthetic data')
+    parser.add_argument('--out', help='JSON file for results')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run (all by default)')
+    parser.add_argument('--scales', nargs='+', type=int, default=list(SCALES),
+                        help='Multipliers of base size of every benchmark')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Number of runs at every scale')
+    parser.add_argument('--seed', type=int, default=SEED, help='Seed of synthetic data')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--compare', help='Compare saved JSON results with baseline instead of running benchmarks')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Allowed relative slowdown')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        if args.baseline is None:
+            parser.error('--compare requires --baseline')
+        suite_results = load_results(args.compare)
+    else:
+        suite_results = run_suite(args.only, args.scales, args.repeat, args.seed)
+        if args.out is not None:
+            save_results(suite_results, args.out)
+
+    if args.baseline is not None:
+        comparison = compare(load_results(args.baseline), suite_results, args.tolerance)
+        print(format_comparison(comparison))
+        n_regressions = sum(row['regression'] for row in comparison)
+        if n_regressions > 0:
+            print(f'{n_regressions} benchmarks are slower than baseline by more than {args.tolerance:.0%}')
+            sys.exit(1)
@@ -0,0 +1,249 @@
+"""
+Streaming export of scraped questions, tags and answers.
+
+Questions are read in batches with ``yield_per`` (server-side cursor), tags and answers of a batch
+are loaded with one ``selectinload`` query per relation instead of lazy loads per question,
+and only one batch is referenced at a time, so memory does not depend on database size.
+
+Output:
+    questions/part-XXXXX.parquet: id, short_name, parent_short_name, url, text, tags (list of dictionary-encoded tags)
+    answers/part-XXXXX.parquet: id, question_id, text, pluses, minuses
+    All_questions_with_tags.csv: questions separated by ';' with tags joined by TAG_SEPARATOR
+"""
+import pandas as pd
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:
+    pa = None
+    pq = None
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, selectinload
+
+import argparse
+import os
+import shutil
+import time
+from os import path
+from typing import Dict, Iterator, List, Sequence
+
+from database.models import Question, Tag
+
+BATCH_SIZE = 5_000
+PARTITION_SIZE = 500_000
+TAG_SEPARATOR = '|'
+CSV_NAME = 'All_questions_with_tags.csv'
+QUESTION_COLUMNS = ['id', 'short_name', 'parent_short_name', 'url', 'text', 'tags']
+ANSWER_COLUMNS = ['id', 'question_id', 'text', 'pluses', 'minuses']
+
+
+def iter_question_batches(session: Session, batch_size: int = BATCH_SIZE) -> Iterator[List[Question]]:
+    """Questions ordered by id in batches with eagerly loaded tags and answers"""
+    stmt = (
+        select(Question)
+        .options(selectinload(Question.tags), selectinload(Question.answers))
+        .order_by(Question.id)
+        .execution_options(yield_per=batch_size, stream_results=True)
+    )
+    # Identity map of the session holds weak references, objects of a written batch are released
+    yield from session.execute(stmt).scalars().partitions()
+
+
+class PartitionedParquetWriter(object):
+    """
+    Parquet dataset split into files of at most ``partition_size`` rows, every written batch is a row group.
+
+    Partitions are written into ``<root>.tmp`` directory, which replaces ``root`` on ``commit``,
+    so the dataset of the previous export is kept until the new one is complete.
+    """
+    def __init__(self, root: str, schema, partition_size: int = PARTITION_SIZE):
+        self.root = root
+        self.tmp_root = root + '.tmp'
+        self.schema = schema
+        self.partition_size = partition_size
+        self.n_partitions = 0
+        self._writer = None
+        self._rows = 0
+        # Leftover of interrupted export
+        if path.isdir(self.tmp_root):
+            shutil.rmtree(self.tmp_root)
+        os.makedirs(self.tmp_root)
+
+    def write(self, table) -> None:
+        start = 0
+        while start < table.num_rows:
+            if self._writer is None or self._rows >= self.partition_size:
+                self._next_partition()
+            length = min(table.num_rows - start, self.partition_size - self._rows)
+            self._writer.write_table(table.slice(start, length))
+            self._rows += length
+            start += length
+
+    def _next_partition(self) -> None:
+        self.close()
+        file_path = path.join(self.tmp_root, f'part-{self.n_partitions:05d}.parquet')
+        self._writer = pq.ParquetWriter(file_path, self.schema, compression='zstd')
+        self._rows = 0
+        self.n_partitions += 1
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def commit(self) -> None:
+        """Close the last partition and replace dataset of the previous export with the written one"""
+        self.close()
+        old_root = self.root + '.old'
+        if path.isdir(old_root):
+            shutil.rmtree(old_root)
+        # Directory can't be replaced by another one unless it is empty, so the old dataset is moved aside first
+        if path.isdir(self.root):
+            os.rename(self.root, old_root)
+        os.rename(self.tmp_root, self.root)
+        if path.isdir(old_root):
+            shutil.rmtree(old_root)
+
+
+def question_schema(tag_type):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('short_name', pa.string()),
+        ('parent_short_name', pa.string()),
+        ('url', pa.string()),
+        ('text', pa.string()),
+        ('tags', pa.list_(tag_type)),
+    ])
+
+
+ANSWER_SCHEMA = None if pa is None else pa.schema([
+    ('id', pa.int64()),
+    ('question_id', pa.int64()),
+    ('text', pa.string()),
+    ('pluses', pa.int64()),
+    ('minuses', pa.int64()),
+])
+
+
+def questions_table(batch: Sequence[Question], tag_codes: Dict[int, int], tag_dictionary):
+    """Arrow table of questions, tags are indices into the global dictionary of tags"""
+    offsets = np.zeros(len(batch) + 1, dtype=np.int32)
+    codes = []
+    for i, q in enumerate(batch):
+        codes.extend(tag_codes[t.id] for t in q.tags)
+        offsets[i + 1] = len(codes)
+    tags = pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), tag_dictionary)
+    return pa.Table.from_arrays([
+        pa.array([q.id for q in batch], type=pa.int64()),
+        pa.array([q.short_name for q in batch], type=pa.string()),
+        pa.array([q.parent_short_name for q in batch], type=pa.string()),
+        pa.array([q.url for q in batch], type=pa.string()),
+        pa.array([q.text for q in batch], type=pa.string()),
+        pa.ListArray.from_arrays(pa.array(offsets), tags),
+    ], schema=question_schema(tags.type))
+
+
+def answers_table(batch: Sequence[Question]):
+    answers = [a for q in batch for a in q.answers]
+    return pa.Table.from_arrays([
+        pa.array([a.id for a in answers], type=pa.int64()),
+        pa.array([a.question_id for a in answers], type=pa.int64()),
+        pa.array([a.text for a in answers], type=pa.string()),
+        pa.array([a.pluses for a in answers], type=pa.int64()),
+        pa.array([a.minuses for a in answers], type=pa.int64()),
+    ], schema=ANSWER_SCHEMA)
+
+
+def questions_frame(batch: Sequence[Question]) -> pd.DataFrame:
+    return pd.DataFrame({
+        'id': [q.id for q in batch],
+        'short_name': [q.short_name for q in batch],
+        'parent_short_name': [q.parent_short_name for q in batch],
+        'url': [q.url for q in batch],
+        'text': [q.text for q in batch],
+        'tags': [TAG_SEPARATOR.join(t.tag for t in q.tags) for q in batch],
+    }, columns=QUESTION_COLUMNS)
+
+
+def export(db_url: str, out_dir: str, batch_size: int = BATCH_SIZE, partition_size: int = PARTITION_SIZE,
+           parquet: bool = True, csv: bool = True, silent: bool = False) -> int:
+    """Export all questions with tags and answers
+
+    Args:
+        db_url: SQLAlchemy database url
+        out_dir: output directory
+        batch_size: number of questions loaded at once
+        partition_size: maximal number of rows in one Parquet file
+        parquet: write Parquet datasets (requires pyarrow)
+        csv: write questions CSV
+
+    Returns:
+        Number of exported questions
+    """
+    if parquet and pa is None:
+        raise ImportError('pyarrow is required for Parquet export')
+    os.makedirs(out_dir, exist_ok=True)
+    engine = create_engine(db_url)
+
+    q_writer = a_writer = None
+    csv_path = path.join(out_dir, CSV_NAME)
+    tmp_csv_path = csv_path + '.tmp'
+    n_questions = 0
+    start = time.perf_counter()
+    with Session(engine) as session:
+        tag_codes: Dict[int, int] = {}
+        tag_dictionary = None
+        if parquet:
+            # Tags table is small, its order defines codes of the dictionary
+            tag_rows = session.execute(select(Tag.id, Tag.tag).order_by(Tag.id)).all()
+            tag_codes = {tag_id: code for code, (tag_id, _) in enumerate(tag_rows)}
+            tag_dictionary = pa.array([tag for _, tag in tag_rows], type=pa.string())
+            q_writer = PartitionedParquetWriter(
+                path.join(out_dir, 'questions'),
+                question_schema(pa.dictionary(pa.int32(), pa.string())),
+                partition_size
+            )
+            a_writer = PartitionedParquetWriter(path.join(out_dir, 'answers'), ANSWER_SCHEMA, partition_size)
+        csv_file = open(tmp_csv_path, 'w', encoding='utf-8', newline='') if csv else None
+        try:
+            for batch in iter_question_batches(session, batch_size):
+                if parquet:
+                    q_writer.write(questions_table(batch, tag_codes, tag_dictionary))
+                    a_writer.write(answers_table(batch))
+                if csv_file is not None:
+                    questions_frame(batch).to_csv(csv_file, sep=';', index=False, header=n_questions == 0)
+                n_questions += len(batch)
+                if not silent:
+                    print(f'{n_questions} questions exported ({n_questions / (time.perf_counter() - start):.0f}/s)',
+                          end='\r')
+            if csv_file is not None and n_questions == 0:
+                questions_frame([]).to_csv(csv_file, sep=';', index=False)
+            if parquet:
+                q_writer.commit()
+                a_writer.commit()
+        finally:
+            if parquet:
+                q_writer.close()
+                a_writer.close()
+            if csv_file is not None:
+                csv_file.close()
+    if csv:
+        os.replace(tmp_csv_path, csv_path)
+    if not silent:
+        print(f'\n{n_questions} questions exported in {time.perf_counter() - start:.1f} s')
+    return n_questions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export scraped questions into Parquet and CSV')
+    parser.add_argument('out_dir', help='Output directory')
+    parser.add_argument('--db-url', default='sqlite:///scraping/questions.db', help='SQLAlchemy database url')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Questions loaded at once')
+    parser.add_argument('--partition-size', type=int, default=PARTITION_SIZE, help='Rows in one Parquet file')
+    parser.add_argument('--no-parquet', action='store_true', help='Do not write Parquet datasets')
+    parser.add_argument('--no-csv', action='store_true', help=f'Do not write {CSV_NAME}')
+    args = parser.parse_args()
+
+    export(args.db_url, args.out_dir, args.batch_size, args.partition_size,
+           parquet=not args.no_parquet, csv=not args.no_csv)
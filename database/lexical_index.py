@@ -0,0 +1,238 @@
+"""
+Lexical index of lemmatized question texts for candidate generation without embeddings.
+
+Lemmas of every question are stored in SQLite FTS5 table next to the questions database
+(``questions.db`` -> ``questions_lexical.db``), row id of the table is question id. Neighbours
+are ranked by BM25 of FTS5 for OR-query of question lemmas. The index is updated incrementally:
+questions with ids greater than the last indexed one are lemmatized and added (see ``update_from_db``
+and ``scraping.pipelines.LexicalIndexPipeline``), so lexical neighbours of new questions are available
+right after scraping, before their embeddings are computed.
+
+Example:
+    python -m database.lexical_index --db-url sqlite:///scraping/questions.db --topk-out lexical_pairs.csv --k 10
+"""
+import pandas as pd
+import numpy as np
+from sqlalchemy import create_engine, select
+
+import argparse
+import re
+import sqlite3
+import time
+from os import path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from database.models import Question
+
+Analyzer = Callable[[Sequence[str]], List[List[str]]]
+PairChunk = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+BATCH_SIZE = 1000
+TOP_K = 10
+INDEX_SUFFIX = '_lexical.db'
+LEXICAL_WEIGHT = 0.5
+_word = re.compile(r'\w+')
+
+
+class IndexMismatchError(ValueError):
+    pass
+
+
+def word_analyzer(texts: Sequence[str]) -> List[List[str]]:
+    """Lower case words without lemmatization"""
+    return [_word.findall(text.lower()) for text in texts]
+
+
+def lemma_analyzer(backend: str = 'mystem') -> Analyzer:
+    """Word lemmas of texts by lemmatizer backend of preprocessing"""
+    from preprocessing.lemmatizers import get_lemmatizer, word_lemmas
+
+    lemmatizer = get_lemmatizer(backend)
+
+    def analyze(texts: Sequence[str]) -> List[List[str]]:
+        return [word_lemmas(tokens) for tokens in lemmatizer.lemmatize_all(texts)]
+    return analyze
+
+
+def get_analyzer(name: str) -> Analyzer:
+    """'words' analyzer or lemmatizer backend name (one of ``preprocessing.lemmatizers.LEMMATIZERS``)"""
+    if name == 'words':
+        return word_analyzer
+    return lemma_analyzer(name)
+
+
+def index_path_for(db_url: str) -> str:
+    """Path of lexical index next to SQLite questions database"""
+    prefix = 'sqlite:///'
+    if not db_url.startswith(prefix):
+        raise ValueError(f'Index path can be derived only from SQLite url, got {db_url}')
+    return path.splitext(db_url[len(prefix):])[0] + INDEX_SUFFIX
+
+
+def match_expression(lemmas: Sequence[str]) -> str:
+    """FTS5 query matching any of lemmas"""
+    unique = dict.fromkeys(lemmas)
+    return ' OR '.join('"' + lemma.replace('"', '""') + '"' for lemma in unique)
+
+
+class LexicalIndex(object):
+    """
+    FTS5 index of question lemmas with BM25 top-k queries
+    """
+    def __init__(self, index_path: str, analyzer_name: str = 'mystem', analyzer: Optional[Analyzer] = None):
+        """
+        Args:
+            index_path: SQLite file of the index
+            analyzer_name: 'words' or lemmatizer backend, it is saved in the index and must be the same on reopen
+            analyzer: function returning tokens of texts, built from ``analyzer_name`` if not given
+        """
+        self.index_path = index_path
+        self.analyzer_name = analyzer_name
+        self._analyzer = analyzer
+        self.conn = sqlite3.connect(index_path, check_same_thread=False)
+        self.conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS question_lemmas USING fts5(lemmas)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'analyzer'").fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO meta VALUES ('analyzer', ?)", (analyzer_name,))
+            self.conn.commit()
+        elif row[0] != analyzer_name:
+            raise IndexMismatchError(f'Index {index_path} was built with {row[0]} analyzer, not {analyzer_name}')
+
+    @property
+    def analyzer(self) -> Analyzer:
+        # Lemmatizer is started only when texts are analyzed
+        if self._analyzer is None:
+            self._analyzer = get_analyzer(self.analyzer_name)
+        return self._analyzer
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT count(*) FROM question_lemmas').fetchone()[0]
+
+    def last_id(self) -> int:
+        """The greatest indexed question id (0 for empty index)"""
+        return self.conn.execute('SELECT coalesce(max(rowid), 0) FROM question_lemmas').fetchone()[0]
+
+    def add(self, ids: Sequence[int], texts: Sequence[str]) -> int:
+        """Index (or re-index) questions, returns the number of added questions"""
+        lemmas = self.analyzer(texts)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO question_lemmas (rowid, lemmas) VALUES (?, ?)',
+                ((int(q_id), ' '.join(q_lemmas)) for q_id, q_lemmas in zip(ids, lemmas))
+            )
+        return len(lemmas)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        with self.conn:
+            self.conn.executemany('DELETE FROM question_lemmas WHERE rowid = ?', ((int(q_id),) for q_id in ids))
+
+    def update_from_db(self, engine, batch_size: int = BATCH_SIZE) -> int:
+        """Index questions of the database with ids greater than the last indexed one
+
+        Returns:
+            Number of added questions
+        """
+        stmt = select(Question.id, Question.text).where(Question.id > self.last_id()).order_by(Question.id)
+        n_added = 0
+        with engine.connect() as conn:
+            for rows in conn.execution_options(stream_results=True).execute(stmt).partitions(batch_size):
+                n_added += self.add([row[0] for row in rows], [row[1] for row in rows])
+        return n_added
+
+    def stored_lemmas(self, ids: Sequence[int]) -> Dict[int, List[str]]:
+        """Indexed lemmas of questions, questions absent in the index are skipped"""
+        result = {}
+        for q_id in ids:
+            row = self.conn.execute('SELECT lemmas FROM question_lemmas WHERE rowid = ?', (int(q_id),)).fetchone()
+            if row is not None:
+                result[int(q_id)] = row[0].split()
+        return result
+
+    def query_lemmas(self, lemmas: Sequence[str], k: int = TOP_K,
+                     exclude_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """k questions with the highest BM25 score for lemmas, scores are positive"""
+        if len(lemmas) == 0:
+            return []
+        rows = self.conn.execute(
+            'SELECT rowid, -bm25(question_lemmas) FROM question_lemmas WHERE question_lemmas MATCH ? '
+            'AND rowid != ? ORDER BY bm25(question_lemmas) LIMIT ?',
+            (match_expression(lemmas), -1 if exclude_id is None else int(exclude_id), k)
+        )
+        return rows.fetchall()
+
+    def _topk(self, left_ids: Sequence[int], lemmas: Sequence[Sequence[str]], k: int,
+              exclude_self: bool) -> PairChunk:
+        left, right, scores = [], [], []
+        for left_id, q_lemmas in zip(left_ids, lemmas):
+            for right_id, score in self.query_lemmas(q_lemmas, k, left_id if exclude_self else None):
+                left.append(left_id)
+                right.append(right_id)
+                scores.append(score)
+        return np.array(left, dtype=np.int64), np.array(right, dtype=np.int64), np.array(scores, dtype=np.float32)
+
+    def topk(self, ids: Sequence[int], texts: Sequence[str], k: int = TOP_K) -> PairChunk:
+        """k lexical neighbours of arbitrary texts (questions with the same ids are excluded)
+
+        Returns:
+            (left_ids, right_ids, BM25 scores) chunk, neighbours of every question are sorted by score
+        """
+        return self._topk(ids, self.analyzer(texts), k, exclude_self=True)
+
+    def topk_for_ids(self, ids: Sequence[int], k: int = TOP_K) -> PairChunk:
+        """k lexical neighbours of indexed questions, lemmas are taken from the index"""
+        lemmas = self.stored_lemmas(ids)
+        return self._topk(list(lemmas), list(lemmas.values()), k, exclude_self=True)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def combine_scores(left_ids: np.ndarray, right_ids: np.ndarray, lexical_scores: np.ndarray,
+                   ids: np.ndarray, embeddings: np.ndarray, lexical_weight: float = LEXICAL_WEIGHT) -> np.ndarray:
+    """Weighted sum of cosine similarity and BM25 score normalized by the best score of the left question
+
+    Args:
+        left_ids, right_ids, lexical_scores: lexical neighbours chunk
+        ids, embeddings: question ids and corresponding embeddings, all ids of pairs must be present
+    """
+    order = np.argsort(ids, kind='stable')
+    left_rows = order[np.searchsorted(ids, left_ids, sorter=order)]
+    right_rows = order[np.searchsorted(ids, right_ids, sorter=order)]
+    left_emb, right_emb = embeddings[left_rows], embeddings[right_rows]
+    dense = np.sum(left_emb * right_emb, axis=1) / np.maximum(
+        np.linalg.norm(left_emb, axis=1) * np.linalg.norm(right_emb, axis=1), 1e-8
+    )
+    best = pd.Series(lexical_scores).groupby(left_ids).transform('max').to_numpy()
+    lexical = lexical_scores / np.maximum(best, 1e-8)
+    return lexical_weight * lexical + (1 - lexical_weight) * dense
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update lexical index of questions and search lexical neighbours')
+    parser.add_argument('--db-url', default='sqlite:///scraping/questions.db', help='SQLAlchemy database url')
+    parser.add_argument('--index', help='Index file, next to SQLite database by default')
+    parser.add_argument('--analyzer', default='mystem', help="Lemmatizer backend or 'words'")
+    parser.add_argument('--topk-out', help='CSV file for lexical neighbours of newly indexed questions')
+    parser.add_argument('--k', type=int, default=TOP_K, help='Number of neighbours')
+    parser.add_argument('--all', action='store_true', help='Search neighbours of all indexed questions')
+    args = parser.parse_args()
+
+    index = LexicalIndex(args.index or index_path_for(args.db_url), args.analyzer)
+    first_new_id = index.last_id() + 1
+    start = time.perf_counter()
+    n_new = index.update_from_db(create_engine(args.db_url))
+    print(f'{n_new} questions are indexed in {time.perf_counter() - start:.1f} s, {len(index)} in total')
+
+    if args.topk_out is not None:
+        min_id = 0 if args.all else first_new_id
+        query_ids = [row[0] for row in index.conn.execute(
+            'SELECT rowid FROM question_lemmas WHERE rowid >= ? ORDER BY rowid', (min_id,)
+        )]
+        chunks = [index.topk_for_ids(query_ids[i:i + BATCH_SIZE], args.k) for i in range(0, len(query_ids), BATCH_SIZE)]
+        pd.DataFrame({
+            'left_id': np.concatenate([c[0] for c in chunks]) if chunks else [],
+            'right_id': np.concatenate([c[1] for c in chunks]) if chunks else [],
+            'score': np.concatenate([c[2] for c in chunks]) if chunks else [],
+        }).to_csv(args.topk_out, sep=';', index=False)
+    index.close()
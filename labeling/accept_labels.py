@@ -4,9 +4,10 @@ import numpy as np
 import argparse
 from datetime import datetime, timedelta
 from warnings import warn
-from sys import stdin, stdout
+from sys import stdin, stdout, stderr
 from typing import Sequence, Tuple, Generator, Union
 
+from utils.agreement import agreement_report
 from utils.download import get_q_text
 
 
@@ -108,6 +109,11 @@ if __name__ == '__main__':
         action='store_true',
         help='Convert output to format expected by Toloka'
     )
+    parser.add_argument(
+        '--agreement',
+        action='store_true',
+        help='Print inter-annotator agreement and golden tasks accuracy to stderr'
+    )
     args = parser.parse_args()
 
     if args.input is None:
@@ -115,6 +121,8 @@ if __name__ == '__main__':
     else:
         in_f = args.input
     ans = pd.read_csv(in_f, sep='\t')
+    if args.agreement:
+        print(agreement_report(ans), file=stderr)
 
     if 'ASSIGNMENT:submitted' in ans.columns:
         ans['ASSIGNMENT:submitted'] = ans['ASSIGNMENT:submitted'].apply(lambda s: datetime.fromisoformat(s))
@@ -0,0 +1,317 @@
+"""
+Question pairs dataset for paraphrase models without legacy torchtext.
+
+Token ids of left and right questions are kept in flat arrays with offsets (one pair is not a python object),
+batches are formed by length-bucketing sampler and padded by vectorized collate functions.
+Batches have the same ``text`` and ``label`` fields as torchtext batches used by trainers in model_tests notebook:
+    * cross-encoder layout (``TransformerCls``): ``text`` is (tokens, token_type_ids) of "[CLS] left [SEP] right [SEP]"
+    * siamese layout (``SiameseClf``): ``text`` is (left_tokens, right_tokens) of "[CLS] question [SEP]"
+"""
+import pandas as pd
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader, Sampler
+
+import os
+from os import path
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from utils.token_cache import TokenCache
+
+BATCH_SIZE = 32
+BUCKET_MULTIPLIER = 50
+
+
+class PairBatch(NamedTuple):
+    text: Tuple[torch.Tensor, Optional[torch.Tensor]]
+    label: torch.LongTensor
+
+    def to(self, device) -> 'PairBatch':
+        text = tuple(None if t is None else t.to(device) for t in self.text)
+        return PairBatch(text, self.label.to(device))
+
+
+def _ragged(seqs: Sequence[Sequence[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    tokens = np.fromiter((tok for seq in seqs for tok in seq), dtype=np.int32, count=int(offsets[-1]))
+    return tokens, offsets
+
+
+class PairDataset(Dataset):
+    """
+    Question pairs with labels, tokenized without special tokens
+    """
+    def __init__(self,
+                 left_tokens: np.ndarray, left_offsets: np.ndarray,
+                 right_tokens: np.ndarray, right_offsets: np.ndarray,
+                 labels: np.ndarray,
+                 left_ids: Optional[np.ndarray] = None,
+                 right_ids: Optional[np.ndarray] = None):
+        if not (len(left_offsets) == len(right_offsets) == len(labels) + 1):
+            raise ValueError('Inconsistent number of left questions, right questions and labels')
+        self.left_tokens = left_tokens
+        self.left_offsets = left_offsets
+        self.right_tokens = right_tokens
+        self.right_offsets = right_offsets
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.left_ids = left_ids
+        self.right_ids = right_ids
+
+    @classmethod
+    def from_texts(cls, tokenizer, left_texts: Sequence[str], right_texts: Sequence[str],
+                   labels: Sequence[int], **kwargs) -> 'PairDataset':
+        """Tokenize pairs by batched tokenizer calls"""
+        encode_args = dict(add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False)
+        left = _ragged(tokenizer(list(left_texts), **encode_args)['input_ids'])
+        right = _ragged(tokenizer(list(right_texts), **encode_args)['input_ids'])
+        return cls(*left, *right, np.asarray(labels), **kwargs)
+
+    @classmethod
+    def from_token_cache(cls, token_cache: TokenCache, left_ids: Sequence[int], right_ids: Sequence[int],
+                         labels: Sequence[int]) -> 'PairDataset':
+        """Take tokens of questions from the cache, tokenizer isn't called at all"""
+        left_ids = np.asarray(left_ids, dtype=np.int64)
+        right_ids = np.asarray(right_ids, dtype=np.int64)
+        return cls(
+            *token_cache.ragged(left_ids), *token_cache.ragged(right_ids),
+            np.asarray(labels), left_ids=left_ids, right_ids=right_ids
+        )
+
+    @classmethod
+    def from_tsv(cls, file_path: str, tokenizer=None, token_cache: Optional[TokenCache] = None,
+                 label_column: str = 'class', shuffle: bool = False, seed: Optional[int] = None) -> 'PairDataset':
+        """Load dev.tsv/test.tsv-like file
+
+        File must contain 'left_id', 'right_id' columns (if token cache is used)
+        or 'left_text', 'right_text' columns (if tokenizer is used) and label column.
+        Rows with missing values are dropped.
+        """
+        df = pd.read_csv(file_path, sep='\t').dropna()
+        if shuffle:
+            df = df.sample(frac=1., random_state=seed)
+        labels = df[label_column].to_numpy(dtype=np.int64)
+        if token_cache is not None:
+            return cls.from_token_cache(token_cache, df['left_id'].to_numpy(), df['right_id'].to_numpy(), labels)
+        if tokenizer is None:
+            raise ValueError('Either tokenizer or token_cache must be given')
+
+        kwargs = {}
+        if 'left_id' in df.columns and 'right_id' in df.columns:
+            kwargs = {'left_ids': df['left_id'].to_numpy(), 'right_ids': df['right_id'].to_numpy()}
+        return cls.from_texts(tokenizer, df['left_text'].tolist(), df['right_text'].tolist(), labels, **kwargs)
+
+    _ARRAYS = ('left_tokens', 'left_offsets', 'right_tokens', 'right_offsets', 'labels', 'left_ids', 'right_ids')
+
+    def save(self, dir_path: str) -> None:
+        """Save arrays as .npy files, so the dataset can be memory-mapped by several processes"""
+        os.makedirs(dir_path, exist_ok=True)
+        for name in self._ARRAYS:
+            arr = getattr(self, name)
+            if arr is not None:
+                np.save(path.join(dir_path, f'{name}.npy'), arr)
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True) -> 'PairDataset':
+        mmap_mode = 'r' if mmap else None
+        arrays = {}
+        for name in cls._ARRAYS:
+            file_path = path.join(dir_path, f'{name}.npy')
+            arrays[name] = np.load(file_path, mmap_mode=mmap_mode) if path.isfile(file_path) else None
+        return cls(**arrays)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, i: int) -> int:
+        # Batches are assembled by collate function directly from flat arrays
+        return i
+
+    @property
+    def left_lengths(self) -> np.ndarray:
+        return np.diff(self.left_offsets)
+
+    @property
+    def right_lengths(self) -> np.ndarray:
+        return np.diff(self.right_offsets)
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler, which groups examples of similar length.
+    For training, examples are shuffled, split into buckets of ``batch_size * bucket_multiplier`` examples,
+    sorted by length inside a bucket, and resulting batches are shuffled.
+    For evaluation (shuffle=False) all examples are sorted by length.
+    """
+    def __init__(self, lengths: Sequence[int], batch_size: int = BATCH_SIZE, shuffle: bool = True,
+                 bucket_multiplier: int = BUCKET_MULTIPLIER, seed: Optional[int] = None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_multiplier = bucket_multiplier
+        self.rnd = np.random.RandomState(seed)
+
+    def __len__(self) -> int:
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind='stable')
+            for start in range(0, len(order), self.batch_size):
+                yield order[start:start + self.batch_size].tolist()
+            return
+
+        perm = self.rnd.permutation(len(self.lengths))
+        bucket_size = self.batch_size * self.bucket_multiplier
+        batches = []
+        for start in range(0, len(perm), bucket_size):
+            bucket = perm[start:start + bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        for batch_i in self.rnd.permutation(len(batches)):
+            yield batches[batch_i].tolist()
+
+
+def _gather(tokens: np.ndarray, offsets: np.ndarray, idx: np.ndarray,
+            max_len: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Flat tokens and lengths of selected sequences (optionally truncated)"""
+    starts = offsets[idx]
+    lengths = offsets[idx + 1] - starts
+    if max_len is not None:
+        lengths = np.minimum(lengths, max_len)
+    shifts = np.zeros(len(idx), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=shifts[1:])
+    flat_idx = np.repeat(starts - shifts, lengths) + np.arange(lengths.sum())
+    return np.asarray(tokens[flat_idx]), lengths
+
+
+def _scatter(pieces: Sequence[Tuple[np.ndarray, np.ndarray]], n: int, pad_index: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate pieces of every example and pad into matrix
+
+    Args:
+        pieces: list of (flat values, lengths) for consecutive parts of examples
+        n: number of examples
+        pad_index: padding value
+
+    Returns:
+        Padded matrix and number of the piece for every cell (-1 for padding)
+    """
+    total_len = np.zeros(n, dtype=np.int64)
+    for _, lengths in pieces:
+        total_len += lengths
+    matrix = np.full((n, int(total_len.max())), pad_index, dtype=np.int64)
+    piece_num = np.full(matrix.shape, -1, dtype=np.int64)
+
+    shift = np.zeros(n, dtype=np.int64)
+    for piece_i, (values, lengths) in enumerate(pieces):
+        rows = np.repeat(np.arange(n), lengths)
+        starts = np.zeros(n, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        cols = np.arange(len(values)) - np.repeat(starts, lengths) + np.repeat(shift, lengths)
+        matrix[rows, cols] = values
+        piece_num[rows, cols] = piece_i
+        shift += lengths
+    return matrix, piece_num
+
+
+class CrossEncoderCollator(object):
+    """
+    Builds "[CLS] left [SEP] right [SEP]" batches with token type ids (``TransformerCls`` layout)
+    """
+    def __init__(self, dataset: PairDataset, cls_index: int, sep_index: int, pad_index: int,
+                 max_length: int = 512, token_type_ids: bool = True):
+        self.dataset = dataset
+        self.cls_index = cls_index
+        self.sep_index = sep_index
+        self.pad_index = pad_index
+        # Every question is truncated to a half of available length
+        self.max_question_len = (max_length - 3) // 2
+        self.token_type_ids = token_type_ids
+
+    @classmethod
+    def from_tokenizer(cls, dataset: PairDataset, tokenizer, **kwargs) -> 'CrossEncoderCollator':
+        return cls(dataset, tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id, **kwargs)
+
+    def __call__(self, idx: Sequence[int]) -> PairBatch:
+        idx = np.asarray(idx, dtype=np.int64)
+        n = len(idx)
+        ds = self.dataset
+        ones = np.ones(n, dtype=np.int64)
+        left = _gather(ds.left_tokens, ds.left_offsets, idx, self.max_question_len)
+        right = _gather(ds.right_tokens, ds.right_offsets, idx, self.max_question_len)
+        matrix, piece_num = _scatter([
+            (np.full(n, self.cls_index), ones),
+            left,
+            (np.full(n, self.sep_index), ones),
+            right,
+            (np.full(n, self.sep_index), ones),
+        ], n, self.pad_index)
+
+        token_types = None
+        if self.token_type_ids:
+            token_types = torch.from_numpy((piece_num >= 3).astype(np.int64))
+        return PairBatch((torch.from_numpy(matrix), token_types), torch.from_numpy(ds.labels[idx]))
+
+
+class SiameseCollator(object):
+    """
+    Builds separately padded "[CLS] question [SEP]" batches for left and right questions (``SiameseClf`` layout)
+    """
+    def __init__(self, dataset: PairDataset, cls_index: int, sep_index: int, pad_index: int,
+                 max_length: int = 512):
+        self.dataset = dataset
+        self.cls_index = cls_index
+        self.sep_index = sep_index
+        self.pad_index = pad_index
+        self.max_question_len = max_length - 2
+
+    @classmethod
+    def from_tokenizer(cls, dataset: PairDataset, tokenizer, **kwargs) -> 'SiameseCollator':
+        sep_index = tokenizer.eos_token_id if tokenizer.eos_token_id is not None else tokenizer.sep_token_id
+        return cls(dataset, tokenizer.cls_token_id, sep_index, tokenizer.pad_token_id, **kwargs)
+
+    def _side(self, tokens: np.ndarray, offsets: np.ndarray, idx: np.ndarray) -> torch.LongTensor:
+        n = len(idx)
+        ones = np.ones(n, dtype=np.int64)
+        matrix, _ = _scatter([
+            (np.full(n, self.cls_index), ones),
+            _gather(tokens, offsets, idx, self.max_question_len),
+            (np.full(n, self.sep_index), ones),
+        ], n, self.pad_index)
+        return torch.from_numpy(matrix)
+
+    def __call__(self, idx: Sequence[int]) -> PairBatch:
+        idx = np.asarray(idx, dtype=np.int64)
+        ds = self.dataset
+        left = self._side(ds.left_tokens, ds.left_offsets, idx)
+        right = self._side(ds.right_tokens, ds.right_offsets, idx)
+        return PairBatch((left, right), torch.from_numpy(ds.labels[idx]))
+
+
+def make_loader(dataset: PairDataset, collator, batch_size: int = BATCH_SIZE, shuffle: bool = True,
+                num_workers: int = 0, seed: Optional[int] = None, siamese: bool = False) -> DataLoader:
+    """Create data loader with length bucketing
+
+    Args:
+        dataset: pairs dataset
+        collator: ``CrossEncoderCollator`` or ``SiameseCollator``
+        batch_size: number of pairs in a batch
+        shuffle: shuffle batches (training mode), otherwise pairs are sorted by length
+        num_workers: number of loader worker processes
+        seed: sampler seed
+        siamese: sort by the longest question of a pair instead of total pair length
+    """
+    if siamese:
+        lengths = np.maximum(dataset.left_lengths, dataset.right_lengths)
+    else:
+        lengths = dataset.left_lengths + dataset.right_lengths
+    sampler = LengthBucketSampler(lengths, batch_size, shuffle=shuffle, seed=seed)
+    # Sampler yields lists of indexes, so every "example" passed to collate is an index
+    return DataLoader(
+        dataset,
+        batch_sampler=sampler,
+        collate_fn=collator,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+    )
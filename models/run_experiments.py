@@ -0,0 +1,242 @@
+"""
+Parallel runner of model_tests experiments: every configuration is trained once per seed.
+
+Datasets are tokenized once per tokenizer and saved as .npy arrays, worker processes memory-map them read-only.
+Jobs (configuration, seed) run in a pool of processes with a fixed number of torch threads per job.
+Test metrics of finished jobs are appended to the results CSV, so rerun skips them.
+
+Configurations file is a JSON list of objects with keys of notebook trial configs, e.g.:
+    [{"name": "rubert", "model_name": "DeepPavlov/rubert-base-cased", "trainer": "paraphraser",
+      "LR": 1e-5, "Dropout rate": 0.1, "Freezed layers": 0, "Epochs": 3, "Semi-positive class prob": 0.5}]
+
+Example:
+    python -m models.run_experiments configs.json paraphrases.xml dev.tsv test.tsv results.csv --jobs 4
+"""
+import pandas as pd
+import numpy as np
+import torch
+from torch import nn
+from parsel import Selector
+from transformers import AutoTokenizer
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path
+from typing import Callable, List, MutableMapping, Optional, Sequence
+
+from models.dataset import PairDataset, CrossEncoderCollator, make_loader, BATCH_SIZE
+from models.trainer import Trainer, ParaphraserTrainer
+from models.transformer import TransformerCls
+from utils.embedding import set_torch_threads
+
+SEEDS = [42, 10, 173, 164, 34]
+RESULT_COLUMNS = ['config', 'seed', 'accuracy', 'f1', 'roc_auc', 'val_accuracy']
+
+
+def read_paraphraser_xml(file_path: str) -> pd.DataFrame:
+    """Paraphraser corpus as DataFrame with 'left_text', 'right_text', 'class' columns
+
+    Classes are shifted to 0..2 like in the notebook.
+    """
+    with open(file_path) as f:
+        selector = Selector(text=f.read())
+    rows = []
+    for pair in selector.xpath('//corpus/paraphrase'):
+        rows.append((
+            pair.xpath('value[@name="text_1"]/text()').get(),
+            pair.xpath('value[@name="text_2"]/text()').get(),
+            int(pair.xpath('value[@name="class"]/text()').get()) + 1
+        ))
+    return pd.DataFrame(rows, columns=['left_text', 'right_text', 'class'])
+
+
+def _read_pairs(file_path: str) -> pd.DataFrame:
+    if file_path.endswith('.xml'):
+        return read_paraphraser_xml(file_path)
+    return pd.read_csv(file_path, sep='\t').dropna()
+
+
+def prepare_datasets(tokenizer, data_dir: str, files: MutableMapping[str, str]) -> None:
+    """Tokenize every file once and save datasets into ``data_dir/<name>``"""
+    for name, file_path in files.items():
+        if path.isfile(path.join(data_dir, name, 'labels.npy')):
+            continue
+        df = _read_pairs(file_path)
+        dataset = PairDataset.from_texts(
+            tokenizer, df['left_text'].tolist(), df['right_text'].tolist(), df['class'].to_numpy()
+        )
+        dataset.save(path.join(data_dir, name))
+
+
+def binary_metrics(labels: np.ndarray, preds: np.ndarray, scores: np.ndarray) -> MutableMapping[str, float]:
+    """Accuracy, F1 and ROC-AUC of binary classification"""
+    labels = np.asarray(labels)
+    preds = np.asarray(preds)
+    tp = np.sum((preds == 1) & (labels == 1))
+    fp = np.sum((preds == 1) & (labels == 0))
+    fn = np.sum((preds == 0) & (labels == 1))
+    f1 = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn > 0 else 0.
+
+    # Mann-Whitney U statistic with average ranks of ties
+    n_pos = np.sum(labels == 1)
+    n_neg = len(labels) - n_pos
+    roc_auc = float('nan')
+    if n_pos > 0 and n_neg > 0:
+        ranks = pd.Series(scores).rank().to_numpy()
+        roc_auc = (ranks[labels == 1].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+    return {
+        'accuracy': float(np.mean(preds == labels)),
+        'f1': float(f1),
+        'roc_auc': float(roc_auc)
+    }
+
+
+def _seed_everything(seed: int) -> None:
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def run_job(config: MutableMapping, seed: int, data_dir: str, n_threads: int) -> MutableMapping:
+    """Train one configuration with one seed and compute test metrics"""
+    set_torch_threads(n_threads)
+    _seed_everything(seed)
+
+    tokenizer = AutoTokenizer.from_pretrained(config['model_name'], use_fast=True)
+    datasets = {name: PairDataset.load(path.join(data_dir, name)) for name in ('train', 'dev', 'test')}
+    batch_size = config.get('batch_size', BATCH_SIZE)
+    loaders = {
+        name: make_loader(
+            dataset, CrossEncoderCollator.from_tokenizer(dataset, tokenizer),
+            batch_size=batch_size, shuffle=name == 'train', seed=seed
+        )
+        for name, dataset in datasets.items()
+    }
+
+    model = TransformerCls(
+        config['model_name'],
+        2,
+        dropout=config['Dropout rate'],
+        freeze=config['Freezed layers'],
+    )
+    trainer_kwargs = dict(
+        pad_index=tokenizer.pad_token_id,
+        silent=True,
+        bf16=config.get('bf16', False),
+        accumulation_steps=config.get('accumulation_steps', 1),
+        patience=config.get('patience'),
+    )
+    if config.get('trainer', 'paraphraser') == 'paraphraser':
+        trainer = ParaphraserTrainer(p=config['Semi-positive class prob'], **trainer_kwargs)
+    else:
+        trainer = Trainer(**trainer_kwargs)
+
+    criterion = nn.CrossEntropyLoss()
+    optim = torch.optim.Adam(model.parameters(), lr=config['LR'])
+    trainer.train(model, loaders['train'], loaders['dev'], criterion, optim, total_epochs=config['Epochs'])
+
+    val_log = trainer.validate(model, loaders['dev'])
+    labels, preds, scores = trainer.predict(model, loaders['test'])
+    return {
+        'config': config['name'],
+        'seed': seed,
+        **binary_metrics(labels, preds, scores),
+        'val_accuracy': val_log.get('accuracy', float('nan'))
+    }
+
+
+def _tokenizer_data_dir(work_dir: str, model_name: str) -> str:
+    return path.join(work_dir, model_name.replace('/', '__'))
+
+
+def run_experiments(configs: List[MutableMapping], files: MutableMapping[str, str], results_path: str,
+                    work_dir: str, seeds: Sequence[int] = SEEDS,
+                    n_jobs: int = 1, threads_per_job: Optional[int] = None,
+                    job: Callable[..., MutableMapping] = run_job) -> pd.DataFrame:
+    """Run all (configuration, seed) jobs, which aren't in the results file yet
+
+    A failed job is reported and skipped, results of other jobs are still written, so rerun retries only
+    failed jobs.
+
+    Args:
+        configs: trial configurations, each must have unique 'name' and 'model_name'
+        files: paths of 'train', 'dev' and 'test' data files
+        results_path: CSV file with test metrics of every job
+        work_dir: directory for tokenized datasets
+        seeds: random seeds
+        n_jobs: number of parallel processes
+        threads_per_job: torch threads of one job, CPU cores are divided equally by default
+        job: function, which trains one configuration with one seed (``run_job`` signature)
+
+    Returns:
+        Results of all jobs
+    """
+    if len({config['name'] for config in configs}) < len(configs):
+        raise ValueError('Configuration names must be unique')
+    if threads_per_job is None:
+        threads_per_job = max(1, (os.cpu_count() or 1) // n_jobs)
+
+    for model_name in {config['model_name'] for config in configs}:
+        tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        prepare_datasets(tokenizer, _tokenizer_data_dir(work_dir, model_name), files)
+
+    done = set()
+    if path.isfile(results_path):
+        results = pd.read_csv(results_path)
+        done = set(zip(results['config'], results['seed']))
+    else:
+        pd.DataFrame(columns=RESULT_COLUMNS).to_csv(results_path, index=False)
+
+    jobs = [(config, seed) for config in configs for seed in seeds if (config['name'], seed) not in done]
+    if len(jobs) > 0:
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(jobs)), mp_context=ctx) as executor:
+            futures = {
+                executor.submit(job, config, seed, _tokenizer_data_dir(work_dir, config['model_name']),
+                                threads_per_job): (config['name'], seed)
+                for config, seed in jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    name, seed = futures[future]
+                    print(f'{name} (seed {seed}) failed: {e!r}')
+                    continue
+                print(f'{row["config"]} (seed {row["seed"]}): accuracy {row["accuracy"]:.4f}, '
+                      f'F1 {row["f1"]:.4f}, ROC-AUC {row["roc_auc"]:.4f}')
+                pd.DataFrame([row], columns=RESULT_COLUMNS).to_csv(results_path, mode='a', header=False, index=False)
+
+    return pd.read_csv(results_path)
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Mean and standard deviation of metrics over seeds"""
+    return results.groupby('config')[['accuracy', 'f1', 'roc_auc', 'val_accuracy']].agg(['mean', 'std'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train model configurations with several seeds in parallel')
+    parser.add_argument('configs', help='JSON file with list of trial configurations')
+    parser.add_argument('train', help='Train set: paraphrases.xml or TSV in dev.tsv format')
+    parser.add_argument('dev', help='Validation TSV')
+    parser.add_argument('test', help='Test TSV')
+    parser.add_argument('results', help='Results CSV, finished jobs are skipped')
+    parser.add_argument('--work-dir', default='experiments_data', help='Directory for tokenized datasets')
+    parser.add_argument('--seeds', type=int, nargs='+', default=SEEDS, help='Random seeds')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of parallel processes')
+    parser.add_argument('--threads-per-job', type=int, help='Torch threads of one job')
+    args = parser.parse_args()
+
+    with open(args.configs) as f:
+        trial_configs = json.load(f)
+    all_results = run_experiments(
+        trial_configs, {'train': args.train, 'dev': args.dev, 'test': args.test},
+        args.results, args.work_dir,
+        seeds=args.seeds, n_jobs=args.jobs, threads_per_job=args.threads_per_job
+    )
+    print(summarize(all_results).to_string())
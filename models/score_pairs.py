@@ -0,0 +1,249 @@
+"""
+Scoring of candidate question pairs by trained paraphrase model on CPU.
+
+Input TSV (dev.tsv/test.tsv layout without labels) is read by chunks, every chunk is tokenized by one call
+of the fast tokenizer, and pairs are grouped into batches by number of tokens.
+Probabilities are appended to the output TSV after every chunk, progress is recorded in ``<output>.progress.json``,
+so interrupted scoring continues from the last finished chunk. Progress file records the input file and the model,
+scoring isn't continued if any of them was changed.
+
+Example:
+    python -m models.score_pairs candidates.tsv scores.tsv --model DeepPavlov/rubert-base-cased \
+        --checkpoint paraphraser.pt --arch cross --threads 16 --quantize
+"""
+import pandas as pd
+import numpy as np
+import torch
+from torch import nn
+from transformers import AutoTokenizer
+
+import argparse
+import json
+import os
+import time
+from typing import MutableMapping, Optional
+
+from models.dataset import PairDataset, CrossEncoderCollator
+from models.siamese_cache import SiameseScorer, EmbeddingCache, CACHE_SIZE
+from models.transformer import TransformerCls, SiameseClf
+from utils.atomic_write import atomic_write_json
+from utils.embedding import token_budget_batches, set_torch_threads, MAX_TOKENS, MAX_BATCH_SIZE
+from utils.token_cache import TokenCache
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+CHUNK_SIZE = 50_000
+OUTPUT_COLUMNS = ['left_id', 'right_id', 'prob']
+
+
+class PairScorer(object):
+    """
+    Probability of paraphrase class for question pairs by ``TransformerCls`` or ``SiameseClf``
+    """
+    def __init__(self, model: nn.Module, tokenizer, token_cache: Optional[TokenCache] = None,
+                 positive_class: int = 1, max_tokens: int = MAX_TOKENS, max_length: int = 512,
+                 cache_size: int = CACHE_SIZE):
+        """
+        Args:
+            model: trained model in eval mode
+            tokenizer: tokenizer of the model
+            token_cache: if given, token ids of questions are taken from the cache instead of texts
+            positive_class: index of paraphrase class
+            max_tokens: tokens budget of one batch
+            max_length: maximum length of model input
+            cache_size: number of question embeddings kept in memory (siamese model only)
+        """
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.token_cache = token_cache
+        self.positive_class = positive_class
+        self.max_tokens = max_tokens
+        self.max_length = max_length
+        self.siamese = None
+        if isinstance(model, SiameseClf):
+            self.siamese = SiameseScorer.from_tokenizer(
+                model, tokenizer,
+                cache=EmbeddingCache(model.output_size, cache_size),
+                max_tokens=max_tokens, max_length=max_length
+            )
+
+    def _dataset(self, chunk: pd.DataFrame) -> PairDataset:
+        labels = np.zeros(len(chunk), dtype=np.int64)
+        left_ids = chunk['left_id'].to_numpy(dtype=np.int64)
+        right_ids = chunk['right_id'].to_numpy(dtype=np.int64)
+        if self.token_cache is not None:
+            return PairDataset.from_token_cache(self.token_cache, left_ids, right_ids, labels)
+        return PairDataset.from_texts(
+            self.tokenizer, chunk['left_text'].tolist(), chunk['right_text'].tolist(), labels,
+            left_ids=left_ids, right_ids=right_ids
+        )
+
+    @torch.no_grad()
+    def score(self, chunk: pd.DataFrame) -> np.ndarray:
+        """Paraphrase probabilities of pairs of the chunk"""
+        if len(chunk) == 0:
+            return np.empty(0, dtype=np.float32)
+        dataset = self._dataset(chunk)
+        if self.siamese is not None:
+            return self.siamese.score_dataset(dataset)[:, self.positive_class]
+
+        collator = CrossEncoderCollator.from_tokenizer(dataset, self.tokenizer, max_length=self.max_length)
+        lengths = np.minimum(dataset.left_lengths, collator.max_question_len) \
+            + np.minimum(dataset.right_lengths, collator.max_question_len) + 3
+        result = np.empty(len(dataset), dtype=np.float32)
+        for batch in token_budget_batches(lengths, self.max_tokens, MAX_BATCH_SIZE):
+            tokens, token_type_ids = collator(batch).text
+            mask = (tokens != collator.pad_index).float()
+            output = self.model(tokens, mask, token_type_ids)
+            result[batch] = torch.softmax(output.float(), dim=1)[:, self.positive_class].numpy()
+        return result
+
+
+def _load_progress(progress_path: str) -> dict:
+    if not os.path.isfile(progress_path):
+        return {'rows_done': 0, 'out_bytes': 0}
+    with open(progress_path) as f:
+        return json.load(f)
+
+
+def _file_signature(file_path: str) -> dict:
+    """Path, size and modification time of a file"""
+    stat = os.stat(file_path)
+    return {'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def score_file(scorer: PairScorer, input_path: str, output_path: str,
+               chunk_size: int = CHUNK_SIZE, silent: bool = False,
+               model_info: Optional[MutableMapping] = None) -> int:
+    """Score all pairs of input TSV and write probabilities into output TSV
+
+    Args:
+        scorer: pair scorer
+        input_path: TSV with 'left_id', 'right_id' (and 'left_text', 'right_text' without token cache) columns
+        output_path: TSV with 'left_id', 'right_id', 'prob' columns
+        chunk_size: number of pairs scored and written at once
+        silent: don't show progress
+        model_info: JSON-serializable description of the model (name, checkpoint, etc.),
+            interrupted scoring is continued only with the same model
+
+    Returns:
+        Number of pairs scored by this call
+
+    Raises:
+        ValueError: if progress file was written for another input file or model
+    """
+    progress_path = output_path + '.progress.json'
+    progress = _load_progress(progress_path)
+    rows_done = progress['rows_done']
+    sources = {'input': _file_signature(input_path), 'model': model_info}
+    for key, value in sources.items():
+        if rows_done > 0 and progress.get(key) != value:
+            raise ValueError(f'{progress_path} was written for another {key}: {progress.get(key)}, '
+                             f'remove it to start scoring from the beginning')
+    progress.update(sources)
+    if rows_done > 0 and (not os.path.isfile(output_path) or os.path.getsize(output_path) < progress['out_bytes']):
+        # Output was deleted or truncated after the checkpoint, scored rows are lost
+        if not silent:
+            print(f'{output_path} is shorter than recorded in {progress_path}, scoring is started from the beginning')
+        progress = {'rows_done': 0, 'out_bytes': 0, **sources}
+        rows_done = 0
+
+    if rows_done == 0:
+        with open(output_path, 'w') as f:
+            f.write('\t'.join(OUTPUT_COLUMNS) + '\n')
+        progress['out_bytes'] = os.path.getsize(output_path)
+    else:
+        # Drop rows, which were written after the last saved checkpoint
+        with open(output_path, 'r+b') as f:
+            f.truncate(progress['out_bytes'])
+
+    usecols = ['left_id', 'right_id']
+    if scorer.token_cache is None:
+        usecols += ['left_text', 'right_text']
+    reader = pd.read_csv(
+        input_path, sep='\t', usecols=usecols, chunksize=chunk_size,
+        skiprows=range(1, rows_done + 1)
+    )
+
+    n_scored = 0
+    start = time.perf_counter()
+    pbar = None if silent else tqdm(unit='pair', initial=rows_done)
+    for chunk in reader:
+        n_rows = len(chunk)
+        chunk = chunk.dropna()
+        probs = scorer.score(chunk)
+        out = pd.DataFrame({'left_id': chunk['left_id'].to_numpy(), 'right_id': chunk['right_id'].to_numpy(),
+                            'prob': probs})
+        with open(output_path, 'a') as f:
+            out.to_csv(f, sep='\t', header=False, index=False, float_format='%.6f')
+            f.flush()
+            os.fsync(f.fileno())
+
+        progress['rows_done'] += n_rows
+        progress['out_bytes'] = os.path.getsize(output_path)
+        atomic_write_json(progress_path, progress)
+        n_scored += len(chunk)
+        if pbar is not None:
+            pbar.update(n_rows)
+            pbar.set_postfix(pairs_per_sec=f'{n_scored / (time.perf_counter() - start):.1f}')
+
+    if pbar is not None:
+        pbar.close()
+        elapsed = time.perf_counter() - start
+        print(f'{n_scored} pairs are scored in {elapsed:.1f} s ({n_scored / max(elapsed, 1e-9):.1f} pairs/s)')
+    return n_scored
+
+
+def load_model(model_name: str, arch: str, checkpoint: Optional[str] = None,
+               num_classes: int = 2, quantize: bool = False) -> nn.Module:
+    """Create model of given architecture and load trained weights (state dict) into it"""
+    model_cls = {'cross': TransformerCls, 'siamese': SiameseClf}[arch]
+    model = model_cls(model_name, num_classes)
+    if checkpoint is not None:
+        model.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+    model.eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score question pairs by trained paraphrase model on CPU')
+    parser.add_argument('input', help="TSV with 'left_id', 'right_id', 'left_text', 'right_text' columns")
+    parser.add_argument('output', help='Output TSV, scoring is continued if progress file exists')
+    parser.add_argument('--model', required=True, help='HuggingFace model name of the base transformer')
+    parser.add_argument('--checkpoint', help='Saved state dict of trained model')
+    parser.add_argument('--arch', choices=('cross', 'siamese'), default='cross',
+                        help='TransformerCls (cross) or SiameseClf (siamese)')
+    parser.add_argument('--num-classes', type=int, default=2, help='Number of model classes')
+    parser.add_argument('--positive-class', type=int, default=1, help='Index of paraphrase class')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='Number of torch threads')
+    parser.add_argument('--quantize', action='store_true', help='Use dynamic int8 quantization')
+    parser.add_argument('--max-tokens', type=int, default=MAX_TOKENS, help='Tokens budget of one batch')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Pairs written at once')
+    parser.add_argument('--token-cache', help='Root directory of token cache (texts are not needed then)')
+    args = parser.parse_args()
+
+    set_torch_threads(args.threads)
+    pair_tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
+    cache = None
+    if args.token_cache is not None:
+        cache = TokenCache(args.token_cache, pair_tokenizer.name_or_path)
+    pair_scorer = PairScorer(
+        load_model(args.model, args.arch, args.checkpoint, args.num_classes, args.quantize),
+        pair_tokenizer, token_cache=cache,
+        positive_class=args.positive_class, max_tokens=args.max_tokens
+    )
+    model_description = {
+        'model': args.model,
+        'arch': args.arch,
+        'checkpoint': None if args.checkpoint is None else _file_signature(args.checkpoint),
+        'num_classes': args.num_classes,
+        'positive_class': args.positive_class,
+        'quantize': args.quantize
+    }
+    score_file(pair_scorer, args.input, args.output, chunk_size=args.chunk_size, model_info=model_description)
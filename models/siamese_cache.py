@@ -0,0 +1,195 @@
+"""
+Inference of ``SiameseClf`` with cached question embeddings.
+
+The same question takes part in many pairs, but siamese model encodes questions independently,
+so every distinct question is passed through the transformer only once.
+Embeddings are kept by question id in LRU memory cache (optionally backed by ``EmbeddingStore`` on disk),
+pairs are scored by the classification head only.
+Cache is valid only for one model: use separate store directory for every checkpoint.
+"""
+import numpy as np
+import torch
+
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from models.dataset import PairDataset
+from models.transformer import SiameseClf
+from utils.embedding import token_budget_batches, pad_batch, MAX_TOKENS, MAX_BATCH_SIZE
+from utils.embedding_store import EmbeddingStore
+
+CACHE_SIZE = 100_000
+SCORE_BATCH_SIZE = 65536
+
+# Callable, which returns token ids (without special tokens) of questions by their ids, e.g. TokenCache.get_many
+TokensGetter = Callable[[np.ndarray], List[np.ndarray]]
+
+
+class EmbeddingCache(object):
+    """
+    LRU cache of question embeddings with optional on-disk store.
+    Evicted embeddings remain in the store, so they aren't computed again.
+    """
+    def __init__(self, dim: int, max_size: int = CACHE_SIZE, store: Optional[EmbeddingStore] = None):
+        if store is not None and store.dim != dim:
+            raise ValueError(f'Store dimension {store.dim} differs from embedding dimension {dim}')
+        self.dim = dim
+        self.max_size = max_size
+        self.store = store
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _put(self, q_id: int, emb: np.ndarray) -> None:
+        self._cache[q_id] = emb
+        self._cache.move_to_end(q_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def get(self, ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Embeddings of given questions
+
+        Returns:
+            Tuple of boolean mask of found questions and embeddings matrix (zero rows for not found ones)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        found = np.zeros(len(ids), dtype=bool)
+        result = np.zeros((len(ids), self.dim), dtype=np.float32)
+        for i, q_id in enumerate(ids.tolist()):
+            emb = self._cache.get(q_id)
+            if emb is not None:
+                self._cache.move_to_end(q_id)
+                result[i] = emb
+                found[i] = True
+
+        if self.store is not None and not found.all():
+            in_store = np.nonzero(~found)[0]
+            in_store = in_store[self.store.contains(ids[in_store])]
+            if len(in_store) > 0:
+                result[in_store] = self.store.get(ids[in_store])
+                found[in_store] = True
+                for q_id, emb in zip(ids[in_store].tolist(), result[in_store]):
+                    self._put(q_id, emb)
+
+        self.hits += int(found.sum())
+        self.misses += int(len(ids) - found.sum())
+        return found, result
+
+    def put(self, ids: Sequence[int], embeddings: np.ndarray) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        for q_id, emb in zip(ids.tolist(), embeddings):
+            self._put(q_id, emb)
+        if self.store is not None:
+            self.store.append(ids, embeddings)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class SiameseScorer(object):
+    """
+    Scores question pairs by ``SiameseClf``, each distinct question is encoded once
+    """
+    def __init__(self, model: SiameseClf, cls_index: int, sep_index: int, pad_index: int,
+                 cache: Optional[EmbeddingCache] = None,
+                 max_tokens: int = MAX_TOKENS, max_length: int = 512, device='cpu'):
+        """
+        Args:
+            model: trained siamese model
+            cls_index: [CLS] token id
+            sep_index: [SEP] token id (added after every question like in ``SiameseCollator``)
+            pad_index: padding token id
+            cache: embeddings cache, in-memory cache of default size if None
+            max_tokens: tokens budget of one encoder batch
+            max_length: questions are truncated to this number of tokens
+            device: model device
+        """
+        self.model = model.to(device).eval()
+        self.cls_index = cls_index
+        self.sep_index = sep_index
+        self.pad_index = pad_index
+        self.cache = cache if cache is not None else EmbeddingCache(model.output_size)
+        self.max_tokens = max_tokens
+        self.max_length = max_length
+        self.device = device
+
+    @classmethod
+    def from_tokenizer(cls, model: SiameseClf, tokenizer, **kwargs) -> 'SiameseScorer':
+        sep_index = tokenizer.eos_token_id if tokenizer.eos_token_id is not None else tokenizer.sep_token_id
+        return cls(model, tokenizer.cls_token_id, sep_index, tokenizer.pad_token_id, **kwargs)
+
+    @torch.no_grad()
+    def encode_tokens(self, token_ids: Sequence[np.ndarray]) -> np.ndarray:
+        """Embed questions (token ids without special tokens), order is preserved"""
+        token_ids = [
+            [self.cls_index] + np.asarray(tokens[:self.max_length - 2]).tolist() + [self.sep_index]
+            for tokens in token_ids
+        ]
+        result = np.empty((len(token_ids), self.model.output_size), dtype=np.float32)
+        lengths = [len(tokens) for tokens in token_ids]
+        for batch in token_budget_batches(lengths, self.max_tokens, MAX_BATCH_SIZE):
+            tokens, mask = pad_batch([token_ids[i] for i in batch], self.pad_index)
+            emb = self.model.encode(tokens.to(self.device), mask.to(self.device))
+            result[batch] = emb.float().cpu().numpy()
+        return result
+
+    def embed(self, ids: Sequence[int], get_tokens: TokensGetter) -> np.ndarray:
+        """Embeddings of questions, only questions absent in the cache are encoded
+
+        Args:
+            ids: question ids (may contain duplicates)
+            get_tokens: returns token ids of questions by their ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        found, embeddings = self.cache.get(unique_ids)
+        if not found.all():
+            missing = np.nonzero(~found)[0]
+            embeddings[missing] = self.encode_tokens(get_tokens(unique_ids[missing]))
+            self.cache.put(unique_ids[missing], embeddings[missing])
+        return embeddings[inverse]
+
+    @torch.no_grad()
+    def score_pairs(self, left_ids: Sequence[int], right_ids: Sequence[int], get_tokens: TokensGetter,
+                    batch_size: int = SCORE_BATCH_SIZE) -> np.ndarray:
+        """Class probabilities of question pairs
+
+        Returns:
+            Matrix of shape (number of pairs, number of classes)
+        """
+        left_ids = np.asarray(left_ids, dtype=np.int64)
+        right_ids = np.asarray(right_ids, dtype=np.int64)
+        result = []
+        for start in range(0, len(left_ids), batch_size):
+            left = self.embed(left_ids[start:start + batch_size], get_tokens)
+            right = self.embed(right_ids[start:start + batch_size], get_tokens)
+            logits = self.model.classify(
+                torch.from_numpy(left).to(self.device),
+                torch.from_numpy(right).to(self.device)
+            )
+            result.append(torch.softmax(logits.float(), dim=1).cpu().numpy())
+        if len(result) == 0:
+            return np.empty((0, self.model.clf[-1].out_features), dtype=np.float32)
+        return np.concatenate(result)
+
+    def score_dataset(self, dataset: PairDataset, batch_size: int = SCORE_BATCH_SIZE) -> np.ndarray:
+        """Class probabilities of all pairs of the dataset (dataset must contain question ids)"""
+        if dataset.left_ids is None or dataset.right_ids is None:
+            raise ValueError('Dataset must contain question ids')
+        tokens = {}
+        for ids, flat, offsets in ((dataset.left_ids, dataset.left_tokens, dataset.left_offsets),
+                                   (dataset.right_ids, dataset.right_tokens, dataset.right_offsets)):
+            for i, q_id in enumerate(np.asarray(ids).tolist()):
+                if q_id not in tokens:
+                    tokens[q_id] = flat[offsets[i]:offsets[i + 1]]
+
+        def get_tokens(q_ids: np.ndarray) -> List[np.ndarray]:
+            return [tokens[q_id] for q_id in q_ids.tolist()]
+
+        return self.score_pairs(dataset.left_ids, dataset.right_ids, get_tokens, batch_size)
@@ -0,0 +1,412 @@
+"""
+Training loops of paraphrase models from model_tests notebook.
+
+Compared to the notebook version:
+    * forward passes may run under bf16 autocast (useful on CPU with AVX512-BF16/AMX)
+    * gradients may be accumulated over several batches to increase effective batch size
+    * training stops early if validation accuracy doesn't improve for ``patience`` epochs
+    * every step is timed (data loading wait vs compute), samples/s, tokens/s and peak RSS
+      are written to a JSON lines metrics file
+
+For the fastest evaluation pass loader, which sorts pairs by length (``make_loader(..., shuffle=False)``).
+"""
+import numpy as np
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+import json
+import resource
+import sys
+import time
+from copy import deepcopy
+from typing import MutableMapping, Optional, Tuple
+
+from models.transformer import SiameseClf
+
+try:
+    import wandb
+except ModuleNotFoundError:
+    wandb = None
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in megabytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+class MetricsWriter(object):
+    """
+    Appends metrics records to JSON lines file, the file is (re)opened on the first write after closing
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = None
+
+    def __enter__(self) -> 'MetricsWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def write(self, record: MutableMapping) -> None:
+        if self._file is None:
+            self._file = open(self.file_path, 'a')
+        self._file.write(json.dumps(record) + '\n')
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _wandb_log(log: MutableMapping, step: Optional[int] = None) -> None:
+    if wandb is not None and wandb.run is not None:
+        wandb.log(log, step=step)
+
+
+class Trainer:
+    log_every = 30
+
+    def __init__(self, pad_index: Optional[int] = None, silent: bool = False,
+                 bf16: bool = False,
+                 accumulation_steps: int = 1,
+                 patience: Optional[int] = None,
+                 metrics_path: Optional[str] = None,
+                 device: Optional[torch.device] = None) -> None:
+        """
+        Args:
+            pad_index: padding token id, attention mask isn't used if None
+            silent: don't show progress bars
+            bf16: run forward passes under bfloat16 autocast
+            accumulation_steps: number of batches per optimizer step
+            patience: stop training if validation accuracy doesn't improve for this number of epochs
+            metrics_path: JSON lines file for per-step metrics
+            device: batches are moved to this device (they must have ``to`` method)
+        """
+        if accumulation_steps < 1:
+            raise ValueError('accumulation_steps must be positive')
+        self.global_step = 0
+        self.pad_index = pad_index
+        self.cur_epoch = None
+        self.silent = silent
+        self.bf16 = bf16
+        self.accumulation_steps = accumulation_steps
+        self.patience = patience
+        self.metrics = MetricsWriter(metrics_path) if metrics_path is not None else None
+        self.device = device
+
+    def autocast(self, device: torch.device):
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=self.bf16)
+
+    def mask(self, tokens: torch.LongTensor) -> Optional[torch.Tensor]:
+        if self.pad_index is None:
+            return None
+        return (tokens != self.pad_index).float()
+
+    def count_tokens(self, batch, siamese: bool = False) -> int:
+        """Number of non-padding tokens of a batch
+
+        Args:
+            batch: batch of pairs
+            siamese: batch has left and right questions tokens (``SiameseCollator`` layout)
+                instead of tokens and token type ids
+        """
+        all_tokens = batch.text if siamese else batch.text[:1]
+        if self.pad_index is None:
+            return sum(tokens.numel() for tokens in all_tokens)
+        return sum(int((tokens != self.pad_index).sum()) for tokens in all_tokens)
+
+    def forward(self, model: nn.Module, batch) -> torch.Tensor:
+        # SiameseClf takes separate left and right questions batches from SiameseCollator,
+        # cross-encoders take pair tokens and token type ids from CrossEncoderCollator
+        if isinstance(model, SiameseClf):
+            left, right = batch.text
+            with self.autocast(left.device):
+                output = model(left, right, self.mask(left), self.mask(right))
+        else:
+            tokens, token_type_ids = batch.text
+            with self.autocast(tokens.device):
+                output = model(tokens, self.mask(tokens), token_type_ids)
+        return output.float()
+
+    def compute_loss(self, model: nn.Module, batch, criterion) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Loss of a batch
+
+        Returns:
+            Tuple of loss, model output and labels used for accuracy
+        """
+        output = self.forward(model, batch)
+        return criterion(output, batch.label), output, batch.label
+
+    def train_step(
+        self,
+        model: nn.Module, batch,
+        criterion, optimizer,
+        it: Optional[int] = None
+        ) -> MutableMapping[str, Optional[float]]:
+
+        loss, output, labels = self.compute_loss(model, batch, criterion)
+        (loss / self.accumulation_steps).backward()
+        if it is None or (it + 1) % self.accumulation_steps == 0:
+            optimizer.step()
+            optimizer.zero_grad()
+
+        preds = torch.argmax(output, dim=-1)
+        acc = (preds == labels).type(torch.float).mean()
+        return {
+            'loss': loss.item(),
+            'accuracy': acc.item()
+        }
+
+    def val_step(
+        self,
+        model: nn.Module, batch,
+        criterion=None,
+        it: Optional[int] = None) -> MutableMapping[str, Optional[float]]:
+
+        output = self.forward(model, batch)
+
+        preds = torch.argmax(output, dim=-1)
+        acc = (preds == batch.label).type(torch.float).mean()
+
+        step_log = {'accuracy': acc.item()}
+        if criterion is not None:
+            step_log['loss'] = criterion(output, batch.label).item()
+
+        return step_log
+
+    def train(self, model: nn.Module, train_iterator, val_iterator, criterion, optimizer, total_epochs):
+        try:
+            self._train(model, train_iterator, val_iterator, criterion, optimizer, total_epochs)
+        finally:
+            if self.metrics is not None:
+                self.metrics.close()
+
+    def _train(self, model: nn.Module, train_iterator, val_iterator, criterion, optimizer, total_epochs):
+        best_acc = -float('inf')
+        best_model_wts = None
+        epochs_without_improvement = 0
+
+        self.global_step = 0
+        if self.silent:
+            pbar = range(total_epochs)
+        else:
+            pbar = tqdm(
+                range(total_epochs),
+                unit='Epoch', desc='Total progress',
+                position=0, leave=True
+            )
+        for epoch in pbar:
+            self.cur_epoch = epoch
+            epoch_log = self.train_epoch(model, train_iterator, criterion, optimizer)
+            msg = f'Epoch {epoch} is finished.\nTraining metrics:\n'
+            for metric_name, val in epoch_log.items():
+                msg += f'\t{metric_name}: {val:.4f}\n'
+
+            print(msg)
+            if val_iterator is not None:
+                val_log = self.validate(model, val_iterator, criterion)
+
+                msg = 'Validation metrics:\n'
+                log = {}
+                for metric_name, val in val_log.items():
+                    msg += f'\t{metric_name}: {val:.4f}\n'
+                    log[f'val_{metric_name}'] = val
+                print(msg)
+                _wandb_log(log)
+                if self.metrics is not None:
+                    self.metrics.write({'epoch': epoch, **log})
+                    self.metrics.flush()
+
+                epoch_acc = val_log.get('accuracy', -float('inf'))
+                if epoch_acc > best_acc:
+                    best_acc = epoch_acc
+                    best_model_wts = deepcopy(model.state_dict())
+                    epochs_without_improvement = 0
+                else:
+                    epochs_without_improvement += 1
+                    if self.patience is not None and epochs_without_improvement >= self.patience:
+                        print(f'No improvement for {epochs_without_improvement} epochs, training is stopped')
+                        break
+
+        self.cur_epoch = None
+        if best_model_wts is not None:
+            if wandb is not None and wandb.run is not None:
+                wandb.run.summary["val_accuracy"] = best_acc
+            model.load_state_dict(best_model_wts)
+
+    def _to_device(self, batch):
+        if self.device is None:
+            return batch
+        return batch.to(self.device)
+
+    @torch.no_grad()
+    def validate(
+        self,
+        model: nn.Module, iterator,
+        criterion=None
+        ) -> MutableMapping[str, Optional[float]]:
+        running_loss = 0.
+        running_acc = 0.
+        loss_cnt = 0
+        acc_cnt = 0
+
+        model.eval()
+        if self.silent:
+            pbar = iterator
+        else:
+            pbar = tqdm(
+                iterator, unit='batch',
+                position=1, leave=False,
+                desc='Validation phase'
+            )
+        for it, batch in enumerate(pbar):
+            it_log = self.val_step(model, self._to_device(batch), criterion, it)
+
+            if 'loss' in it_log:
+                running_loss += it_log['loss']
+                loss_cnt += 1
+            if 'accuracy' in it_log:
+                running_acc += it_log['accuracy']
+                acc_cnt += 1
+
+        epoch_log = {}
+        if loss_cnt > 0:
+            epoch_log['loss'] = running_loss / loss_cnt
+        if acc_cnt > 0:
+            epoch_log['accuracy'] = running_acc / acc_cnt
+        return epoch_log
+
+    @torch.no_grad()
+    def predict(self, model: nn.Module, iterator, positive_class: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Labels, predicted classes and positive class probabilities of all examples
+
+        Examples are returned in the iterator order.
+        """
+        labels, preds, scores = [], [], []
+        model.eval()
+        for batch in iterator:
+            batch = self._to_device(batch)
+            output = self.forward(model, batch)
+            scores.append(torch.softmax(output, dim=1)[:, positive_class].cpu().numpy())
+            preds.append(torch.argmax(output, dim=-1).cpu().numpy())
+            labels.append(batch.label.cpu().numpy())
+        if len(labels) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(labels), np.concatenate(preds), np.concatenate(scores)
+
+    def train_epoch(self,
+                    model: nn.Module, iterator,
+                    criterion, optimizer
+                    ) -> MutableMapping[str, Optional[float]]:
+        running_loss = 0.
+        running_acc = 0.
+        loss_cnt = 0
+        acc_cnt = 0
+
+        model.train()
+        optimizer.zero_grad()
+        if self.silent:
+            pbar = iterator
+        else:
+            pbar = tqdm(
+                iterator,
+                unit='batch',
+                desc='Training phase',
+                position=1, leave=False
+            )
+
+        it = -1
+        step_end = time.perf_counter()
+        for it, batch in enumerate(pbar):
+            batch = self._to_device(batch)
+            step_start = time.perf_counter()
+            it_log = self.train_step(model, batch, criterion, optimizer, it)
+            data_time = step_start - step_end
+            step_end = time.perf_counter()
+            compute_time = step_end - step_start
+
+            if self.metrics is not None:
+                step_time = data_time + compute_time
+                n_samples = batch.label.size(0)
+                self.metrics.write({
+                    'epoch': self.cur_epoch,
+                    'step': it,
+                    'samples': n_samples,
+                    'data_time': data_time,
+                    'compute_time': compute_time,
+                    'samples_per_sec': n_samples / step_time,
+                    'tokens_per_sec': self.count_tokens(batch, isinstance(model, SiameseClf)) / step_time,
+                    'peak_rss_mb': peak_rss_mb(),
+                    **it_log
+                })
+
+            if 'loss' in it_log:
+                running_loss += it_log['loss']
+                loss_cnt += 1
+            if 'accuracy' in it_log:
+                running_acc += it_log['accuracy']
+                acc_cnt += 1
+
+            self.global_step += batch.label.size(0)
+            if it % self.log_every == self.log_every - 1:
+                it_log['epoch'] = self.cur_epoch
+                _wandb_log(it_log, step=self.global_step)
+                if self.metrics is not None:
+                    self.metrics.flush()
+
+        # Gradients of the last incomplete accumulation group
+        if (it + 1) % self.accumulation_steps != 0:
+            optimizer.step()
+            optimizer.zero_grad()
+        if self.metrics is not None:
+            self.metrics.flush()
+
+        epoch_log = {}
+        if loss_cnt > 0:
+            epoch_log['loss'] = running_loss / loss_cnt
+        if acc_cnt > 0:
+            epoch_log['accuracy'] = running_acc / acc_cnt
+        return epoch_log
+
+
+class ParaphraserTrainer(Trainer):
+    def __init__(self, pad_index: Optional[int] = None, silent: bool = False, p: float = 0.5, **kwargs) -> None:
+        super().__init__(pad_index=pad_index, silent=silent, **kwargs)
+        self.prob = p
+        self._semi_dist_v = torch.Tensor([1 - p, p]).detach()
+
+    def compute_loss(self, model: nn.Module, batch, criterion) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # Convert classes to bernoilli dist tensor
+        # "2" (means the same) class has distribution [0, 1]
+        # "0" (different meaning) class has distribution [1, 0]
+        # "1" (close, but not exactly the same) class has distribution [1 - p, p]
+        label_dist = torch.full(
+            (batch.label.size(0), 2),
+            0.,
+            dtype=torch.float,
+        )
+        label_dist[torch.where(batch.label == 2)[0], 1] = 1.
+        label_dist[torch.where(batch.label == 0)[0], 0] = 1.
+        label_dist[torch.where(batch.label == 1)[0]] = self._semi_dist_v
+        label_dist = label_dist.to(batch.label.device)
+
+        output = self.forward(model, batch)
+        log_prob = F.log_softmax(output, dim=1)
+        # NLL loss with soft targets
+        loss = torch.mean(torch.sum(-label_dist * log_prob, 1))
+        hard_labels = torch.argmax(label_dist, dim=1)
+        return loss, output, hard_labels
@@ -0,0 +1,185 @@
+"""
+Paraphrase classification models from model_tests notebook.
+"""
+import torch
+from torch import nn
+from transformers import AutoModel, BertModel, DistilBertModel
+
+from typing import Optional, Union, MutableMapping
+
+AGGREGATE_MODES = ('mean', 'sum', 'cat', 'concat', 'concatenate')
+
+
+def _clf_head(input_size: int, num_classes: int, dropout: float) -> nn.Sequential:
+    clf = nn.Sequential(
+        nn.Linear(input_size, 256),
+        nn.LeakyReLU(0.01),
+        nn.Dropout(dropout),
+        nn.Linear(256, num_classes)
+    )
+    torch.nn.init.xavier_normal_(
+        clf[0].weight,
+        nn.init.calculate_gain('leaky_relu', 0.01)
+    )
+    torch.nn.init.xavier_normal_(clf[3].weight)
+    return clf
+
+
+class TransformerWrapper(nn.Module):
+    """
+    HuggingFace BERT model wrapper,
+    which produces [CLS] embedding from several last transformer layers
+    """
+    def __init__(self, model_name: str,
+                 freeze: Union[bool, int] = False,
+                 aggregate_n_last_hidden_layers: int = 1,
+                 aggregate_mode: str = 'mean',
+                 revision=None):
+        assert aggregate_n_last_hidden_layers >= 1
+        aggregate_mode = aggregate_mode.lower()
+        assert aggregate_mode in AGGREGATE_MODES
+        super(TransformerWrapper, self).__init__()
+
+        if revision is None:
+            self.model = AutoModel.from_pretrained(model_name)
+        else:
+            self.model = AutoModel.from_pretrained(model_name, revision=revision)
+        self.hidden_size = self.model.config.hidden_size
+
+        if aggregate_mode in ('cat', 'concat', 'concatenate'):
+            self.output_size = aggregate_n_last_hidden_layers * self.hidden_size
+        else:
+            self.output_size = self.hidden_size
+
+        if freeze:
+            if isinstance(freeze, bool):
+                freeze = 10**5
+        else:
+            freeze = 0
+
+        layers = []
+        if isinstance(self.model, BertModel):
+            layers = self.model.encoder.layer
+        elif isinstance(self.model, DistilBertModel):
+            layers = self.model.transformer.layer
+
+        for param in self.model.embeddings.parameters():
+            param.requires_grad = False
+
+        for layer in layers[:freeze]:
+            for param in layer.parameters():
+                param.requires_grad = False
+
+        self.n_agg = aggregate_n_last_hidden_layers
+        self.agg_mode = aggregate_mode
+
+    def forward(self, x: torch.LongTensor,
+                mask: Union[torch.BoolTensor, torch.Tensor, None] = None,
+                token_type_ids: Optional[torch.LongTensor] = None) -> torch.Tensor:
+        if mask is None:
+            mask = torch.ones_like(x, dtype=torch.float, device=x.device).detach()
+        mask = mask.float()
+
+        embeddings = self.model(
+            x,
+            attention_mask=mask,
+            token_type_ids=token_type_ids,
+            output_hidden_states=True if self.n_agg > 1 else False,
+            return_dict=True
+            )
+        if self.n_agg == 1:
+            if isinstance(self.model, BertModel):
+                cls_embeddings = embeddings['pooler_output']
+            else:
+                cls_embeddings = embeddings['last_hidden_state'][:, 0, :]
+        else:
+            hidden = embeddings['hidden_states']
+            i = len(hidden) - self.n_agg
+            cls_hidden = [layer_out[:, 0, :] for layer_out in hidden[i:]]
+
+            if self.agg_mode == 'mean':
+                cls_hidden = torch.stack(cls_hidden, dim=2)
+                cls_embeddings = torch.mean(cls_hidden, dim=2)
+            elif self.agg_mode == 'sum':
+                cls_hidden = torch.stack(cls_hidden, dim=2)
+                cls_embeddings = torch.sum(cls_hidden, dim=2)
+            else:
+                cls_embeddings = torch.cat(cls_hidden, dim=1)
+
+        return cls_embeddings
+
+
+class TransformerCls(TransformerWrapper):
+    """
+    Cross-encoder: question pair is passed to the transformer as one sequence
+    """
+    def __init__(self, model_name: str,
+                 num_classes: int,
+                 dropout: float = 0.,
+                 freeze: Union[bool, int] = False,
+                 aggregate_n_last_hidden_layers: int = 1,
+                 aggregate_mode: str = 'mean',
+                 revision=None):
+        super(TransformerCls, self).__init__(
+            model_name, freeze,
+            aggregate_n_last_hidden_layers,
+            aggregate_mode,
+            revision
+            )
+        self.clf = _clf_head(self.output_size, num_classes, dropout)
+
+    def forward(self, x: torch.LongTensor,
+                mask: Union[torch.BoolTensor, torch.Tensor, None] = None,
+                token_type_ids: Optional[torch.LongTensor] = None) -> torch.Tensor:
+        cls_emb = super(TransformerCls, self).forward(
+            x,
+            mask,
+            token_type_ids=token_type_ids
+        )
+        return self.clf(cls_emb)
+
+
+class SiameseClf(TransformerWrapper):
+    """
+    Siamese model: questions are encoded separately, classification head is applied to both embeddings
+    """
+    def __init__(self, model_name: str,
+                 num_classes: int,
+                 dropout: float = 0.,
+                 freeze: Union[bool, int] = False,
+                 aggregate_n_last_hidden_layers: int = 1,
+                 aggregate_mode: str = 'mean',
+                 revision=None):
+        super(SiameseClf, self).__init__(
+            model_name, freeze,
+            aggregate_n_last_hidden_layers,
+            aggregate_mode,
+            revision
+            )
+        self.clf = _clf_head(2 * self.output_size, num_classes, dropout)
+
+    def encode(self, x: torch.LongTensor,
+               mask: Union[torch.BoolTensor, torch.Tensor, None] = None) -> torch.Tensor:
+        """Embedding of one question"""
+        return super(SiameseClf, self).forward(x, mask, token_type_ids=None)
+
+    def classify(self, emb1: torch.Tensor, emb2: torch.Tensor) -> torch.Tensor:
+        """Logits of question pairs by their embeddings"""
+        return self.clf(torch.cat([emb1, emb2], dim=1))
+
+    def forward(self,
+                x1: torch.LongTensor, x2: torch.LongTensor,
+                mask1: Union[torch.BoolTensor, torch.Tensor, None] = None,
+                mask2: Union[torch.BoolTensor, torch.Tensor, None] = None,
+                return_dict: bool = False) -> Union[torch.Tensor, MutableMapping[str, torch.Tensor]]:
+        cls_emb_1 = self.encode(x1, mask1)
+        cls_emb_2 = self.encode(x2, mask2)
+
+        logits = self.classify(cls_emb_1, cls_emb_2)
+        if return_dict:
+            return {
+                'logits': logits,
+                'embeddings': torch.stack([cls_emb_1, cls_emb_2], dim=1)
+            }
+        else:
+            return logits
@@ -0,0 +1,70 @@
+"""
+Speed of lemmatizer backends and their agreement with Mystem on questions corpus.
+
+Agreement is reported on lemmas and on decisions of obscene words and low IPM filters,
+which are the only consumers of lemmas in preprocessing.
+
+Example (from preprocessing directory, like preprocessing.py):
+    python benchmark_lemmatizers.py ../All_questions_with_tags.csv --sample 20000
+"""
+import pandas as pd
+import numpy as np
+
+import argparse
+import time
+from typing import Dict, List, Sequence
+
+try:
+    from preprocessing.lemmatizers import LEMMATIZERS, get_lemmatizer, lemma_agreement
+    from preprocessing.preprocessing import IPM_LOWER_THRESHOLD, ipm_filter, load_ipm, obscene_filter, sanitize_unicode
+except ModuleNotFoundError:
+    # Script is run from preprocessing directory
+    from lemmatizers import LEMMATIZERS, get_lemmatizer, lemma_agreement
+    from preprocessing import IPM_LOWER_THRESHOLD, ipm_filter, load_ipm, obscene_filter, sanitize_unicode
+
+
+def run_backend(name: str, sentences: Sequence[str]) -> Dict:
+    lemmatizer = get_lemmatizer(name)
+    start = time.perf_counter()
+    lemmas = lemmatizer.lemmatize_all(sentences)
+    elapsed = time.perf_counter() - start
+    return {'lemmas': lemmas, 'seconds': elapsed, 'sentences_per_sec': len(sentences) / max(elapsed, 1e-9)}
+
+
+def filter_agreement(left: List[List[str]], right: List[List[str]], ipm: Dict[str, float]) -> Dict[str, float]:
+    """Share of sentences, on which filters make the same decision"""
+    obscene_l = np.array([obscene_filter(tokens, True) for tokens in left])
+    obscene_r = np.array([obscene_filter(tokens, True) for tokens in right])
+    ipm_l = np.array([ipm_filter(tokens, ipm, IPM_LOWER_THRESHOLD) for tokens in left])
+    ipm_r = np.array([ipm_filter(tokens, ipm, IPM_LOWER_THRESHOLD) for tokens in right])
+    return {
+        'obscene_filter': float(np.mean(obscene_l == obscene_r)),
+        'ipm_filter': float(np.mean(ipm_l == ipm_r)),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare lemmatizer backends with Mystem')
+    parser.add_argument('questions', help='Questions CSV separated by ";" with "text" column')
+    parser.add_argument('--sample', type=int, default=10_000, help='Number of questions to lemmatize')
+    parser.add_argument('--backends', nargs='+', choices=list(LEMMATIZERS), default=list(LEMMATIZERS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = pd.read_csv(args.questions, sep=';', usecols=['text'])['text'].dropna()
+    texts = texts.sample(min(args.sample, len(texts)), random_state=args.seed)
+    sentences = [sanitize_unicode(text, mode='hard') for text in texts]
+
+    results = {name: run_backend(name, sentences) for name in args.backends}
+    for name, res in results.items():
+        print(f'{name}: {res["seconds"]:.2f} s, {res["sentences_per_sec"]:.0f} sentences/s')
+
+    if 'mystem' in results:
+        ipm_dict = load_ipm('freqrnc2011.csv')
+        reference = results['mystem']['lemmas']
+        for name, res in results.items():
+            if name == 'mystem':
+                continue
+            agreement = lemma_agreement(reference, res['lemmas'])
+            agreement.update(filter_agreement(reference, res['lemmas'], ipm_dict))
+            print(f'{name} vs mystem: ' + ', '.join(f'{key} {value:.4f}' for key, value in agreement.items()))
@@ -0,0 +1,138 @@
+"""
+Lemmatizer backends for preprocessing filters.
+
+``MystemLemmatizer`` pipes chunks of sentences to the Mystem binary, ``PymorphyLemmatizer`` works in-process
+with memoized pymorphy2 parses (see ``utils.morphology``), so it doesn't pay for IPC and sentence boundaries
+can't be lost. Both return lemmas of every sentence as a list of tokens.
+"""
+try:
+    from pymystem3 import Mystem
+except ModuleNotFoundError:
+    Mystem = None
+try:
+    from utils.morphology import MorphCache, russian_tokenize
+except ImportError:
+    MorphCache = None
+    russian_tokenize = None
+
+from collections import Counter
+from copy import copy
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class Lemmatizer(object):
+    """
+    Interface of lemmatizer backends
+    """
+    name = None
+
+    def lemmatize_all(self, sentences: Sequence[str], chunk_size: Optional[int] = None) -> List[List[str]]:
+        """Lemmas of every sentence (punctuation and, for some backends, spaces are kept as tokens)
+
+        Args:
+            sentences: sentences to lemmatize
+            chunk_size: number of sentences processed at once, if backend processes them in batches
+        """
+        raise NotImplementedError()
+
+
+class MystemLemmatizer(Lemmatizer):
+    """
+    Mystem lemmatizer, sentences of a chunk are joined by newlines and processed by one Mystem call
+    """
+    name = 'mystem'
+
+    def __init__(self, chunk_size: int = 1000, mystem=None):
+        if mystem is None:
+            if Mystem is None:
+                raise ImportError('pymystem3 is required for Mystem lemmatizer')
+            mystem = Mystem()
+        self.mystem = mystem
+        self.chunk_size = chunk_size
+
+    def _lemmatize_chunk(self, chunk: Sequence[str]) -> List[List[str]]:
+        result = []
+        cur_sent_tokens = []
+        for token in self.mystem.lemmatize('\n'.join(chunk)):
+            stripped_tok = token.rstrip('\n')
+            if stripped_tok != token:
+                # Token contains \n char, which was added manually as sentence separator
+                cur_sent_tokens.append(stripped_tok)
+                result.append(copy(cur_sent_tokens))
+                cur_sent_tokens = []
+            else:
+                cur_sent_tokens.append(token)
+        if len(cur_sent_tokens) > 0:
+            result.append(copy(cur_sent_tokens))
+        return result
+
+    def lemmatize_all(self, sentences: Sequence[str], chunk_size: Optional[int] = None) -> List[List[str]]:
+        chunk_size = chunk_size or self.chunk_size
+        result = []
+        for i in range(0, len(sentences), chunk_size):
+            chunk = sentences[i:i + chunk_size]
+            chunk_result = self._lemmatize_chunk(chunk)
+            if len(chunk_result) != len(chunk):
+                # Sentence boundaries are lost (e.g. Mystem merged newlines), process sentences one by one
+                chunk_result = [sum(self._lemmatize_chunk([sent]), []) for sent in chunk]
+            result.extend(chunk_result)
+        return result
+
+
+class PymorphyLemmatizer(Lemmatizer):
+    """
+    In-process pymorphy2 lemmatizer with lemmas memoized per token
+    """
+    name = 'pymorphy2'
+
+    def __init__(self, morph_cache=None, tokenize: Optional[Callable[[str], List[str]]] = None):
+        if morph_cache is None:
+            if MorphCache is None:
+                raise ImportError('pymorphy2 is required for pymorphy2 lemmatizer')
+            morph_cache = MorphCache()
+        self.morph_cache = morph_cache
+        self.tokenize = tokenize if tokenize is not None else russian_tokenize
+
+    def lemmatize_all(self, sentences: Sequence[str], chunk_size: Optional[int] = None) -> List[List[str]]:
+        return [self.morph_cache.lemmas(self.tokenize(sent), skip_punct=False) for sent in sentences]
+
+
+LEMMATIZERS = {cls.name: cls for cls in (MystemLemmatizer, PymorphyLemmatizer)}
+_instances: Dict[str, Lemmatizer] = {}
+
+
+def get_lemmatizer(name: str = 'mystem') -> Lemmatizer:
+    """Shared lemmatizer instance of the backend (Mystem process and pymorphy2 cache are reused)"""
+    if name not in LEMMATIZERS:
+        raise ValueError(f'Unknown lemmatizer {name}, available: {", ".join(LEMMATIZERS)}')
+    if name not in _instances:
+        _instances[name] = LEMMATIZERS[name]()
+    return _instances[name]
+
+
+def word_lemmas(tokens: Sequence[str]) -> List[str]:
+    """Lemmas without spaces and punctuation (backends tokenize them differently)"""
+    return [tok.strip().lower() for tok in tokens if any(char.isalnum() for char in tok)]
+
+
+def lemma_agreement(left: Sequence[Sequence[str]], right: Sequence[Sequence[str]]) -> Dict[str, float]:
+    """Agreement of lemmatization results of two backends
+
+    Returns:
+        'sentence': share of sentences with the same word lemmas,
+        'token': share of common word lemmas (multiset intersection) among all word lemmas of the longer result
+    """
+    if len(left) != len(right):
+        raise ValueError('Results must contain the same number of sentences')
+    same_sentences = 0
+    common = 0
+    total = 0
+    for l_tokens, r_tokens in zip(left, right):
+        l_words, r_words = word_lemmas(l_tokens), word_lemmas(r_tokens)
+        same_sentences += l_words == r_words
+        common += sum((Counter(l_words) & Counter(r_words)).values())
+        total += max(len(l_words), len(r_words))
+    return {
+        'sentence': same_sentences / max(len(left), 1),
+        'token': common / max(total, 1)
+    }
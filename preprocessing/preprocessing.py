@@ -1,17 +1,18 @@
 import pandas as pd
 import numpy as np
-from pymystem3 import Mystem
-from nltk import word_tokenize
-from nltk import download as nltk_download
 
+import argparse
 from unicodedata import normalize
-from typing import Sequence, List, Union, Any, Callable, Optional, Tuple
-from copy import copy
+from typing import Dict, Sequence, List, Union, Any, Callable, Optional, Tuple
 from os import path
 
 from utils.download import extend_dataframe
-
-nltk_download('punkt', quiet=True)
+from utils.nltk_resources import word_tokenize
+try:
+    from preprocessing.lemmatizers import LEMMATIZERS, get_lemmatizer
+except ModuleNotFoundError:
+    # Script is run from preprocessing directory, where 'preprocessing' is this module
+    from lemmatizers import LEMMATIZERS, get_lemmatizer
 
 # Unicode symbols which can be replaced by ASCII char without any ambiguity
 _char_soft_replacement = [
@@ -78,7 +79,7 @@ _punkt_w_space_ranges = [
     (0x007b, 0x007e)
 ]
 
-with open('obscene_words.txt') as f:
+with open(path.join(path.dirname(path.abspath(__file__)), 'obscene_words.txt')) as f:
     obscene_words = list(map(lambda s: s.rstrip(), f))
 _obscene_words_set = set(obscene_words)
 
@@ -122,38 +123,23 @@ def is_valid_unicode_range(s: str, ranges: Union[None, Sequence[Tuple[int, int]]
     return is_valid
 
 
-_mystem_analyzer = Mystem()
-
+def lemmatize_all(sentences: Sequence[str], chunk_size: int = 1000, backend: str = 'mystem') -> List[List[str]]:
+    """Lemmas of every sentence
 
-def lemmatize_all(sentences: Sequence[str], chunk_size: int = 1000) -> List[List[str]]:
-    result = []
-    cur_sent_tokens = []
-    for i in range(0, len(sentences), chunk_size):
-        chunk = sentences[i:i + chunk_size]
-        prev_res_size = len(result)
-        for token in _mystem_analyzer.lemmatize('\n'.join(chunk)):
-            stripped_tok = token.rstrip('\n')
-            if stripped_tok != token:
-                # Token contains \n char, which was added manually as sentence separator
-                cur_sent_tokens.append(stripped_tok)
-                result.append(copy(cur_sent_tokens))
-                cur_sent_tokens = []
-            else:
-                cur_sent_tokens.append(token)
-        if len(cur_sent_tokens) > 0:
-            result.append(copy(cur_sent_tokens))
-            cur_sent_tokens = []
-        if len(result) - prev_res_size != len(chunk):
-            raise RuntimeError('Some error occurred during in chunking pipeline while lemmatizing text with MyStem.')
-
-    return result
+    Args:
+        sentences: sentences to lemmatize
+        chunk_size: number of sentences passed to Mystem at once (other backends ignore it)
+        backend: lemmatizer name, one of ``preprocessing.lemmatizers.LEMMATIZERS``
+    """
+    return get_lemmatizer(backend).lemmatize_all(sentences, chunk_size=chunk_size)
 
 
-def obscene_filter(sent: Union[Sequence[str], str], is_input_lemmatized: bool = False) -> bool:
+def obscene_filter(sent: Union[Sequence[str], str], is_input_lemmatized: bool = False,
+                   backend: str = 'mystem') -> bool:
     if not is_input_lemmatized:
-        if isinstance(sent, Sequence):
+        if not isinstance(sent, str):
             sent = ' '.join(sent)
-        sent = lemmatize_all([sent], chunk_size=1)
+        sent = lemmatize_all([sent], chunk_size=1, backend=backend)[0]
 
     if isinstance(sent, str):
         sent = word_tokenize(sent)
@@ -187,6 +173,36 @@ def apply_index_filter(idx: Sequence[int], collection: Sequence[Any], filter: Ca
     return valid_idx
 
 
+def load_ipm(file_path: str = 'freqrnc2011.csv') -> Dict[str, float]:
+    """Frequency (instances per million) of lemmas from frequency dictionary of Russian National Corpus"""
+    freq_df = pd.read_csv(file_path, sep='\t')
+    ipm = {}
+    for lemma, ipm_val in freq_df[['Lemma', 'Freq(ipm)']].itertuples(index=False):
+        ipm[lemma] = ipm_val + ipm.get(lemma, 0.)
+    return ipm
+
+
+def ipm_filter(sent_lemmas: Sequence[str], ipm: Dict[str, float], threshold: float = 2.) -> bool:
+    """Sentence consists of russian words with frequency not lower than threshold"""
+    ignore_ranges = [
+        (0x0030, 0x0039),  # digits
+    ]
+    ignore_ranges.extend(_punkt_w_space_ranges)
+
+    for token in sent_lemmas:
+        # Punctuation, spacing and numbers are ignored
+        if is_valid_unicode_range(token, ignore_ranges):
+            continue
+
+        # Non-russian word is ignored
+        if not is_valid_unicode_range(token, (0x0400, 0x04ff)):
+            return False
+
+        if ipm.get(token, 0.) < threshold:
+            return False
+    return True
+
+
 class QIdDataError(ValueError):
     pass
 
@@ -198,6 +214,13 @@ questions_data_path = '../All_questions_with_tags.csv'
 _required_columns = ['id', 'short_name', 'url']
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Filter questions by unicode, obscene words, word frequency and length')
+    parser.add_argument('--questions', default=questions_data_path, help='CSV file with question URLs')
+    parser.add_argument('--lemmatizer', choices=list(LEMMATIZERS), default='mystem',
+                        help='Lemmatizer for obscene words and IPM filters')
+    args = parser.parse_args()
+    questions_data_path = args.questions
+
     # Resolving correct path to questions csv
     while not path.isfile(questions_data_path):
         questions_data_path = input('Enter path to CSV file with question URLs: ')
@@ -237,39 +260,15 @@ if __name__ == '__main__':
                                  filter_name='Valid Unicode symbols')
 
     print('Lemmatizing questions text for applying further filters')
-    question_lemmas = lemmatize_all(questions['text'])
+    question_lemmas = lemmatize_all(questions['text'], backend=args.lemmatizer)
 
     cur_idx = apply_index_filter(cur_idx, question_lemmas, lambda sent_tokens: obscene_filter(sent_tokens, True),
                                  filter_name='Obscene words')
 
-    freq_df = pd.read_csv('freqrnc2011.csv', sep='\t')
-
-    ipm = {}
-    for lemma, ipm_val in freq_df[['Lemma', 'Freq(ipm)']].itertuples(index=False):
-        ipm[lemma] = ipm_val + ipm.get(lemma, 0.)
-
-
-    def ipm_filter(sent_lemmas: Sequence[str]) -> bool:
-        ignore_ranges = [
-            (0x0030, 0x0039),  # digits
-        ]
-        ignore_ranges.extend(_punkt_w_space_ranges)
-
-        for token in sent_lemmas:
-            # Punctuation, spacing and numbers are ignored
-            if is_valid_unicode_range(token, ignore_ranges):
-                continue
-
-            # Non-russian word is ignored
-            if not is_valid_unicode_range(token, (0x0400, 0x04ff)):
-                return False
-
-            if ipm.get(token, 0.) < IPM_LOWER_THRESHOLD:
-                return False
-        return True
-
-
-    cur_idx = apply_index_filter(cur_idx, question_lemmas, ipm_filter, filter_name='low IPM')
+    ipm = load_ipm('freqrnc2011.csv')
+    cur_idx = apply_index_filter(cur_idx, question_lemmas,
+                                 lambda sent_lemmas: ipm_filter(sent_lemmas, ipm, IPM_LOWER_THRESHOLD),
+                                 filter_name='low IPM')
 
     # Length filtering
     questions['q_len'] = questions['text'].apply(lambda s: len(s.split()))
@@ -0,0 +1,206 @@
+"""
+Append-only archive of raw responses.
+
+Every response is one independent zstd frame in a segment file ``segment-XXXXX.zst``
+(a new segment is started when the current one exceeds ``segment_size`` bytes).
+A frame contains JSON header (url, status, headers, callback name and its kwargs) and response body.
+``index.tsv`` maps url to segment number, offset and length of the frame; it is appended after the frame
+is written, so a record is visible only when it is completely on disk. The latest record of a url wins.
+"""
+import zstandard
+
+import json
+import os
+import re
+import struct
+import time
+from os import path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+SEGMENT_SIZE = 256 * 2**20
+COMPRESSION_LEVEL = 3
+_INDEX_NAME = 'index.tsv'
+_SEGMENT_PATTERN = re.compile(r'segment-(\d{5})\.zst$')
+_HEADER_LEN = struct.Struct('<I')
+
+
+class ArchiveRecord(NamedTuple):
+    url: str
+    status: int
+    headers: Dict[str, List[str]]
+    body: bytes
+    callback: Optional[str]
+    cb_kwargs: dict
+    timestamp: float
+
+
+class IndexEntry(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+
+
+def _segment_name(segment: int) -> str:
+    return f'segment-{segment:05d}.zst'
+
+
+class PageArchive(object):
+    """
+    Raw responses stored in zstd-compressed append-only segments
+    """
+    def __init__(self, root: str, segment_size: int = SEGMENT_SIZE, level: int = COMPRESSION_LEVEL,
+                 read_only: bool = False):
+        """
+        Args:
+            root: archive directory, created if not exists
+            segment_size: size of segment file, after which a new segment is started
+            level: zstd compression level
+            read_only: don't load the index, records are read only by their index entries
+        """
+        self.root = root
+        self.segment_size = segment_size
+        self.read_only = read_only
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        # Size of complete lines of index file, if it ends with an incomplete line
+        self._index_valid_size = None
+        if read_only:
+            self.index = {}
+        else:
+            os.makedirs(root, exist_ok=True)
+            self.index = self._load_index()
+
+        segments = [int(m.group(1)) for m in map(_SEGMENT_PATTERN.match, os.listdir(root)) if m is not None]
+        self._segment = max(segments, default=0)
+        self._segment_file = None
+        self._index_file = None
+
+    def _load_index(self) -> Dict[str, IndexEntry]:
+        index = {}
+        index_path = path.join(self.root, _INDEX_NAME)
+        if not path.isfile(index_path):
+            return index
+        segment_sizes = {}
+        valid_size = 0
+        with open(index_path, 'rb') as f:
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    # Incomplete line after interrupted write
+                    self._index_valid_size = valid_size
+                    break
+                valid_size += len(raw_line)
+                parts = raw_line.decode('utf-8').rstrip('\n').split('\t')
+                if len(parts) != 4:
+                    continue
+                url, segment, offset, length = parts[0], int(parts[1]), int(parts[2]), int(parts[3])
+                if segment not in segment_sizes:
+                    segment_path = path.join(self.root, _segment_name(segment))
+                    segment_sizes[segment] = path.getsize(segment_path) if path.isfile(segment_path) else 0
+                if offset + length <= segment_sizes[segment]:
+                    index[url] = IndexEntry(segment, offset, length)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.index
+
+    def _open_for_append(self) -> None:
+        if self.read_only:
+            raise ValueError('Archive is opened read-only')
+        if self._segment_file is None:
+            self._segment_file = open(path.join(self.root, _segment_name(self._segment)), 'ab')
+            index_path = path.join(self.root, _INDEX_NAME)
+            if self._index_valid_size is not None:
+                # Incomplete line would swallow the next record
+                os.truncate(index_path, self._index_valid_size)
+                self._index_valid_size = None
+            self._index_file = open(index_path, 'a', encoding='utf-8')
+        if self._segment_file.tell() >= self.segment_size:
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_file = open(path.join(self.root, _segment_name(self._segment)), 'ab')
+
+    def write(self, url: str, status: int, headers: Dict[str, List[str]], body: bytes,
+              callback: Optional[str] = None, cb_kwargs: Optional[dict] = None) -> IndexEntry:
+        """Append response to the archive"""
+        header = json.dumps({
+            'url': url,
+            'status': status,
+            'headers': headers,
+            'callback': callback,
+            'cb_kwargs': cb_kwargs or {},
+            'timestamp': time.time()
+        }, ensure_ascii=False).encode('utf-8')
+        frame = self._compressor.compress(_HEADER_LEN.pack(len(header)) + header + body)
+
+        self._open_for_append()
+        offset = self._segment_file.tell()
+        self._segment_file.write(frame)
+        self._segment_file.flush()
+        entry = IndexEntry(self._segment, offset, len(frame))
+        self._index_file.write(f'{url}\t{entry.segment}\t{entry.offset}\t{entry.length}\n')
+        self._index_file.flush()
+        self.index[url] = entry
+        return entry
+
+    def read_entry(self, entry: IndexEntry) -> ArchiveRecord:
+        with open(path.join(self.root, _segment_name(entry.segment)), 'rb') as f:
+            f.seek(entry.offset)
+            frame = f.read(entry.length)
+        return self.decode(frame)
+
+    def decode(self, frame: bytes) -> ArchiveRecord:
+        data = self._decompressor.decompress(frame)
+        header_len = _HEADER_LEN.unpack_from(data)[0]
+        header = json.loads(data[_HEADER_LEN.size:_HEADER_LEN.size + header_len].decode('utf-8'))
+        return ArchiveRecord(body=data[_HEADER_LEN.size + header_len:], **header)
+
+    def read(self, url: str) -> ArchiveRecord:
+        """The latest archived response of url
+
+        Raises:
+            KeyError: if url is not archived
+        """
+        return self.read_entry(self.index[url])
+
+    def entries(self) -> List[IndexEntry]:
+        """Index entries of the latest records ordered by position in segments (sequential reading)"""
+        return sorted(self.index.values())
+
+    def iter_entries(self, entries: List[IndexEntry]) -> Iterator[ArchiveRecord]:
+        """Read records of given entries, opening every segment once"""
+        segment_file = None
+        segment = None
+        try:
+            for entry in sorted(entries):
+                if entry.segment != segment:
+                    if segment_file is not None:
+                        segment_file.close()
+                    segment = entry.segment
+                    segment_file = open(path.join(self.root, _segment_name(segment)), 'rb')
+                segment_file.seek(entry.offset)
+                yield self.decode(segment_file.read(entry.length))
+        finally:
+            if segment_file is not None:
+                segment_file.close()
+
+    def __iter__(self) -> Iterator[ArchiveRecord]:
+        return self.iter_entries(self.entries())
+
+    def close(self) -> None:
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._index_file.close()
+            self._segment_file = None
+            self._index_file = None
+
+
+def response_headers(headers) -> Dict[str, List[str]]:
+    """Scrapy headers as JSON-serializable dict"""
+    return {
+        key.decode('latin-1'): [value.decode('latin-1') for value in values]
+        for key, values in headers.items()
+    }
+
@@ -0,0 +1,107 @@
+"""
+CPU time of question page parsing by spiders on saved pages.
+
+Pages are HTML files named ``<question id>.html``. If fixtures directory is not given,
+synthetic pages with the same DOM layout as Yandex Q question page are generated.
+
+Example (from scraping project directory):
+    python -m scraping.benchmark --fixtures saved_pages/ --repeat 20
+"""
+from scrapy.http import HtmlResponse
+
+import argparse
+import os
+import time
+from os import path
+from random import Random
+from typing import List, Tuple
+
+from scraping.items import Question
+from scraping.spiders.yandex_q import YandexQuestionsSpider, YandexQuestionIDSpider
+
+PAGE_URL = 'https://yandex.ru/q/question/{q_id}/'
+
+
+def synthetic_page(q_id: str, n_answers: int = 20, n_links: int = 60, seed: int = 0) -> str:
+    """Question page with answers, votes, tags and links in the layout expected by spiders"""
+    rnd = Random(seed)
+    words = ['вопрос', 'ответ', 'почему', 'когда', 'можно', 'нужно', 'сделать', 'время', 'человек', 'дом']
+    answers = []
+    for i in range(n_answers):
+        paragraphs = ''.join(
+            '<p>' + ' '.join(rnd.choice(words) for _ in range(30)) + '</p>' for _ in range(rnd.randint(1, 5))
+        )
+        answers.append(
+            f'<div data-id="a{i}"><div><a href="/q/profile/user{i}/">user{i}</a></div>'
+            f'<div><div class="formatted">{paragraphs}</div>'
+            f'<button>Хороший ответ<span>{rnd.randint(0, 100)}</span></button>'
+            f'<button>Плохой ответ<span>{rnd.randint(0, 10)}</span></button></div></div>'
+        )
+    links = ''.join(
+        f'<a href="/q/question/{rnd.choice(words)}-{rnd.randint(0, 10**6):x}/">link</a>' for _ in range(n_links)
+    )
+    return (
+        '<html><body><div id="page"><div><div><header>Яндекс Кью</header></div><div><section>'
+        '<div><h1>Почему небо голубое?</h1>'
+        '<div><div><a href="/q/tag/science/">Наука</a><a href="/q/tag/physics/">Физика</a></div></div></div>'
+        f'<div><div>{"".join(answers)}</div></div>'
+        f'</section></div><aside>{links}</aside></div></div></body></html>'
+    )
+
+
+def load_pages(fixtures_dir: str) -> List[Tuple[str, bytes]]:
+    pages = []
+    for name in sorted(os.listdir(fixtures_dir)):
+        if name.endswith('.html'):
+            with open(path.join(fixtures_dir, name), 'rb') as f:
+                pages.append((name[:-len('.html')], f.read()))
+    return pages
+
+
+def parse_cpu_time(spider, pages: List[Tuple[str, bytes]], repeat: int = 10) -> Tuple[float, float]:
+    """Mean CPU time of one page parsing in seconds
+
+    Returns:
+        Time of item extraction (until question item is yielded, including DOM construction)
+        and total time (including extraction of links to follow)
+    """
+    extraction = 0.
+    total = 0.
+    for _ in range(repeat):
+        for q_id, body in pages:
+            # New response every time, otherwise parsed DOM is cached in the response selector
+            response = HtmlResponse(PAGE_URL.format(q_id=q_id), body=body, encoding='utf-8')
+            start = time.process_time()
+            item_time = None
+            for item in spider.parse(response, q_id):
+                if item_time is None and isinstance(item, Question):
+                    item_time = time.process_time() - start
+            total += time.process_time() - start
+            extraction += item_time if item_time is not None else 0.
+    n = repeat * len(pages)
+    return extraction / n, total / n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of question page parsing by spiders')
+    parser.add_argument('--fixtures', help='Directory with saved pages <question id>.html')
+    parser.add_argument('--synthetic', type=int, default=50, help='Number of synthetic pages without fixtures')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of passes over pages')
+    args = parser.parse_args()
+
+    if args.fixtures is not None:
+        bench_pages = load_pages(args.fixtures)
+    else:
+        bench_pages = [(str(i), synthetic_page(str(i), seed=i).encode('utf-8')) for i in range(args.synthetic)]
+    if len(bench_pages) == 0:
+        raise SystemExit('No pages to parse')
+
+    results = {}
+    for spider_cls in (YandexQuestionsSpider, YandexQuestionIDSpider):
+        results[spider_cls.name] = parse_cpu_time(spider_cls(), bench_pages, args.repeat)
+        extraction_time, total_time = results[spider_cls.name]
+        print(f'{spider_cls.name}: {extraction_time * 1000:.3f} ms item extraction, '
+              f'{total_time * 1000:.3f} ms total CPU per page')
+    full, ids_only = results[YandexQuestionsSpider.name], results[YandexQuestionIDSpider.name]
+    print(f'Id-only parsing is {full[0] / ids_only[0]:.2f}x faster on item extraction, '
+          f'{full[1] / ids_only[1]:.2f}x faster in total')
@@ -0,0 +1,253 @@
+"""
+Crawl instrumentation: histograms of download latency, response sizes, callback CPU time,
+requests generated per page and pipeline stages.
+
+Metrics of one crawler are shared by ``InstrumentationSpiderMiddleware``, item pipelines
+and ``CrawlInstrumentation`` extension, which publishes them into the stats collector
+and periodically dumps them into local JSON and Prometheus text files.
+
+Settings:
+    INSTRUMENTATION_ENABLED: collect metrics
+    INSTRUMENTATION_DUMP_PATH: path of JSON dump, Prometheus text is written next to it with ``.prom`` extension
+    INSTRUMENTATION_INTERVAL: seconds between dumps and stats updates
+"""
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+import bisect
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
+
+from utils.atomic_write import atomic_write_json, atomic_write_text
+
+INTERVAL = 60.
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+SIZE_BUCKETS = tuple(2 ** i for i in range(8, 25, 2))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed bucket upper bounds (Prometheus-like)
+    """
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing q-quantile (max value for the last bucket)"""
+        if self.count == 0:
+            return 0.
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= rank and n > 0:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max
+        }
+
+
+class CrawlMetrics(object):
+    """
+    Histograms and counters identified by metric name and labels
+    """
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = TIME_BUCKETS, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram(buckets)
+        hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe wall time of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def dupefilter_hit_rate(self) -> float:
+        scheduled = self.counter('requests_scheduled')
+        return self.counter('requests_dropped') / scheduled if scheduled else 0.
+
+    def to_stats(self, stats, prefix: str = 'instrumentation') -> None:
+        """Summaries of histograms and counters as values of scrapy stats collector"""
+        for (name, labels), hist in self.histograms.items():
+            key = '/'.join([prefix, name] + [value for _, value in labels])
+            for stat, value in hist.summary().items():
+                stats.set_value(f'{key}/{stat}', value)
+        for (name, labels), value in self.counters.items():
+            stats.set_value('/'.join([prefix, name] + [v for _, v in labels]), value)
+        stats.set_value(f'{prefix}/dupefilter_hit_rate', self.dupefilter_hit_rate())
+
+    def to_dict(self) -> dict:
+        def _key(name: str, labels: Labels) -> str:
+            return name + ''.join(f'[{k}={v}]' for k, v in labels)
+        return {
+            'timestamp': time.time(),
+            'histograms': {_key(*key): hist.summary() for key, hist in sorted(self.histograms.items())},
+            'counters': {_key(*key): value for key, value in sorted(self.counters.items())},
+            'dupefilter_hit_rate': self.dupefilter_hit_rate()
+        }
+
+    def to_prometheus(self, namespace: str = 'scrapy') -> str:
+        """Metrics in Prometheus text exposition format"""
+        def _labels(labels: Labels, extra: str = '') -> str:
+            parts = [f'{k}="{v}"' for k, v in labels]
+            if extra:
+                parts.append(extra)
+            return '{' + ','.join(parts) + '}' if parts else ''
+
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), hist in sorted(self.histograms.items()):
+            metric = f'{namespace}_{name}'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            cumulative = 0
+            for bound, n in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f'{metric}_bucket{_labels(labels, le)} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(labels)} {hist.sum}')
+            lines.append(f'{metric}_count{_labels(labels)} {hist.count}')
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = f'{namespace}_{name}_total'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{_labels(labels)} {value}')
+        lines.append(f'# TYPE {namespace}_dupefilter_hit_rate gauge')
+        lines.append(f'{namespace}_dupefilter_hit_rate {self.dupefilter_hit_rate()}')
+        return '\n'.join(lines) + '\n'
+
+
+_crawler_metrics = WeakKeyDictionary()
+
+
+def metrics_for(crawler) -> Optional[CrawlMetrics]:
+    """Metrics shared by components of the crawler, None if INSTRUMENTATION_ENABLED is not set"""
+    if not crawler.settings.getbool('INSTRUMENTATION_ENABLED'):
+        return None
+    if crawler not in _crawler_metrics:
+        _crawler_metrics[crawler] = CrawlMetrics()
+    return _crawler_metrics[crawler]
+
+
+def stage_timer(metrics: Optional[CrawlMetrics], pipeline: str, stage: str):
+    """Timer of pipeline stage, does nothing if metrics are disabled"""
+    if metrics is None:
+        return nullcontext()
+    return metrics.timer('pipeline_seconds', pipeline=pipeline, stage=stage)
+
+
+def callback_name(request) -> str:
+    """Name of request callback, 'parse' for requests without callback"""
+    callback = request.callback if request is not None else None
+    if callback is None:
+        return 'parse'
+    if isinstance(callback, str):
+        return callback
+    return callback.__name__
+
+
+class CrawlInstrumentation(object):
+    """
+    Extension, which counts scheduled and dupefilter-dropped requests, observes download latency
+    and response sizes, and publishes all crawler metrics every INSTRUMENTATION_INTERVAL seconds
+    """
+    def __init__(self, metrics: CrawlMetrics, stats, dump_path: Optional[str] = None, interval: float = INTERVAL):
+        self.metrics = metrics
+        self.stats = stats
+        self.dump_path = dump_path
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = metrics_for(crawler)
+        if metrics is None:
+            raise NotConfigured('INSTRUMENTATION_ENABLED is not set')
+        ext = cls(
+            metrics,
+            crawler.stats,
+            crawler.settings.get('INSTRUMENTATION_DUMP_PATH'),
+            crawler.settings.getfloat('INSTRUMENTATION_INTERVAL', INTERVAL)
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(ext.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def request_scheduled(self, request, spider):
+        self.metrics.inc('requests_scheduled')
+
+    def request_dropped(self, request, spider):
+        # Requests rejected by the scheduler, i.e. filtered by dupefilter
+        self.metrics.inc('requests_dropped')
+
+    def response_received(self, response, request, spider):
+        callback = callback_name(request)
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.observe('download_latency_seconds', latency, callback=callback)
+        self.metrics.observe('response_bytes', len(response.body), SIZE_BUCKETS, callback=callback)
+
+    def item_scraped(self, item, response, spider):
+        self.metrics.inc('items_scraped')
+
+    def publish(self) -> None:
+        self.metrics.to_stats(self.stats)
+        if self.dump_path:
+            atomic_write_json(self.dump_path, self.metrics.to_dict(), indent=2)
+            atomic_write_text(os.path.splitext(self.dump_path)[0] + '.prom', self.metrics.to_prometheus())
+
+    def spider_opened(self, spider):
+        self.task = task.LoopingCall(self.publish)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.publish()
@@ -3,11 +3,17 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from scrapy import signals, Request
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+import time
+
+from scraping.archive import PageArchive, SEGMENT_SIZE, response_headers
+from scraping.instrumentation import COUNT_BUCKETS, callback_name, metrics_for
+
 
 class ScrapingSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +107,117 @@ class ScrapingDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class ArchiveSpiderMiddleware:
+    """
+    Saves every successful response, which goes into the spider, to ``PageArchive``
+    together with name of its callback and callback kwargs, so pages can be parsed again offline
+    (see ``scraping.reparse``).
+
+    Settings:
+        ARCHIVE_DIR: archive directory, middleware is disabled if not set
+        ARCHIVE_SEGMENT_SIZE: size of one segment file in bytes
+        ARCHIVE_CALLBACKS: names of callbacks, responses of which are archived (all by default)
+    """
+    def __init__(self, archive: PageArchive, callbacks=None):
+        self.archive = archive
+        self.callbacks = set(callbacks) if callbacks else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        archive_dir = crawler.settings.get('ARCHIVE_DIR')
+        if not archive_dir:
+            raise NotConfigured('ARCHIVE_DIR is not set')
+        archive = PageArchive(archive_dir, crawler.settings.getint('ARCHIVE_SEGMENT_SIZE', SEGMENT_SIZE))
+        s = cls(archive, crawler.settings.getlist('ARCHIVE_CALLBACKS'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_input(self, response, spider):
+        if response.status != 200:
+            return None
+        callback = callback_name(response.request)
+        if self.callbacks is not None and callback not in self.callbacks:
+            return None
+
+        self.archive.write(
+            response.url,
+            response.status,
+            response_headers(response.headers),
+            response.body,
+            callback=callback,
+            cb_kwargs=response.request.cb_kwargs if response.request is not None else {}
+        )
+        return None
+
+    def spider_opened(self, spider):
+        spider.logger.info('Archiving responses into %s (%d pages archived)', self.archive.root, len(self.archive))
+
+    def spider_closed(self, spider):
+        self.archive.close()
+
+
+class InstrumentationSpiderMiddleware:
+    """
+    Observes CPU time of every callback, number of requests and items generated per page
+    (see ``scraping.instrumentation``). The middleware must be the closest one to the spider
+    (the largest order in SPIDER_MIDDLEWARES), otherwise time of middlewares after it is included.
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = metrics_for(crawler)
+        if metrics is None:
+            raise NotConfigured('INSTRUMENTATION_ENABLED is not set')
+        return cls(metrics)
+
+    def _observe(self, response, cpu_time: float, n_requests: int, n_items: int) -> None:
+        callback = callback_name(response.request)
+        self.metrics.observe('callback_cpu_seconds', cpu_time, callback=callback)
+        self.metrics.observe('requests_per_page', n_requests, COUNT_BUCKETS, callback=callback)
+        self.metrics.observe('items_per_page', n_items, COUNT_BUCKETS, callback=callback)
+
+    def process_spider_output(self, response, result, spider):
+        cpu_time = 0.
+        n_requests = 0
+        n_items = 0
+        iterator = iter(result)
+        while True:
+            # Only time spent in the callback is counted, not processing of yielded objects downstream
+            start = time.process_time()
+            try:
+                obj = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                cpu_time += time.process_time() - start
+            if isinstance(obj, Request):
+                n_requests += 1
+            elif is_item(obj):
+                n_items += 1
+            yield obj
+        self._observe(response, cpu_time, n_requests, n_items)
+
+    async def process_spider_output_async(self, response, result, spider):
+        cpu_time = 0.
+        n_requests = 0
+        n_items = 0
+        iterator = result.__aiter__()
+        while True:
+            start = time.process_time()
+            try:
+                obj = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                cpu_time += time.process_time() - start
+            if isinstance(obj, Request):
+                n_requests += 1
+            elif is_item(obj):
+                n_items += 1
+            yield obj
+        self._observe(response, cpu_time, n_requests, n_items)
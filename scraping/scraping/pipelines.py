@@ -11,7 +11,9 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 
 from database import Base
+from database.lexical_index import BATCH_SIZE, LexicalIndex, index_path_for
 from database.models import Answer, Question, Tag
+from scraping.instrumentation import metrics_for, stage_timer
 
 
 class ScrapingPipeline:
@@ -24,8 +26,9 @@ class DatabaseSQLPipeline:
     Pipeline which saves parsed question into SQL database
     using models from database module
     """
-    def __init__(self, db_url: str, connect_args=None):
+    def __init__(self, db_url: str, connect_args=None, metrics=None):
         self.db_url = db_url
+        self.metrics = metrics
         if connect_args is None:
             engine = create_engine(db_url)
         else:
@@ -38,7 +41,7 @@ class DatabaseSQLPipeline:
         db_settings = crawler.settings.getdict("DB_SETTINGS")
         if not db_settings:  # if we don't define db config in settings
             raise KeyError('No DB_SETTINGS in crawler settings')  # then reaise error
-        return cls(db_settings['url'], db_settings.get('connect_args', None))
+        return cls(db_settings['url'], db_settings.get('connect_args', None), metrics_for(crawler))
 
     def open_spider(self, spider):
         self.session = self.session_class()
@@ -50,24 +53,26 @@ class DatabaseSQLPipeline:
         # Processed parsed tags
         tags = []
         new_tags_added = False
-        for tag_name in item.get('tags', []):
-            # Get tag object from DB or create if not exists
-            try:
-                tag_obj = self.session.query(Tag).filter(Tag.tag == tag_name).one()
-            except NoResultFound:
-                tag_obj = Tag(tag=tag_name)
-                self.session.add(tag_obj)
-                new_tags_added = True
-
-            tags.append(tag_obj)
-        # Add new tags to DB
-        if new_tags_added:
-            self.session.commit()
+        with stage_timer(self.metrics, 'database', 'tags'):
+            for tag_name in item.get('tags', []):
+                # Get tag object from DB or create if not exists
+                try:
+                    tag_obj = self.session.query(Tag).filter(Tag.tag == tag_name).one()
+                except NoResultFound:
+                    tag_obj = Tag(tag=tag_name)
+                    self.session.add(tag_obj)
+                    new_tags_added = True
+
+                tags.append(tag_obj)
+            # Add new tags to DB
+            if new_tags_added:
+                self.session.commit()
 
         # If same question is in DB, return
         question_short_name = item['question_id']
         if question_short_name is not None:
-            q_obj = self.session.query(Question).filter(Question.short_name == question_short_name).one_or_none()
+            with stage_timer(self.metrics, 'database', 'lookup'):
+                q_obj = self.session.query(Question).filter(Question.short_name == question_short_name).one_or_none()
             if q_obj is not None:
                 spider.logger.debug("The question with id='%s' is already exists", question_short_name)
                 return item
@@ -90,6 +95,57 @@ class DatabaseSQLPipeline:
             self.session.add(ans_obj)
             question.answers.append(ans_obj)
         # Commit all changes
-        self.session.add(question)
-        self.session.commit()
+        with stage_timer(self.metrics, 'database', 'commit'):
+            self.session.add(question)
+            self.session.commit()
+        return item
+
+
+class LexicalIndexPipeline:
+    """
+    Pipeline which adds new questions of SQL database to lexical index,
+    must run after DatabaseSQLPipeline
+    """
+    def __init__(self, db_url: str, index_path: str = None, analyzer: str = 'mystem', batch_size: int = BATCH_SIZE,
+                 connect_args=None):
+        if connect_args is None:
+            self.engine = create_engine(db_url)
+        else:
+            self.engine = create_engine(db_url, connect_args=connect_args)
+        self.index_path = index_path or index_path_for(db_url)
+        self.analyzer = analyzer
+        self.batch_size = batch_size
+        self.n_pending = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        db_settings = crawler.settings.getdict("DB_SETTINGS")
+        if not db_settings:
+            raise KeyError('No DB_SETTINGS in crawler settings')
+        index_settings = crawler.settings.getdict("LEXICAL_INDEX_SETTINGS")
+        return cls(
+            db_settings['url'],
+            index_settings.get('path', None),
+            index_settings.get('analyzer', 'mystem'),
+            index_settings.get('batch_size', BATCH_SIZE),
+            db_settings.get('connect_args', None),
+        )
+
+    def open_spider(self, spider):
+        self.index = LexicalIndex(self.index_path, self.analyzer)
+
+    def close_spider(self, spider):
+        self._update(spider)
+        self.index.close()
+
+    def _update(self, spider):
+        # Questions are lemmatized in batches, new ones are found by ids greater than the last indexed
+        n_added = self.index.update_from_db(self.engine)
+        spider.logger.debug("%d questions are added to lexical index", n_added)
+        self.n_pending = 0
+
+    def process_item(self, item, spider):
+        self.n_pending += 1
+        if self.n_pending >= self.batch_size:
+            self._update(spider)
         return item
@@ -0,0 +1,165 @@
+"""
+Offline re-parsing of archived responses.
+
+Callbacks of the spider are applied to pages from ``PageArchive`` (see ``ArchiveSpiderMiddleware``)
+by a pool of worker processes, extracted items are passed through item pipelines from project settings
+in the main process. Requests produced by callbacks are dropped, nothing is downloaded.
+
+Example (from scraping project directory):
+    python -m scraping.reparse archive/ --spider yandex_questions --workers 8
+"""
+from itemadapter import is_item
+from scrapy import Request
+from scrapy.crawler import Crawler
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.conf import build_component_list
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+import argparse
+import logging
+import multiprocessing as mp
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from scraping.archive import PageArchive, IndexEntry
+
+CHUNK_SIZE = 500
+# Chunks submitted to the pool per worker, parsed items of at most this number of chunks are held in memory
+TASKS_PER_WORKER = 2
+
+logger = logging.getLogger(__name__)
+
+# Worker process state
+_spider = None
+_archive = None
+
+
+def _init_worker(spider_cls, archive_root: str) -> None:
+    global _spider, _archive
+    _spider = spider_cls()
+    _archive = PageArchive(archive_root, read_only=True)
+
+
+def parse_record(spider, record) -> list:
+    """Items extracted by the spider callback from archived response"""
+    callback = getattr(spider, record.callback or 'parse')
+    request = Request(record.url, callback=callback, cb_kwargs=record.cb_kwargs)
+    response = HtmlResponse(
+        record.url,
+        status=record.status,
+        headers=record.headers,
+        body=record.body,
+        request=request,
+        encoding='utf-8'
+    )
+    result = callback(response, **record.cb_kwargs)
+    if result is None:
+        return []
+    return [obj for obj in result if is_item(obj)]
+
+
+def _parse_chunk(entries: List[IndexEntry]) -> list:
+    items = []
+    for record in _archive.iter_entries(entries):
+        try:
+            items.extend(parse_record(_spider, record))
+        except Exception:
+            logger.exception('Failed to parse %s', record.url)
+    return items
+
+
+def build_pipelines(crawler: Crawler) -> list:
+    """Item pipelines enabled in crawler settings in order of their priority"""
+    pipelines = []
+    for cls_path in build_component_list(crawler.settings.getwithbase('ITEM_PIPELINES')):
+        pipeline_cls = load_object(cls_path)
+        if hasattr(pipeline_cls, 'from_crawler'):
+            pipelines.append(pipeline_cls.from_crawler(crawler))
+        else:
+            pipelines.append(pipeline_cls())
+    return pipelines
+
+
+def reparse(archive_root: str, spider_name: str, n_workers: int = 1,
+            chunk_size: int = CHUNK_SIZE, settings=None) -> int:
+    """Parse all archived pages and feed extracted items into item pipelines
+
+    Args:
+        archive_root: archive directory
+        spider_name: name of project spider, which callbacks are used
+        n_workers: number of parsing processes
+        chunk_size: number of pages parsed by one task
+        settings: scrapy settings, project settings by default
+
+    Returns:
+        Number of items, which passed all pipelines
+    """
+    if settings is None:
+        settings = get_project_settings()
+    spider_cls = SpiderLoader.from_settings(settings).load(spider_name)
+    crawler = Crawler(spider_cls, settings)
+    spider = spider_cls()
+    pipelines = build_pipelines(crawler)
+
+    archive = PageArchive(archive_root)
+    entries = archive.entries()
+    chunks = [entries[i:i + chunk_size] for i in range(0, len(entries), chunk_size)]
+
+    for pipeline in pipelines:
+        if hasattr(pipeline, 'open_spider'):
+            pipeline.open_spider(spider)
+
+    n_items = 0
+    n_pages = 0
+    start = time.perf_counter()
+    try:
+        # Spawned workers don't inherit reactor, sqlite connections and open files of the pipelines
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(spider_cls, archive_root)) as executor:
+            # Chunks are consumed in archive order, so pipelines see items in the crawl order
+            pending = deque()
+            chunks_it = iter(chunks)
+            while True:
+                for chunk in chunks_it:
+                    pending.append((executor.submit(_parse_chunk, chunk), len(chunk)))
+                    if len(pending) >= n_workers * TASKS_PER_WORKER:
+                        break
+                if not pending:
+                    break
+                future, n_chunk_pages = pending.popleft()
+                n_pages += n_chunk_pages
+                for item in future.result():
+                    try:
+                        for pipeline in pipelines:
+                            item = pipeline.process_item(item, spider)
+                    except DropItem as e:
+                        logger.debug('Item is dropped: %s', e)
+                        continue
+                    n_items += 1
+                logger.info('%d/%d pages parsed, %d items', n_pages, len(entries), n_items)
+    finally:
+        for pipeline in pipelines:
+            if hasattr(pipeline, 'close_spider'):
+                pipeline.close_spider(spider)
+
+    elapsed = time.perf_counter() - start
+    logger.info('%d pages are parsed in %.1f s (%.1f pages/s)', n_pages, elapsed, n_pages / max(elapsed, 1e-9))
+    return n_items
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parse archived pages and pass items through pipelines')
+    parser.add_argument('archive', help='Archive directory (ARCHIVE_DIR setting of the crawl)')
+    parser.add_argument('--spider', default='yandex_questions', help='Spider name')
+    parser.add_argument('--workers', type=int, default=1, help='Number of parsing processes')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of pages in one task')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    n = reparse(args.archive, args.spider, n_workers=args.workers, chunk_size=args.chunk_size)
+    print(f'{n} items are processed')
@@ -9,7 +9,7 @@
 try:
     from . import sensitive_settings
     have_sensitive = True
-except ModuleNotFoundError:
+except ImportError:
     have_sensitive = False
 
 BOT_NAME = 'scraping'
@@ -29,6 +29,7 @@ ROBOTSTXT_OBEY = False
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
+# With adaptive throttling enabled (see below) it is only the delay of the first requests to a domain
 DOWNLOAD_DELAY = 1.5
 RANDOMIZE_DOWNLOAD_DELAY = True
 # The download delay setting will honor only one of:
@@ -53,6 +54,12 @@ DEFAULT_REQUEST_HEADERS = {
 #    'scraping.middlewares.ScrapingSpiderMiddleware': 543,
 # }
 
+# Archive raw responses for offline re-parsing (python -m scraping.reparse ARCHIVE_DIR)
+# SPIDER_MIDDLEWARES = {
+#    'scraping.middlewares.ArchiveSpiderMiddleware': 100,
+# }
+# ARCHIVE_DIR = 'archive'
+
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 # DOWNLOADER_MIDDLEWARES = {
@@ -65,11 +72,28 @@ DEFAULT_REQUEST_HEADERS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
 # }
 
+# Crawl instrumentation: timing histograms in stats and periodic JSON/Prometheus dumps
+# INSTRUMENTATION_ENABLED = True
+# INSTRUMENTATION_DUMP_PATH = 'crawl_metrics.json'
+# INSTRUMENTATION_INTERVAL = 60
+# EXTENSIONS = {
+#    'scraping.instrumentation.CrawlInstrumentation': 500,
+# }
+# SPIDER_MIDDLEWARES = {
+#    'scraping.middlewares.InstrumentationSpiderMiddleware': 1000,
+# }
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     'scraping.pipelines.DatabaseSQLPipeline': 300,
 }
+# Lexical index of question lemmas next to questions database (questions_lexical.db)
+# ITEM_PIPELINES['scraping.pipelines.LexicalIndexPipeline'] = 400
+# LEXICAL_INDEX_SETTINGS = {
+#     'analyzer': 'mystem',
+#     'batch_size': 1000,
+# }
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -84,6 +108,19 @@ ITEM_PIPELINES = {
 # Enable showing throttling stats for every response received:
 # AUTOTHROTTLE_DEBUG = False
 
+# Adaptive throttling of every domain from latency and 429/captcha rate (scraping.throttle),
+# disabled if AutoThrottle is enabled. Test locally: python -m scraping.standin
+# ADAPTIVE_THROTTLE_ENABLED = True
+# EXTENSIONS = {
+#    'scraping.throttle.AdaptiveThrottle': 500,
+# }
+# Request budget per domain, requests per second (the same rate as DOWNLOAD_DELAY)
+# ADAPTIVE_THROTTLE_TARGET_RPS = 0.67
+# Hard limits
+# ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 8
+# ADAPTIVE_THROTTLE_MIN_DELAY = 0.25
+# ADAPTIVE_THROTTLE_MAX_DELAY = 60
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 # HTTPCACHE_ENABLED = True
@@ -2,7 +2,7 @@ from scrapy import Spider, Request
 from scrapy.http import Response
 
 import re
-from typing import Optional, Generator
+from typing import Optional, Generator, List
 from random import shuffle
 
 from scraping.items import Question, Answer
@@ -67,9 +67,8 @@ class YandexQuestionsSpider(Spider):
                     meta={'filter_mode': 'session'}
                 )
 
-    def parse(self, response: Response, q_id: str, parent_id: Optional[str] = None, **kwargs):
-
-        # Get question text
+    def parse_header(self, response: Response) -> Optional[str]:
+        """Question text from h1 header, None for "not found" page or page without header"""
         non_found_page_cnt = 0
         questions = set()
         for q in response.xpath('//h1/text()').getall():
@@ -79,15 +78,24 @@ class YandexQuestionsSpider(Spider):
                 questions.add(q)
         questions = list(questions)
 
-        if len(questions) == 0 and non_found_page_cnt == 0:
-            self.logger.error('No h1 header found on %s page', response.url)
-        elif len(questions) > 0:
-            if len(questions) > 1:
-                self.logger.warn('Page on %s contains more than one header. The question may be parsed incorrectly',
-                                 response.url)
+        if len(questions) == 0:
+            if non_found_page_cnt == 0:
+                self.logger.error('No h1 header found on %s page', response.url)
+            return None
+        if len(questions) > 1:
+            self.logger.warn('Page on %s contains more than one header. The question may be parsed incorrectly',
+                             response.url)
+        return questions[0]
 
-            question = questions[0]
+    @staticmethod
+    def parse_tags(response: Response) -> List[str]:
+        # This simple rule may fail on some special tags like "Вопросы о коронавирусе"
+        return response.xpath('//h1/following-sibling::div/div/a/text()').getall()
 
+    def parse(self, response: Response, q_id: str, parent_id: Optional[str] = None, **kwargs):
+        # Get question text
+        question = self.parse_header(response)
+        if question is not None:
             answers = []
             # Get all blocks with answers
             # Page inspection shows, that all answers divs have "data-id" attribute
@@ -121,14 +129,11 @@ class YandexQuestionsSpider(Spider):
 
                 answers.append(Answer(text=text, pluses=pluses, minuses=minuses))
 
-            # Get tags
-            # This simple rule may fail on some special tags like "Вопросы о коронавирусе"
-            tags = response.xpath('//h1/following-sibling::div/div/a/text()').getall()
             yield Question(
                 question=question,
                 question_id=q_id,
                 parent_id=parent_id,
-                tags=tags,
+                tags=self.parse_tags(response),
                 answers=answers,
                 url=response.url
             )
@@ -145,20 +150,16 @@ class YandexQuestionIDSpider(YandexQuestionsSpider):
     name = 'yandex_question_ids'
 
     def parse(self, response: Response, q_id: str, parent_id: Optional[str] = None, **kwargs):
-        for item in super(YandexQuestionIDSpider, self).parse(response, q_id, parent_id):
-            if isinstance(item, Question):
-                q_id = item['question_id']
-                parent_id = item.get('parent_id', None)
-                q_url = item['url']
-                q_tags = item.get('tags', [])
-
-                yield Question(
-                    question='',
-                    question_id=q_id,
-                    parent_id=parent_id,
-                    tags=q_tags,
-                    answers=[],
-                    url=q_url
-                )
-            else:
-                yield item
+        # Answers DOM is not touched at all, only header existence and tags are checked
+        if self.parse_header(response) is not None:
+            yield Question(
+                question='',
+                question_id=q_id,
+                parent_id=parent_id,
+                tags=self.parse_tags(response),
+                answers=[],
+                url=response.url
+            )
+        # Follow all links on a page
+        for req in self.follow_urls(response, q_id):
+            yield req
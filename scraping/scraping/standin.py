@@ -0,0 +1,244 @@
+"""
+Local HTTP stand-in of the question site for throttling experiments.
+
+The server returns synthetic question pages (see ``scraping.benchmark``), its latency grows when more
+requests are in flight than its capacity, requests above the rate limit get 429 with Retry-After
+or a redirect to a captcha page, and the server can be slowed down for a period of time.
+``compare`` crawls the stand-in with fixed DOWNLOAD_DELAY and with ``AdaptiveThrottle``.
+
+Example (from scraping project directory):
+    python -m scraping.standin --pages 300 --slowdown 10:20:5
+"""
+from scrapy import Request, Spider
+
+import argparse
+import multiprocessing as mp
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from scraping.benchmark import synthetic_page
+
+QUESTION_PATH = '/q/question/'
+CAPTCHA_PATH = '/showcaptcha'
+CRAWL_TIMEOUT = 3600.
+
+
+class StandInState(object):
+    """
+    Load model of the stand-in server
+
+    Args:
+        base_latency: latency of one request without load, seconds
+        capacity: number of requests processed in parallel without slowdown
+        overload_latency: additional latency for every request in flight above capacity
+        rate_limit: requests per second, above which requests are rejected
+        captcha: reject with redirect to captcha page instead of 429
+        slowdown: (start, end, factor) - latency is multiplied by factor between start and end seconds
+    """
+    def __init__(self, base_latency: float = 0.05, capacity: int = 4, overload_latency: float = 0.1,
+                 rate_limit: float = 20., captcha: bool = False, slowdown: Optional[Tuple[float, float, float]] = None):
+        self.base_latency = base_latency
+        self.capacity = capacity
+        self.overload_latency = overload_latency
+        self.rate_limit = rate_limit
+        self.captcha = captcha
+        self.slowdown = slowdown
+        self.started = time.monotonic()
+        self.in_flight = 0
+        self.recent = deque()
+        self.counts: Dict[str, int] = {'ok': 0, 'rejected': 0}
+        self.lock = threading.Lock()
+
+    def enter(self) -> Tuple[bool, float]:
+        """Register request, returns whether it is rejected and its latency"""
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] > 1.:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                self.counts['rejected'] += 1
+                return True, 0.
+            self.recent.append(now)
+            self.in_flight += 1
+            self.counts['ok'] += 1
+            latency = self.base_latency + self.overload_latency * max(0, self.in_flight - self.capacity)
+        if self.slowdown is not None:
+            start, end, factor = self.slowdown
+            if start <= now - self.started < end:
+                latency *= factor
+        return False, latency
+
+    def leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+
+def make_handler(state: StandInState):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith(CAPTCHA_PATH):
+                self._send(200, b'<html><body>captcha</body></html>')
+                return
+            if not self.path.startswith(QUESTION_PATH):
+                self._send(404, b'')
+                return
+            rejected, latency = state.enter()
+            if rejected:
+                if state.captcha:
+                    self._send(302, b'', {'Location': f'{CAPTCHA_PATH}?retpath={self.path}'})
+                else:
+                    self._send(429, b'', {'Retry-After': '1'})
+                return
+            try:
+                time.sleep(latency)
+                q_id = self.path[len(QUESTION_PATH):].strip('/')
+                self._send(200, synthetic_page(q_id, n_answers=3, n_links=0).encode('utf-8'))
+            finally:
+                state.leave()
+
+        def _send(self, status: int, body: bytes, headers: Optional[dict] = None):
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(state: StandInState, port: int = 0) -> ThreadingHTTPServer:
+    """Start the stand-in in a background thread, actual port is ``server.server_address[1]``"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StandInSpider(Spider):
+    name = 'standin'
+
+    def __init__(self, base_url: str, n_pages: int, **kwargs):
+        super(StandInSpider, self).__init__(**kwargs)
+        self.base_url = base_url
+        self.n_pages = n_pages
+
+    def start_requests(self):
+        for i in range(self.n_pages):
+            yield Request(f'{self.base_url}{QUESTION_PATH}{i}/', callback=self.parse)
+
+    async def start(self):
+        # Scrapy >= 2.13 entry point
+        for request in self.start_requests():
+            yield request
+
+    def parse(self, response, **kwargs):
+        yield {'url': response.url}
+
+
+def _crawl(base_url: str, n_pages: int, settings: dict, result_queue) -> None:
+    from scrapy.crawler import CrawlerProcess
+
+    process = CrawlerProcess(dict(settings, LOG_LEVEL='WARNING', TELNETCONSOLE_ENABLED=False))
+    crawler = process.create_crawler(StandInSpider)
+    start = time.perf_counter()
+    process.crawl(crawler, base_url=base_url, n_pages=n_pages)
+    process.start()
+    stats = crawler.stats.get_stats()
+    result_queue.put({
+        'seconds': time.perf_counter() - start,
+        'items': stats.get('item_scraped_count', 0),
+        'throttled': stats.get('downloader/response_status_count/429', 0)
+                     + stats.get('downloader/response_status_count/302', 0),
+    })
+
+
+def crawl(base_url: str, n_pages: int, settings: dict, timeout: float = CRAWL_TIMEOUT) -> dict:
+    """Crawl the stand-in in a separate process (twisted reactor can't be restarted)
+
+    Raises:
+        RuntimeError: if crawl process exited without result
+        TimeoutError: if crawl didn't finish in ``timeout`` seconds, the process is killed
+    """
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_crawl, args=(base_url, n_pages, settings, result_queue))
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = result_queue.get(timeout=1.)
+            break
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            try:
+                # Result could be put right before the process exited
+                result = result_queue.get(timeout=1.)
+                break
+            except queue.Empty:
+                raise RuntimeError(f'Crawl process exited with code {process.exitcode} without result')
+        if time.monotonic() > deadline:
+            # Scrapy handles SIGTERM by graceful shutdown, which waits for requests in progress
+            process.kill()
+            process.join()
+            raise TimeoutError(f'Crawl did not finish in {timeout} s')
+    process.join()
+    return result
+
+
+FIXED_SETTINGS = {
+    'DOWNLOAD_DELAY': 1.5,
+    'RANDOMIZE_DOWNLOAD_DELAY': True,
+}
+ADAPTIVE_SETTINGS = {
+    'DOWNLOAD_DELAY': 1.5,
+    'ADAPTIVE_THROTTLE_ENABLED': True,
+    'EXTENSIONS': {'scraping.throttle.AdaptiveThrottle': 500},
+}
+
+
+def compare(state_kwargs: dict, n_pages: int, target_rps: float) -> Dict[str, dict]:
+    results = {}
+    for name, settings in (('fixed', FIXED_SETTINGS), ('adaptive', ADAPTIVE_SETTINGS)):
+        state = StandInState(**state_kwargs)
+        server = serve(state)
+        settings = dict(settings, ADAPTIVE_THROTTLE_TARGET_RPS=target_rps, RETRY_HTTP_CODES=[429, 503])
+        try:
+            results[name] = crawl(f'http://127.0.0.1:{server.server_address[1]}', n_pages, settings)
+        finally:
+            server.shutdown()
+            server.server_close()
+        results[name]['rejected_by_server'] = state.counts['rejected']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl local stand-in with fixed and adaptive throttling')
+    parser.add_argument('--pages', type=int, default=200, help='Number of pages to crawl')
+    parser.add_argument('--target-rps', type=float, default=8., help='ADAPTIVE_THROTTLE_TARGET_RPS')
+    parser.add_argument('--latency', type=float, default=0.3, help='Server latency without load, seconds')
+    parser.add_argument('--capacity', type=int, default=4, help='Requests processed in parallel without slowdown')
+    parser.add_argument('--rate-limit', type=float, default=10., help='Requests per second accepted by the server')
+    parser.add_argument('--captcha', action='store_true', help='Redirect to captcha instead of 429')
+    parser.add_argument('--slowdown', help='START:END:FACTOR, latency is multiplied between START and END seconds')
+    args = parser.parse_args()
+
+    server_kwargs = dict(
+        base_latency=args.latency,
+        capacity=args.capacity,
+        rate_limit=args.rate_limit,
+        captcha=args.captcha,
+        slowdown=tuple(map(float, args.slowdown.split(':'))) if args.slowdown else None
+    )
+    for mode, res in compare(server_kwargs, args.pages, args.target_rps).items():
+        print(f'{mode}: {res["items"]} pages in {res["seconds"]:.1f} s ({res["items"] / res["seconds"]:.2f} pages/s), '
+              f'{res["throttled"]} throttled responses, {res["rejected_by_server"]} rejected by server')
@@ -0,0 +1,217 @@
+"""
+Adaptive per-domain throttling.
+
+Concurrency and delay of every downloader slot are tuned from observed latency and error rate:
+delay between requests follows the request budget (``1 / TARGET_RPS``), concurrency grows by one
+after a series of successes up to ``TARGET_RPS * latency`` requests in flight (Little's law), which is
+enough to spend the budget. Errors (429/503, captcha pages, timeouts) halve concurrency and double delay
+(respecting Retry-After), latency above the limit reduces concurrency. Both values are kept within hard limits.
+
+Settings:
+    ADAPTIVE_THROTTLE_ENABLED: enable the extension
+    ADAPTIVE_THROTTLE_TARGET_RPS: request budget per domain (requests per second)
+    ADAPTIVE_THROTTLE_START_CONCURRENCY, ADAPTIVE_THROTTLE_MAX_CONCURRENCY: concurrency of a new slot and its ceiling
+    ADAPTIVE_THROTTLE_MIN_DELAY, ADAPTIVE_THROTTLE_MAX_DELAY: limits of delay between requests in seconds
+    ADAPTIVE_THROTTLE_MAX_LATENCY: latency, above which the server is considered overloaded
+    ADAPTIVE_THROTTLE_ERROR_RATE: error rate in recent responses, above which concurrency is not increased
+    ADAPTIVE_THROTTLE_ERROR_STATUSES: statuses treated as throttling errors
+    ADAPTIVE_THROTTLE_CAPTCHA_MARKERS: substrings of captcha page urls
+    ADAPTIVE_THROTTLE_DEBUG: log every adjustment
+"""
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+import logging
+import math
+from collections import deque
+from typing import Dict, Optional
+
+TARGET_RPS = 2.
+START_CONCURRENCY = 1
+MAX_CONCURRENCY = 8
+MIN_DELAY = 0.1
+MAX_DELAY = 60.
+MAX_LATENCY = 5.
+ERROR_RATE = 0.05
+ERROR_STATUSES = (429, 503)
+CAPTCHA_MARKERS = ('showcaptcha',)
+WINDOW_SIZE = 50
+INCREASE_AFTER = 10
+LATENCY_SMOOTHING = 0.3
+DELAY_RECOVERY = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottlePolicy(object):
+    """
+    Concurrency and delay of one domain (AIMD on errors, Little's law on latency)
+    """
+    def __init__(self, target_rps: float = TARGET_RPS, start_concurrency: int = START_CONCURRENCY,
+                 max_concurrency: int = MAX_CONCURRENCY, min_delay: float = MIN_DELAY, max_delay: float = MAX_DELAY,
+                 max_latency: float = MAX_LATENCY, error_rate: float = ERROR_RATE, start_delay: Optional[float] = None):
+        self.target_rps = target_rps
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_latency = max_latency
+        self.max_error_rate = error_rate
+
+        self.concurrency = min(max(1, start_concurrency), max_concurrency)
+        self.delay = self._clip_delay(start_delay if start_delay is not None else 1. / target_rps)
+        self.latency = None
+        self.outcomes = deque(maxlen=WINDOW_SIZE)
+        self.successes = 0
+
+    def _clip_delay(self, delay: float) -> float:
+        return min(max(self.min_delay, delay), self.max_delay)
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.
+
+    def on_success(self, latency: float) -> None:
+        self.outcomes.append(False)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+        if self.latency > self.max_latency:
+            # Server slows down: fewer requests in flight, do not shorten delay
+            self.successes = 0
+            self.concurrency = max(1, self.concurrency - 1)
+            return
+
+        self.successes += 1
+        if self.error_rate > self.max_error_rate:
+            return
+        # Requests in flight needed to reach the budget; concurrency grows by one step at a time
+        needed = max(1, math.ceil(self.target_rps * self.latency))
+        if self.successes >= INCREASE_AFTER and self.concurrency < needed:
+            self.concurrency += 1
+            self.successes = 0
+        elif self.concurrency > needed:
+            self.concurrency = needed
+        self.concurrency = min(self.concurrency, self.max_concurrency)
+        # Delay slowly returns to the budget after backoff
+        target_delay = 1. / self.target_rps
+        if self.delay > target_delay:
+            self.delay -= DELAY_RECOVERY * (self.delay - target_delay)
+        self.delay = self._clip_delay(max(self.delay, target_delay))
+
+    def on_error(self, retry_after: Optional[float] = None) -> None:
+        self.outcomes.append(True)
+        self.successes = 0
+        self.concurrency = max(1, self.concurrency // 2)
+        delay = max(self.delay * 2, 1. / self.target_rps)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        self.delay = self._clip_delay(delay)
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Retry-After header in seconds (HTTP dates are not supported)"""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return float(value.decode('latin-1'))
+    except ValueError:
+        return None
+
+
+class AdaptiveThrottle(object):
+    """
+    Extension, which applies ``ThrottlePolicy`` of every download slot to the downloader
+    """
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured('ADAPTIVE_THROTTLE_ENABLED is not set')
+        if settings.getbool('AUTOTHROTTLE_ENABLED'):
+            raise NotConfigured('AutoThrottle is enabled, adaptive throttle is disabled')
+        self.crawler = crawler
+        self.debug = settings.getbool('ADAPTIVE_THROTTLE_DEBUG')
+        self.error_statuses = set(map(int, settings.getlist('ADAPTIVE_THROTTLE_ERROR_STATUSES', ERROR_STATUSES)))
+        self.captcha_markers = settings.getlist('ADAPTIVE_THROTTLE_CAPTCHA_MARKERS', CAPTCHA_MARKERS)
+        self.policy_kwargs = dict(
+            target_rps=settings.getfloat('ADAPTIVE_THROTTLE_TARGET_RPS', TARGET_RPS),
+            start_concurrency=settings.getint('ADAPTIVE_THROTTLE_START_CONCURRENCY', START_CONCURRENCY),
+            max_concurrency=settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', MAX_CONCURRENCY),
+            min_delay=settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY', MIN_DELAY),
+            max_delay=settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', MAX_DELAY),
+            max_latency=settings.getfloat('ADAPTIVE_THROTTLE_MAX_LATENCY', MAX_LATENCY),
+            error_rate=settings.getfloat('ADAPTIVE_THROTTLE_ERROR_RATE', ERROR_RATE),
+        )
+        self.policies: Dict[str, ThrottlePolicy] = {}
+        crawler.signals.connect(self.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(self.request_left_downloader, signal=signals.request_left_downloader)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def _slot(self, request):
+        key = request.meta.get('download_slot')
+        if key is None:
+            return None, None
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def _apply(self, key: str, slot) -> None:
+        policy = self.policies[key]
+        if self.debug and (slot.concurrency != policy.concurrency or abs(slot.delay - policy.delay) > 1e-3):
+            logger.info('slot %s: concurrency %d -> %d, delay %.2f -> %.2f s (latency %s, error rate %.2f)',
+                        key, slot.concurrency, policy.concurrency, slot.delay, policy.delay,
+                        'n/a' if policy.latency is None else f'{policy.latency:.2f} s', policy.error_rate)
+        slot.concurrency = policy.concurrency
+        slot.delay = policy.delay
+        stats = self.crawler.stats
+        stats.set_value(f'adaptive_throttle/{key}/concurrency', policy.concurrency)
+        stats.set_value(f'adaptive_throttle/{key}/delay', policy.delay)
+
+    def request_reached_downloader(self, request, spider):
+        key, slot = self._slot(request)
+        if slot is None:
+            return
+        if key not in self.policies:
+            self.policies[key] = ThrottlePolicy(**self.policy_kwargs, start_delay=slot.delay)
+        # Slot may be recreated by the downloader after idle time, policy state is kept
+        policy = self.policies[key]
+        if slot.concurrency != policy.concurrency or slot.delay != policy.delay:
+            self._apply(key, slot)
+
+    def is_error(self, response) -> bool:
+        if response.status in self.error_statuses:
+            return True
+        location = response.headers.get('Location', b'').decode('latin-1')
+        return any(marker in response.url or marker in location for marker in self.captcha_markers)
+
+    def response_downloaded(self, response, request, spider):
+        key, slot = self._slot(request)
+        if slot is None or key not in self.policies:
+            return
+        request.meta['adaptive_throttle_seen'] = True
+        policy = self.policies[key]
+        if self.is_error(response):
+            policy.on_error(retry_after_seconds(response))
+            self.crawler.stats.inc_value('adaptive_throttle/errors')
+        else:
+            latency = request.meta.get('download_latency')
+            if latency is None:
+                return
+            policy.on_success(latency)
+        self._apply(key, slot)
+
+    def request_left_downloader(self, request, spider):
+        # Request left downloader without response: timeout or connection error.
+        # The flag is removed, because retries and redirects copy meta of the request
+        if request.meta.pop('adaptive_throttle_seen', False):
+            return
+        key, slot = self._slot(request)
+        if slot is None or key not in self.policies:
+            return
+        self.policies[key].on_error()
+        self.crawler.stats.inc_value('adaptive_throttle/errors')
+        self._apply(key, slot)
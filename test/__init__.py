@@ -0,0 +1,7 @@
+import sys
+from os import path
+
+# Scrapy project package 'scraping' is in scraping/ directory of the repository
+SCRAPY_PROJECT_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'scraping')
+if SCRAPY_PROJECT_DIR not in sys.path:
+    sys.path.append(SCRAPY_PROJECT_DIR)
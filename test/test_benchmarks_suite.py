@@ -0,0 +1,39 @@
+from unittest import TestCase, mock
+import importlib
+
+from benchmarks import generators
+from benchmarks.suite import BENCHMARKS, compare, time_benchmark
+
+
+class Test(TestCase):
+    def test_generators(self):
+        self.assertEqual(generators.synthetic_questions(20, seed=1), generators.synthetic_questions(20, seed=1))
+        assignments = generators.toloka_assignments(30, tasks_per_assignment=5, seed=1)
+        self.assertEqual(150, len(assignments))
+        self.assertEqual(30, assignments['ASSIGNMENT:assignment_id'].nunique())
+        # Every assignment is done by one worker
+        self.assertTrue((assignments.groupby('ASSIGNMENT:assignment_id')['ASSIGNMENT:worker_id'].nunique() == 1).all())
+
+    def test_time_benchmark(self):
+        for name in ('propagate_verdict', 'get_q_text', 'database_pipeline',
+                     'sanitize_unicode', 'is_valid_unicode_range', 'obscene_filter', 'ipm_filter'):
+            result = time_benchmark(BENCHMARKS[name], 5, repeat=2)
+            self.assertEqual(2, len(result['seconds']))
+            self.assertLessEqual(result['min'], result['median'])
+
+    def test_compare(self):
+        baseline = {'results': {
+            'a/10': {'median': 1.}, 'b/10': {'median': 1.}, 'c/10': {'skipped': 'No module named x'}
+        }}
+        current = {'results': {
+            'a/10': {'median': 1.1}, 'b/10': {'median': 1.5}, 'c/10': {'median': 1.}, 'd/10': {'median': 1.}
+        }}
+        rows = compare(baseline, current, tolerance=0.2)
+        self.assertEqual(['a/10', 'b/10'], [row['key'] for row in rows])
+        self.assertEqual([False, True], [row['regression'] for row in rows])
+
+    def test_offline_import(self):
+        # NLTK data mustn't be downloaded on import of preprocessing code
+        with mock.patch('nltk.download', side_effect=AssertionError('NLTK download on import')):
+            from preprocessing import preprocessing
+            importlib.reload(preprocessing)
@@ -0,0 +1,67 @@
+from unittest import TestCase, mock
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import os
+import tempfile
+from os import path
+
+from database import Base
+from database.models import Answer, Question, Tag
+from database.export import CSV_NAME, export
+
+
+class Test(TestCase):
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = f'sqlite:///{path.join(tmp_dir, "questions.db")}'
+            engine = create_engine(db_url)
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                science, physics = Tag(tag='science'), Tag(tag='physics')
+                for i in range(7):
+                    q = Question(text=f'Вопрос {i}?', url=f'https://yandex.ru/q/question/{i}/', short_name=str(i))
+                    q.tags.extend([science, physics][:i % 3])
+                    q.answers.extend(Answer(text=f'Ответ {j}', pluses=j) for j in range(i % 2 + 1))
+                    session.add(q)
+                session.commit()
+
+            out_dir = path.join(tmp_dir, 'out')
+            self.assertEqual(7, export(db_url, out_dir, batch_size=2, partition_size=3, silent=True))
+
+            csv = pd.read_csv(path.join(out_dir, CSV_NAME), sep=';', keep_default_na=False)
+            self.assertEqual(list(range(1, 8)), csv['id'].tolist())
+            self.assertEqual(['', 'science', 'science|physics'], csv['tags'].tolist()[:3])
+
+            questions = pq.read_table(path.join(out_dir, 'questions')).to_pandas()
+            self.assertEqual(7, len(questions))
+            self.assertEqual(['science', 'physics'], list(questions['tags'].iat[2]))
+            answers = pq.read_table(path.join(out_dir, 'answers'))
+            self.assertEqual(sum(i % 2 + 1 for i in range(7)), answers.num_rows)
+            self.assertEqual(3, len(pq.ParquetDataset(path.join(out_dir, 'questions')).files))
+
+    def test_replace(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = f'sqlite:///{path.join(tmp_dir, "questions.db")}'
+            engine = create_engine(db_url)
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                session.add_all(Question(text=f'Вопрос {i}?', url=f'https://yandex.ru/q/question/{i}/')
+                                for i in range(5))
+                session.commit()
+
+            out_dir = path.join(tmp_dir, 'out')
+            export(db_url, out_dir, partition_size=1, silent=True)
+            # Failed export keeps the previous dataset
+            with mock.patch('database.export.answers_table', side_effect=RuntimeError('Export failed')):
+                with self.assertRaises(RuntimeError):
+                    export(db_url, out_dir, partition_size=2, silent=True)
+            self.assertEqual(5, len(os.listdir(path.join(out_dir, 'questions'))))
+
+            # Partitions of the previous export are replaced, not mixed with the new ones
+            export(db_url, out_dir, partition_size=2, silent=True)
+            self.assertEqual(3, len(os.listdir(path.join(out_dir, 'questions'))))
+            self.assertEqual(5, pq.read_table(path.join(out_dir, 'questions')).num_rows)
+            self.assertEqual(['All_questions_with_tags.csv', 'answers', 'questions'], sorted(os.listdir(out_dir)))
@@ -0,0 +1,59 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from database import Base
+from database.lexical_index import IndexMismatchError, LexicalIndex, combine_scores, index_path_for
+from database.models import Question
+
+TEXTS = [
+    'Как научиться играть на гитаре?',
+    'Как быстро научиться играть на гитаре самому?',
+    'Почему небо голубое?',
+    'Почему небо днем голубое, а ночью черное?',
+    'Где купить гитару недорого?',
+]
+
+
+class Test(TestCase):
+    def test_incremental_update(self):
+        with TemporaryDirectory() as tmp_dir:
+            db_url = f'sqlite:///{path.join(tmp_dir, "questions.db")}'
+            self.assertEqual(path.join(tmp_dir, 'questions_lexical.db'), index_path_for(db_url))
+            engine = create_engine(db_url)
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                session.add_all([Question(text=text, url='') for text in TEXTS[:3]])
+                session.commit()
+
+            index = LexicalIndex(index_path_for(db_url), 'words')
+            self.assertEqual(3, index.update_from_db(engine, batch_size=2))
+            self.assertEqual(0, index.update_from_db(engine))
+            with Session(engine) as session:
+                session.add_all([Question(text=text, url='') for text in TEXTS[3:]])
+                session.commit()
+            self.assertEqual(2, index.update_from_db(engine))
+            self.assertEqual(5, len(index))
+
+            left, right, scores = index.topk_for_ids([1, 3], k=2)
+            # Without lemmatization 'гитару' doesn't match 'гитаре'
+            self.assertEqual([1, 3], left.tolist())
+            self.assertEqual([2, 4], right.tolist())
+            self.assertTrue(np.all(scores > 0))
+
+            left, right, _ = index.topk([100], ['небо голубое'], k=10)
+            self.assertEqual({3, 4}, set(right.tolist()))
+            index.close()
+
+            with self.assertRaises(IndexMismatchError):
+                LexicalIndex(index_path_for(db_url), 'mystem')
+
+    def test_combine_scores(self):
+        embeddings = np.array([[1., 0.], [1., 0.], [0., 1.]])
+        combined = combine_scores(
+            np.array([10, 10]), np.array([20, 30]), np.array([2., 1.]), np.array([30, 10, 20]), embeddings, 0.5
+        )
+        self.assertTrue(np.allclose([0.5, 0.75], combined))
@@ -0,0 +1,36 @@
+from unittest import TestCase
+import numpy as np
+
+from models.dataset import PairDataset, CrossEncoderCollator, SiameseCollator, LengthBucketSampler
+
+CLS, SEP, PAD = 101, 102, 0
+
+
+class Test(TestCase):
+    def setUp(self):
+        left = [[5, 6], [7], [8, 9, 10]]
+        right = [[11], [12, 13, 14], [15]]
+        offsets = [np.cumsum([0] + [len(x) for x in side]) for side in (left, right)]
+        self.dataset = PairDataset(
+            np.concatenate(left), offsets[0], np.concatenate(right), offsets[1], np.array([1, 0, 1])
+        )
+
+    def test_cross_encoder(self):
+        batch = CrossEncoderCollator(self.dataset, CLS, SEP, PAD)([1, 0])
+        tokens, token_types = batch.text
+        self.assertEqual([[CLS, 7, SEP, 12, 13, 14, SEP], [CLS, 5, 6, SEP, 11, SEP, PAD]], tokens.tolist())
+        self.assertEqual([[0, 0, 0, 1, 1, 1, 1], [0, 0, 0, 0, 1, 1, 0]], token_types.tolist())
+        self.assertEqual([0, 1], batch.label.tolist())
+
+    def test_siamese(self):
+        batch = SiameseCollator(self.dataset, CLS, SEP, PAD, max_length=4)([2, 1])
+        left, right = batch.text
+        self.assertEqual([[CLS, 8, 9, SEP], [CLS, 7, SEP, PAD]], left.tolist())
+        self.assertEqual([[CLS, 15, SEP, PAD], [CLS, 12, 13, SEP]], right.tolist())
+
+    def test_sampler(self):
+        lengths = np.random.RandomState(0).randint(1, 100, size=1000)
+        batches = list(LengthBucketSampler(lengths, batch_size=32, seed=0))
+        self.assertEqual(list(range(1000)), sorted(i for batch in batches for i in batch))
+        eval_order = [i for batch in LengthBucketSampler(lengths, batch_size=32, shuffle=False) for i in batch]
+        self.assertTrue(np.all(np.diff(lengths[eval_order]) >= 0))
@@ -0,0 +1,29 @@
+from unittest import TestCase, mock
+from tempfile import TemporaryDirectory
+from os import path
+
+from models.run_experiments import binary_metrics, run_experiments
+
+
+def stub_job(config, seed, data_dir, n_threads):
+    """Job of run_experiments, which fails for seed 2"""
+    if seed == 2:
+        raise RuntimeError('Training failed')
+    return {'config': config['name'], 'seed': seed, 'accuracy': 0.5, 'f1': 0.5, 'roc_auc': 0.5, 'val_accuracy': 0.5}
+
+
+class Test(TestCase):
+    def test_binary_metrics(self):
+        metrics = binary_metrics([0, 1, 1, 0], [0, 1, 0, 0], [0.1, 0.9, 0.4, 0.3])
+        self.assertEqual({'accuracy': 0.75, 'f1': 2 / 3, 'roc_auc': 1.}, metrics)
+
+    @mock.patch('models.run_experiments.prepare_datasets')
+    @mock.patch('models.run_experiments.AutoTokenizer')
+    def test_failed_job(self, *mocks):
+        configs = [{'name': 'a', 'model_name': 'model/a'}, {'name': 'b', 'model_name': 'model/b'}]
+        with TemporaryDirectory() as tmp_dir:
+            results_path = path.join(tmp_dir, 'results.csv')
+            results = run_experiments(configs, {}, results_path, tmp_dir, seeds=[1, 2, 3], n_jobs=2, job=stub_job)
+            # Results of all jobs except the failed ones are written
+            self.assertEqual([('a', 1), ('a', 3), ('b', 1), ('b', 3)],
+                             sorted(zip(results['config'], results['seed'])))
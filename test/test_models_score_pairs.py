@@ -0,0 +1,86 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+import os
+from os import path
+import pandas as pd
+import numpy as np
+
+from models.score_pairs import score_file
+
+
+class StubScorer(object):
+    """Probability is left_id / 100, fails after given number of chunks"""
+    token_cache = None
+
+    def __init__(self, fail_after: int = -1):
+        self.fail_after = fail_after
+        self.n_chunks = 0
+
+    def score(self, chunk: pd.DataFrame) -> np.ndarray:
+        if self.n_chunks == self.fail_after:
+            raise RuntimeError('Scoring is interrupted')
+        self.n_chunks += 1
+        return chunk['left_id'].to_numpy() / 100
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.input_path = path.join(self.tmp_dir.name, 'pairs.tsv')
+        self.output_path = path.join(self.tmp_dir.name, 'scores.tsv')
+        pd.DataFrame({
+            'left_id': np.arange(10), 'right_id': np.arange(10, 20),
+            'left_text': ['left'] * 10, 'right_text': ['right'] * 10
+        }).to_csv(self.input_path, sep='\t', index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_output(self) -> pd.DataFrame:
+        return pd.read_csv(self.output_path, sep='\t')
+
+    def test_resume(self):
+        with self.assertRaises(RuntimeError):
+            score_file(StubScorer(fail_after=2), self.input_path, self.output_path, chunk_size=3, silent=True)
+        # Rows written after the last checkpoint are dropped on resume
+        with open(self.output_path, 'a') as f:
+            f.write('100\t200\t0.5\n')
+        self.assertEqual(4, score_file(StubScorer(), self.input_path, self.output_path, chunk_size=3, silent=True))
+        out = self.read_output()
+        self.assertEqual(list(range(10)), out['left_id'].tolist())
+        self.assertTrue(np.allclose(np.arange(10) / 100, out['prob']))
+
+    def test_truncated_output(self):
+        with self.assertRaises(RuntimeError):
+            score_file(StubScorer(fail_after=2), self.input_path, self.output_path, chunk_size=3, silent=True)
+        with open(self.output_path, 'r+b') as f:
+            f.truncate(20)
+        self.assertEqual(10, score_file(StubScorer(), self.input_path, self.output_path, chunk_size=3, silent=True))
+        self.assertEqual(list(range(10)), self.read_output()['left_id'].tolist())
+
+        # Missing output is scored again as well
+        os.remove(self.output_path)
+        self.assertEqual(10, score_file(StubScorer(), self.input_path, self.output_path, chunk_size=3, silent=True))
+        self.assertEqual(list(range(10)), self.read_output()['left_id'].tolist())
+
+    def test_changed_sources(self):
+        model_info = {'model': 'stub', 'checkpoint': None}
+        with self.assertRaises(RuntimeError):
+            score_file(StubScorer(fail_after=1), self.input_path, self.output_path, chunk_size=3, silent=True,
+                       model_info=model_info)
+        with self.assertRaises(ValueError):
+            score_file(StubScorer(), self.input_path, self.output_path, chunk_size=3, silent=True,
+                       model_info={'model': 'stub', 'checkpoint': 'other.pt'})
+
+        with open(self.input_path, 'a') as f:
+            f.write('10\t20\tleft\tright\n')
+        with self.assertRaises(ValueError):
+            score_file(StubScorer(), self.input_path, self.output_path, chunk_size=3, silent=True,
+                       model_info=model_info)
+        # Output is kept until progress file is removed
+        self.assertEqual([0, 1, 2], self.read_output()['left_id'].tolist())
+
+        os.remove(self.output_path + '.progress.json')
+        self.assertEqual(11, score_file(StubScorer(), self.input_path, self.output_path, chunk_size=3, silent=True,
+                                        model_info=model_info))
+        self.assertEqual(list(range(11)), self.read_output()['left_id'].tolist())
@@ -0,0 +1,114 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import numpy as np
+import torch
+from torch import nn
+
+from models.dataset import PairDataset, SiameseCollator
+from models.siamese_cache import EmbeddingCache, SiameseScorer
+from models.transformer import SiameseClf
+from utils.embedding_store import EmbeddingStore
+
+CLS, SEP, PAD = 1, 2, 0
+
+
+class TinySiamese(SiameseClf):
+    """SiameseClf with bag of embeddings encoder instead of pretrained transformer"""
+    def __init__(self, vocab_size: int = 20, num_classes: int = 2):
+        nn.Module.__init__(self)
+        self.output_size = 8
+        self.embedding = nn.Embedding(vocab_size, self.output_size)
+        self.clf = nn.Sequential(nn.Linear(2 * self.output_size, num_classes))
+
+    def encode(self, x, mask=None):
+        emb = self.embedding(x)
+        if mask is None:
+            return emb.mean(dim=1)
+        return (emb * mask.unsqueeze(-1)).sum(dim=1) / mask.sum(dim=1, keepdim=True)
+
+
+class StubTokens(object):
+    """Token ids of questions by their ids, records every requested id"""
+    def __init__(self, questions):
+        self.questions = questions
+        self.requested = []
+
+    def __call__(self, ids):
+        self.requested.extend(ids.tolist())
+        return [self.questions[q_id] for q_id in ids.tolist()]
+
+
+def random_questions(n: int, rng: np.random.RandomState):
+    return {q_id: rng.randint(3, 20, size=rng.randint(1, 6)) for q_id in range(n)}
+
+
+class Test(TestCase):
+    def test_lru(self):
+        cache = EmbeddingCache(2, max_size=2)
+        cache.put([1, 2], np.array([[1, 1], [2, 2]]))
+        cache.get([1])
+        cache.put([3], np.array([[3, 3]]))
+        found, embeddings = cache.get([1, 2, 3])
+        self.assertEqual([True, False, True], found.tolist())
+        np.testing.assert_array_equal([[1, 1], [0, 0], [3, 3]], embeddings)
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_store(self):
+        with TemporaryDirectory() as tmp_dir:
+            store = EmbeddingStore.create(path.join(tmp_dir, 'store'), 2)
+            self.assertRaises(ValueError, EmbeddingCache, 3, store=store)
+            cache = EmbeddingCache(2, max_size=1, store=store)
+            cache.put([1, 2], np.array([[1, 1], [2, 2]]))
+            # Embedding 1 is evicted from memory, but written through to the store
+            self.assertEqual(1, len(cache))
+            self.assertEqual([1, 2], store.ids.tolist())
+            found, embeddings = cache.get([1, 5])
+            self.assertEqual([True, False], found.tolist())
+            np.testing.assert_array_equal([[1, 1], [0, 0]], embeddings)
+            # Embedding from the store is put into memory
+            self.assertEqual([1], list(cache._cache))
+
+            found, _ = EmbeddingCache(2, store=EmbeddingStore(store.root)).get([2])
+            self.assertTrue(found.all())
+
+    def test_score_pairs(self):
+        rng = np.random.RandomState(0)
+        questions = random_questions(10, rng)
+        torch.manual_seed(0)
+        scorer = SiameseScorer(TinySiamese(), CLS, SEP, PAD, cache=EmbeddingCache(8, max_size=100))
+        get_tokens = StubTokens(questions)
+
+        left_ids = rng.randint(0, 10, size=50)
+        right_ids = rng.randint(0, 10, size=50)
+        scores = scorer.score_pairs(left_ids, right_ids, get_tokens, batch_size=7)
+        self.assertEqual((50, 2), scores.shape)
+        np.testing.assert_allclose(1., scores.sum(axis=1), rtol=1e-6)
+        self.assertEqual(sorted(get_tokens.requested), sorted(set(left_ids) | set(right_ids)))
+
+        np.testing.assert_allclose(scores, scorer.score_pairs(left_ids, right_ids, get_tokens), rtol=1e-5)
+        self.assertEqual(len(set(left_ids) | set(right_ids)), len(get_tokens.requested))
+        self.assertEqual((0, 2), scorer.score_pairs([], [], get_tokens).shape)
+
+    def test_score_dataset(self):
+        rng = np.random.RandomState(1)
+        questions = random_questions(12, rng)
+        left_ids = rng.randint(0, 12, size=30)
+        right_ids = rng.randint(0, 12, size=30)
+        left = [questions[q_id] for q_id in left_ids]
+        right = [questions[q_id] for q_id in right_ids]
+        offsets = [np.cumsum([0] + [len(x) for x in side]) for side in (left, right)]
+        dataset = PairDataset(np.concatenate(left), offsets[0], np.concatenate(right), offsets[1],
+                              rng.randint(0, 2, size=30), left_ids=left_ids, right_ids=right_ids)
+
+        torch.manual_seed(0)
+        model = TinySiamese()
+        scores = SiameseScorer(model, CLS, SEP, PAD, max_tokens=16).score_dataset(dataset, batch_size=8)
+
+        (left_tokens, right_tokens), _ = SiameseCollator(dataset, CLS, SEP, PAD)(np.arange(30))
+        with torch.no_grad():
+            logits = model(left_tokens, right_tokens, left_tokens != PAD, right_tokens != PAD)
+        np.testing.assert_allclose(torch.softmax(logits, dim=1).numpy(), scores, rtol=1e-5, atol=1e-6)
+
+        dataset.left_ids = None
+        self.assertRaises(ValueError, SiameseScorer(model, CLS, SEP, PAD).score_dataset, dataset)
@@ -0,0 +1,59 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import json
+import numpy as np
+import torch
+from torch import nn
+
+from models.dataset import PairDataset, SiameseCollator, make_loader
+from models.trainer import Trainer
+from models.transformer import SiameseClf
+
+CLS, SEP, PAD = 1, 2, 0
+
+
+class TinySiamese(SiameseClf):
+    """SiameseClf with bag of embeddings encoder instead of pretrained transformer"""
+    def __init__(self, vocab_size: int = 20, num_classes: int = 2):
+        nn.Module.__init__(self)
+        self.embedding = nn.Embedding(vocab_size, 8)
+        self.clf = nn.Linear(16, num_classes)
+
+    def encode(self, x, mask=None):
+        emb = self.embedding(x)
+        if mask is None:
+            return emb.mean(dim=1)
+        return (emb * mask.unsqueeze(-1)).sum(dim=1) / mask.sum(dim=1, keepdim=True)
+
+
+class Test(TestCase):
+    def test_siamese(self):
+        rng = np.random.RandomState(0)
+        left = [rng.randint(3, 20, size=rng.randint(1, 5)) for _ in range(40)]
+        right = [rng.randint(3, 20, size=rng.randint(1, 5)) for _ in range(40)]
+        offsets = [np.cumsum([0] + [len(x) for x in side]) for side in (left, right)]
+        dataset = PairDataset(np.concatenate(left), offsets[0], np.concatenate(right), offsets[1],
+                              rng.randint(0, 2, size=40))
+        collator = SiameseCollator(dataset, CLS, SEP, PAD)
+        loader = make_loader(dataset, collator, batch_size=8, shuffle=False, siamese=True)
+
+        torch.manual_seed(0)
+        model = TinySiamese()
+        with TemporaryDirectory() as tmp_dir:
+            metrics_path = path.join(tmp_dir, 'metrics.jsonl')
+            trainer = Trainer(pad_index=PAD, silent=True, metrics_path=metrics_path)
+            trainer.train(model, loader, loader, nn.CrossEntropyLoss(),
+                          torch.optim.Adam(model.parameters(), lr=0.01), total_epochs=2)
+            # Metrics file is closed after training
+            self.assertIsNone(trainer.metrics._file)
+            with open(metrics_path) as f:
+                records = [json.loads(line) for line in f]
+            n_tokens = sum(len(x) + 2 for x in left + right)
+            self.assertAlmostEqual(n_tokens, sum(r['tokens_per_sec'] * (r['data_time'] + r['compute_time'])
+                                           for r in records if r.get('epoch') == 0 and 'step' in r), places=6)
+            self.assertEqual(2, sum('val_accuracy' in r for r in records))
+
+            labels, preds, scores = trainer.predict(model, loader)
+            self.assertEqual(40, len(labels))
+            self.assertTrue(np.all((scores >= 0) & (scores <= 1)))
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from preprocessing.lemmatizers import MystemLemmatizer, PymorphyLemmatizer, get_lemmatizer, lemma_agreement
+
+
+class StubMystem(object):
+    """
+    Mystem output format: words and spaces are tokens, every line ends with a token containing newline.
+    With ``merge_lines`` newlines between sentences are lost, like Mystem does on some inputs.
+    """
+    def __init__(self, merge_lines: bool = False):
+        self.merge_lines = merge_lines
+
+    def lemmatize(self, text):
+        lines = text.split('\n')
+        tokens = []
+        for i, line in enumerate(lines):
+            for j, word in enumerate(line.lower().split()):
+                if j > 0:
+                    tokens.append(' ')
+                tokens.append(word)
+            last = i == len(lines) - 1
+            tokens.append('\n' if last or not self.merge_lines else ' ')
+        return tokens
+
+
+class StubMorphCache(object):
+    def lemmas(self, tokens, skip_punct=True):
+        return [tok.lower() for tok in tokens]
+
+
+class Test(TestCase):
+    def test_mystem_chunks(self):
+        sentences = ['Кот идет', 'Собаки лают громко', 'Да']
+        expected = [['кот', ' ', 'идет', ''], ['собаки', ' ', 'лают', ' ', 'громко', ''], ['да', '']]
+        self.assertEqual(expected, MystemLemmatizer(chunk_size=2, mystem=StubMystem()).lemmatize_all(sentences))
+        # Lost sentence boundaries are recovered by lemmatizing sentences one by one
+        lossy = MystemLemmatizer(chunk_size=2, mystem=StubMystem(merge_lines=True))
+        self.assertEqual(expected, lossy.lemmatize_all(sentences))
+
+    def test_pymorphy(self):
+        lemmatizer = PymorphyLemmatizer(morph_cache=StubMorphCache(), tokenize=str.split)
+        self.assertEqual([['кот', 'идет'], []], lemmatizer.lemmatize_all(['Кот идет', '']))
+        with self.assertRaises(ValueError):
+            get_lemmatizer('unknown')
+
+    def test_lemma_agreement(self):
+        left = [['кот', ' ', 'идти', '\n'], ['собака', ' ', 'лаять'], ['да']]
+        right = [['кот', 'идти'], ['собака', 'лай'], ['да']]
+        agreement = lemma_agreement(left, right)
+        self.assertAlmostEqual(2 / 3, agreement['sentence'])
+        self.assertAlmostEqual(4 / 5, agreement['token'])
+        with self.assertRaises(ValueError):
+            lemma_agreement(left, right[:2])
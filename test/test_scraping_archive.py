@@ -0,0 +1,90 @@
+from unittest import TestCase
+from os import path
+from tempfile import TemporaryDirectory
+
+from scraping.archive import PageArchive, IndexEntry
+
+
+def write_pages(archive: PageArchive, n: int) -> None:
+    for i in range(n):
+        archive.write(f'https://example.com/{i}', 200, {'Content-Type': ['text/html']},
+                      f'<html>{i}</html>'.encode(), callback='parse_question', cb_kwargs={'i': i})
+
+
+class Test(TestCase):
+    def test_segments(self):
+        with TemporaryDirectory() as root:
+            archive = PageArchive(root, segment_size=100)
+            write_pages(archive, 5)
+            archive.close()
+
+            archive = PageArchive(root, segment_size=100)
+            self.assertEqual(5, len(archive))
+            self.assertEqual(list(range(5)), [entry.segment for entry in archive.entries()])
+            record = archive.read('https://example.com/3')
+            self.assertEqual(b'<html>3</html>', record.body)
+            self.assertEqual({'i': 3}, record.cb_kwargs)
+            self.assertEqual('parse_question', record.callback)
+            self.assertEqual([f'<html>{i}</html>'.encode() for i in range(5)], [r.body for r in archive])
+
+            # Writing continues in the last segment
+            archive.write('https://example.com/5', 200, {}, b'')
+            self.assertEqual(5, archive.index['https://example.com/5'].segment)
+            archive.close()
+
+    def test_latest(self):
+        with TemporaryDirectory() as root:
+            archive = PageArchive(root)
+            write_pages(archive, 2)
+            archive.write('https://example.com/0', 404, {}, b'missing')
+            archive.close()
+
+            archive = PageArchive(root)
+            self.assertEqual(2, len(archive))
+            record = archive.read('https://example.com/0')
+            self.assertEqual((404, b'missing'), (record.status, record.body))
+            self.assertEqual(['https://example.com/1', 'https://example.com/0'], [r.url for r in archive])
+
+    def test_torn(self):
+        with TemporaryDirectory() as root:
+            archive = PageArchive(root)
+            write_pages(archive, 3)
+            archive.close()
+            segment_path = path.join(root, 'segment-00000.zst')
+            index_path = path.join(root, 'index.tsv')
+
+            # Frame of the last record is torn
+            entry = archive.index['https://example.com/2']
+            with open(segment_path, 'r+b') as f:
+                f.truncate(entry.offset + entry.length - 1)
+            archive = PageArchive(root)
+            self.assertEqual({'https://example.com/0', 'https://example.com/1'}, set(archive.index))
+
+            # Index line is torn in the middle of the length
+            with open(index_path, 'rb') as f:
+                lines = f.readlines()
+            with open(index_path, 'wb') as f:
+                f.writelines(lines[:1])
+                f.write(lines[1][:-2])
+            archive = PageArchive(root)
+            self.assertEqual({'https://example.com/0'}, set(archive.index))
+
+            # The next record isn't glued to the torn line
+            archive.write('https://example.com/3', 200, {}, b'3')
+            archive.close()
+            archive = PageArchive(root)
+            self.assertEqual({'https://example.com/0', 'https://example.com/3'}, set(archive.index))
+            self.assertEqual(b'3', archive.read('https://example.com/3').body)
+
+    def test_read_only(self):
+        with TemporaryDirectory() as root:
+            archive = PageArchive(root)
+            write_pages(archive, 3)
+            archive.close()
+
+            reader = PageArchive(root, read_only=True)
+            self.assertEqual(0, len(reader))
+            self.assertEqual([b'<html>1</html>', b'<html>2</html>'],
+                             [r.body for r in reader.iter_entries(archive.entries()[1:])])
+            self.assertRaises(ValueError, reader.write, 'https://example.com/3', 200, {}, b'')
+            self.assertRaises(FileNotFoundError, lambda: list(reader.iter_entries([IndexEntry(1, 0, 1)])))
@@ -0,0 +1,59 @@
+from unittest import TestCase
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from scraping.benchmark import PAGE_URL, parse_cpu_time, synthetic_page
+from scraping.items import Question
+from scraping.spiders.yandex_q import YandexQuestionsSpider, YandexQuestionIDSpider
+
+
+def parse_page(spider, q_id: str, body: str):
+    response = HtmlResponse(PAGE_URL.format(q_id=q_id), body=body.encode('utf-8'), encoding='utf-8')
+    results = list(spider.parse(response, q_id, parent_id='parent'))
+    items = [obj for obj in results if isinstance(obj, Question)]
+    # Links are shuffled, so requests are compared as a set
+    requests = {
+        (req.url, req.callback.__name__, req.priority, tuple(sorted(req.cb_kwargs.items())))
+        for req in results if isinstance(req, Request)
+    }
+    return items, requests
+
+
+class Test(TestCase):
+    def test_spiders_agree(self):
+        body = synthetic_page('42', n_answers=3, n_links=10)
+        items, requests = parse_page(YandexQuestionsSpider(), '42', body)
+        id_items, id_requests = parse_page(YandexQuestionIDSpider(), '42', body)
+
+        self.assertEqual(1, len(items))
+        self.assertEqual(1, len(id_items))
+        item, id_item = items[0], id_items[0]
+        for field in ('question_id', 'parent_id', 'tags', 'url'):
+            self.assertEqual(item[field], id_item[field])
+        self.assertEqual('42', item['question_id'])
+        self.assertEqual(['Наука', 'Физика'], item['tags'])
+        self.assertEqual('Почему небо голубое?', item['question'])
+        self.assertEqual(3, len(item['answers']))
+        self.assertEqual('', id_item['question'])
+        self.assertEqual([], id_item['answers'])
+
+        self.assertEqual(requests, id_requests)
+        # Question links are parsed, profile and tag pages are only followed
+        self.assertEqual({'parse', 'follow_urls'}, {callback for _, callback, _, _ in requests})
+        self.assertTrue(all(dict(kwargs)['parent_id'] == '42'
+                            for _, callback, _, kwargs in requests if callback == 'parse'))
+
+    def test_not_found(self):
+        body = synthetic_page('42', n_answers=1, n_links=5).replace(
+            'Почему небо голубое?', YandexQuestionsSpider.not_found_texts[0]
+        )
+        for spider in (YandexQuestionsSpider(), YandexQuestionIDSpider()):
+            items, requests = parse_page(spider, '42', body)
+            self.assertEqual([], items)
+            self.assertGreater(len(requests), 0)
+
+    def test_parse_cpu_time(self):
+        pages = [(str(i), synthetic_page(str(i), n_answers=2, n_links=5, seed=i).encode('utf-8')) for i in range(2)]
+        extraction, total = parse_cpu_time(YandexQuestionIDSpider(), pages, repeat=1)
+        self.assertLessEqual(extraction, total)
@@ -0,0 +1,104 @@
+from unittest import TestCase
+import asyncio
+
+from scrapy import Request, Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+
+from scraping.instrumentation import COUNT_BUCKETS, Histogram, CrawlMetrics
+from scraping.items import Question
+from scraping.middlewares import InstrumentationSpiderMiddleware
+
+
+class StubSpider(Spider):
+    name = 'stub'
+
+    def parse_question(self, response):
+        yield Question(question_id='1')
+        yield Request('https://example.com/2')
+        yield {'question_id': '3'}
+        yield Request('https://example.com/4')
+        yield Request('https://example.com/5')
+
+
+class StubCrawler(object):
+    def __init__(self, settings: dict):
+        self.settings = Settings(settings)
+
+
+class Test(TestCase):
+    def test_quantile(self):
+        hist = Histogram((1, 2, 5))
+        self.assertEqual(0., hist.quantile(0.5))
+        for value in (0.5, 1, 2, 3, 10):
+            hist.observe(value)
+        # Values equal to the bucket bound belong to this bucket (le semantics)
+        self.assertEqual([2, 1, 1, 1], hist.counts)
+        self.assertEqual(1, hist.quantile(0.4))
+        self.assertEqual(2, hist.quantile(0.5))
+        self.assertEqual(5, hist.quantile(0.7))
+        self.assertEqual(10, hist.quantile(1.))
+
+        hist = Histogram((1, 2, 5))
+        hist.observe(0.3)
+        # Bucket bound isn't greater than max observed value
+        self.assertEqual(0.3, hist.quantile(0.5))
+        self.assertEqual({'count': 1, 'mean': 0.3, 'p50': 0.3, 'p95': 0.3, 'max': 0.3}, hist.summary())
+
+    def test_prometheus(self):
+        metrics = CrawlMetrics()
+        for value in (0.5, 1, 2, 3, 10):
+            metrics.observe('latency', value, (1, 2, 5), callback='parse')
+        metrics.inc('requests_scheduled', 4)
+        lines = metrics.to_prometheus().splitlines()
+        self.assertEqual([
+            '# TYPE scrapy_latency histogram',
+            'scrapy_latency_bucket{callback="parse",le="1"} 2',
+            'scrapy_latency_bucket{callback="parse",le="2"} 3',
+            'scrapy_latency_bucket{callback="parse",le="5"} 4',
+            'scrapy_latency_bucket{callback="parse",le="+Inf"} 5',
+            'scrapy_latency_sum{callback="parse"} 16.5',
+            'scrapy_latency_count{callback="parse"} 5',
+            '# TYPE scrapy_requests_scheduled_total counter',
+            'scrapy_requests_scheduled_total 4',
+        ], lines[:9])
+
+    def test_dupefilter_hit_rate(self):
+        metrics = CrawlMetrics()
+        self.assertEqual(0., metrics.dupefilter_hit_rate())
+        metrics.inc('requests_scheduled', 4)
+        metrics.inc('requests_dropped')
+        self.assertEqual(0.25, metrics.dupefilter_hit_rate())
+        self.assertEqual(0.25, metrics.to_dict()['dupefilter_hit_rate'])
+        self.assertIn('scrapy_dupefilter_hit_rate 0.25', metrics.to_prometheus().splitlines())
+
+    def test_spider_middleware(self):
+        self.assertRaises(NotConfigured, InstrumentationSpiderMiddleware.from_crawler, StubCrawler({}))
+        middleware = InstrumentationSpiderMiddleware.from_crawler(StubCrawler({'INSTRUMENTATION_ENABLED': True}))
+        spider = StubSpider()
+        response = HtmlResponse('https://example.com/1', body=b'<html></html>',
+                                request=Request('https://example.com/1', callback=spider.parse_question))
+
+        expected = list(spider.parse_question(response))
+        output = list(middleware.process_spider_output(response, iter(expected), spider))
+        # Objects are passed through unchanged and in the same order
+        self.assertEqual(len(expected), len(output))
+        self.assertTrue(all(a is b for a, b in zip(expected, output)))
+
+        async def agen():
+            for obj in expected:
+                yield obj
+
+        async def consume():
+            return [obj async for obj in middleware.process_spider_output_async(response, agen(), spider)]
+
+        output = asyncio.run(consume())
+        self.assertTrue(all(a is b for a, b in zip(expected, output)))
+
+        labels = (('callback', 'parse_question'),)
+        for name, value in (('requests_per_page', 3), ('items_per_page', 2)):
+            hist = middleware.metrics.histograms[(name, labels)]
+            self.assertEqual(COUNT_BUCKETS, hist.buckets)
+            self.assertEqual((2, 2 * value, value), (hist.count, hist.sum, hist.max))
+        self.assertEqual(2, middleware.metrics.histograms[('callback_cpu_seconds', labels)].count)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+
+from scrapy import Request, Spider
+from scrapy.exceptions import DropItem
+from scrapy.settings import Settings
+
+from scraping.archive import PageArchive
+from scraping.reparse import reparse
+
+
+class StubSpider(Spider):
+    name = 'stub'
+
+    def parse_question(self, response, question_id: int):
+        if response.status == 404:
+            return
+        yield {'question_id': question_id, 'title': response.css('h1::text').get()}
+        yield Request(f'https://example.com/{question_id + 1}')
+
+
+class StubPipeline(object):
+    """Collects items in the main process, drops items without title"""
+    items = []
+    closed = False
+
+    def open_spider(self, spider):
+        StubPipeline.items = []
+
+    def process_item(self, item, spider):
+        if item['title'] is None:
+            raise DropItem('No title')
+        StubPipeline.items.append(item)
+        return item
+
+    def close_spider(self, spider):
+        StubPipeline.closed = True
+
+
+class Test(TestCase):
+    def test_reparse(self):
+        with TemporaryDirectory() as root:
+            archive = PageArchive(root)
+            for i in range(7):
+                body = f'<html><h1>Question {i}</h1></html>' if i != 3 else '<html></html>'
+                archive.write(f'https://example.com/{i}', 200, {'Content-Type': ['text/html']}, body.encode(),
+                              callback='parse_question', cb_kwargs={'question_id': i})
+            archive.write('https://example.com/5', 404, {}, b'', callback='parse_question',
+                          cb_kwargs={'question_id': 5})
+            archive.close()
+
+            settings = Settings({
+                'SPIDER_MODULES': [__name__],
+                'ITEM_PIPELINES': {f'{__name__}.StubPipeline': 100},
+            })
+            n_items = reparse(root, 'stub', n_workers=2, chunk_size=2, settings=settings)
+
+            self.assertEqual(5, n_items)
+            self.assertTrue(StubPipeline.closed)
+            self.assertEqual(
+                [{'question_id': i, 'title': f'Question {i}'} for i in (0, 1, 2, 4, 6)],
+                StubPipeline.items
+            )
@@ -0,0 +1,56 @@
+from unittest import TestCase
+from http.client import HTTPConnection
+
+from scraping.standin import CAPTCHA_PATH, QUESTION_PATH, StandInState, crawl, serve
+
+
+class Test(TestCase):
+    def request(self, server, url: str):
+        connection = HTTPConnection(*server.server_address, timeout=10)
+        try:
+            connection.request('GET', url)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def serve(self, state: StandInState):
+        server = serve(state)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_rate_limit(self):
+        state = StandInState(base_latency=0., rate_limit=2)
+        server = self.serve(state)
+        for _ in range(2):
+            status, _, body = self.request(server, f'{QUESTION_PATH}42/')
+            self.assertEqual(200, status)
+            self.assertIn('Почему небо голубое?', body.decode('utf-8'))
+        status, headers, _ = self.request(server, f'{QUESTION_PATH}43/')
+        self.assertEqual(429, status)
+        self.assertEqual('1', headers['Retry-After'])
+        self.assertEqual({'ok': 2, 'rejected': 1}, state.counts)
+        self.assertEqual(0, state.in_flight)
+        self.assertEqual(404, self.request(server, '/q/tag/science/')[0])
+
+    def test_captcha(self):
+        state = StandInState(base_latency=0., rate_limit=1, captcha=True)
+        server = self.serve(state)
+        self.assertEqual(200, self.request(server, f'{QUESTION_PATH}42/')[0])
+        status, headers, _ = self.request(server, f'{QUESTION_PATH}43/')
+        self.assertEqual(302, status)
+        self.assertEqual(f'{CAPTCHA_PATH}?retpath={QUESTION_PATH}43/', headers['Location'])
+        status, _, body = self.request(server, headers['Location'])
+        self.assertEqual((200, b'<html><body>captcha</body></html>'), (status, body))
+        self.assertEqual({'ok': 1, 'rejected': 1}, state.counts)
+
+    def test_crawl_failure(self):
+        # Crawl process fails on unknown spider loader, result is never put into the queue
+        with self.assertRaises(RuntimeError):
+            crawl('http://127.0.0.1:1', 1, {'SPIDER_LOADER_CLASS': 'scraping.missing.SpiderLoader'}, timeout=60)
+
+    def test_crawl_timeout(self):
+        server = self.serve(StandInState(base_latency=60.))
+        with self.assertRaises(TimeoutError):
+            crawl(f'http://127.0.0.1:{server.server_address[1]}', 1, {}, timeout=5)
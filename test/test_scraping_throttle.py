@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+from scrapy import Request
+from scrapy.http import Response
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+from scraping.throttle import AdaptiveThrottle, ThrottlePolicy, retry_after_seconds, INCREASE_AFTER
+
+
+class StubSlot(object):
+    def __init__(self, concurrency: int = 1, delay: float = 1.):
+        self.concurrency = concurrency
+        self.delay = delay
+
+
+class StubCrawler(object):
+    """Crawler with settings, stats, signals and downloader slots required by AdaptiveThrottle"""
+    def __init__(self, settings: dict):
+        class Signals(object):
+            def connect(self, *args, **kwargs):
+                pass
+
+        class Downloader(object):
+            slots = {}
+
+        class Engine(object):
+            downloader = Downloader()
+
+        self.settings = Settings(settings)
+        self.signals = Signals()
+        self.engine = Engine()
+        self.stats = MemoryStatsCollector(self)
+
+
+class Test(TestCase):
+    def test_error_backoff(self):
+        policy = ThrottlePolicy(target_rps=2, start_concurrency=4, max_delay=10)
+        self.assertEqual(0.5, policy.delay)
+        policy.on_error()
+        self.assertEqual((2, 1.), (policy.concurrency, policy.delay))
+        policy.on_error()
+        policy.on_error()
+        self.assertEqual((1, 4.), (policy.concurrency, policy.delay))
+        # Retry-After is the lower bound of delay, delay is within the ceiling
+        policy.on_error(retry_after=7.)
+        self.assertEqual(8., policy.delay)
+        policy = ThrottlePolicy(target_rps=2, max_delay=10)
+        policy.on_error(retry_after=3.)
+        self.assertEqual(3., policy.delay)
+        policy.on_error(retry_after=30.)
+        self.assertEqual(10., policy.delay)
+
+    def test_latency(self):
+        policy = ThrottlePolicy(target_rps=4, start_concurrency=1, max_concurrency=3, max_latency=5)
+        for _ in range(10 * INCREASE_AFTER):
+            policy.on_success(latency=2.)
+        # 4 rps * 2 s = 8 requests in flight are needed, concurrency is limited by the ceiling
+        self.assertEqual(3, policy.concurrency)
+        self.assertEqual(0.25, policy.delay)
+        # Latency above the limit cuts concurrency
+        for _ in range(5):
+            policy.on_success(latency=20.)
+        self.assertEqual(1, policy.concurrency)
+
+        policy = ThrottlePolicy(target_rps=0.5, start_concurrency=4, min_delay=0.1)
+        policy.on_success(latency=0.5)
+        # One request in flight spends the budget of slow crawl
+        self.assertEqual((1, 2.), (policy.concurrency, policy.delay))
+
+    def test_retry_after(self):
+        self.assertEqual(5., retry_after_seconds(Response('https://a.ru', headers={'Retry-After': '5'})))
+        self.assertIsNone(retry_after_seconds(Response('https://a.ru')))
+        self.assertIsNone(retry_after_seconds(
+            Response('https://a.ru', headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})))
+
+    def test_extension_flag(self):
+        crawler = StubCrawler({'ADAPTIVE_THROTTLE_ENABLED': True, 'ADAPTIVE_THROTTLE_TARGET_RPS': 1})
+        slot = crawler.engine.downloader.slots['a.ru'] = StubSlot(concurrency=2, delay=1.)
+        throttle = AdaptiveThrottle(crawler)
+        request = Request('https://a.ru', meta={'download_slot': 'a.ru', 'download_latency': 0.1})
+
+        throttle.request_reached_downloader(request, None)
+        throttle.response_downloaded(Response('https://a.ru', status=301), request, None)
+        throttle.request_left_downloader(request, None)
+        self.assertEqual(0, crawler.stats.get_value('adaptive_throttle/errors', 0))
+
+        # Redirected request has meta of the original one and fails by timeout
+        redirected = request.replace(url='https://a.ru/q')
+        throttle.request_reached_downloader(redirected, None)
+        throttle.request_left_downloader(redirected, None)
+        self.assertEqual(1, crawler.stats.get_value('adaptive_throttle/errors'))
+        self.assertEqual((1, 2.), (slot.concurrency, slot.delay))
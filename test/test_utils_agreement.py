@@ -0,0 +1,49 @@
+from unittest import TestCase
+import pandas as pd
+import numpy as np
+
+from utils.agreement import fleiss_kappa, pair_counts, set_fleiss_kappa, worker_golden_accuracy
+
+
+class Test(TestCase):
+    def test_fleiss_kappa(self):
+        # Example from Fleiss (1971) as given in Wikipedia
+        table = np.array([
+            [0, 0, 0, 0, 14],
+            [0, 2, 6, 4, 2],
+            [0, 0, 3, 5, 6],
+            [0, 3, 9, 2, 0],
+            [2, 2, 8, 1, 1],
+            [7, 7, 0, 0, 0],
+            [3, 2, 6, 3, 0],
+            [2, 5, 3, 2, 2],
+            [6, 5, 2, 1, 0],
+            [0, 2, 2, 3, 7],
+        ])
+        self.assertAlmostEqual(0.210, fleiss_kappa(table), places=3)
+
+    def test_set_fleiss_kappa(self):
+        ans = pd.DataFrame({
+            'left_id': [1, 1, 1, 2, 2, 2, 3, 3, 4, 4],
+            'right_id': [5, 5, 5, 6, 6, 6, 7, 7, 8, 8],
+            'class': [1, 1, 0, 0, 0, 0, 1, 1, 1, 0],
+        })
+        table = pair_counts(ans)
+        self.assertEqual([1, 2], table.loc[(1, 5), [0, 1]].tolist())
+        self.assertEqual([3, 3, 2, 2], table['num_raters'].tolist())
+
+        groups = set_fleiss_kappa(ans, final_agg=False).set_index('num_raters')
+        self.assertAlmostEqual(fleiss_kappa([[1, 2], [3, 0]]), groups.at[3, 'fleiss_kappa'])
+        self.assertAlmostEqual(fleiss_kappa([[0, 2], [1, 1]]), groups.at[2, 'fleiss_kappa'])
+        expected = (groups['fleiss_kappa'] * groups['num_entities']).sum() / 4
+        self.assertAlmostEqual(expected, set_fleiss_kappa(ans))
+
+    def test_worker_golden_accuracy(self):
+        assignments = pd.DataFrame({
+            'ASSIGNMENT:worker_id': ['a', 'a', 'b', 'b', 'b'],
+            'OUTPUT:class': [1, 0, 1, 1, 0],
+            'GOLDEN:class': [1, 1, np.nan, 1, 0],
+        })
+        workers = worker_golden_accuracy(assignments)
+        self.assertEqual([2, 2], workers.loc[['a', 'b'], 'n_golden'].tolist())
+        self.assertEqual([0.5, 1.], workers.loc[['a', 'b'], 'accuracy'].tolist())
@@ -0,0 +1,69 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import os
+import numpy as np
+
+from utils.ann import IVFFlatIndex, exact_search, recall_at_k
+
+
+class Test(TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(0)
+        # Clustered data, like question embeddings
+        centers = rnd.normal(size=(8, 16))
+        self.embeddings = centers[rnd.randint(0, 8, size=600)] + 0.3 * rnd.normal(size=(600, 16))
+        self.ids = np.arange(600) * 5 + 3
+        self.index = IVFFlatIndex(n_lists=8, n_probe=3)
+        self.index.train(self.embeddings)
+        self.index.add(self.embeddings, self.ids)
+
+    def test_recall(self):
+        queries = self.embeddings[:50]
+        true_ids, _ = exact_search(self.embeddings, self.ids, queries, 10)
+        found_ids, _ = self.index.search(queries, 10, n_probe=8)
+        self.assertEqual(1., recall_at_k(found_ids, true_ids))
+        found_ids, _ = self.index.search(queries, 10)
+        self.assertGreater(recall_at_k(found_ids, true_ids), 0.9)
+
+    def test_add_existing_ids(self):
+        # Re-added ids replace their vectors instead of being duplicated
+        self.index.add(self.embeddings[:100], self.ids[:100])
+        self.assertEqual(600, len(self.index))
+        found_ids, _ = self.index.search(self.embeddings[:20], 10, n_probe=8)
+        for row in found_ids:
+            self.assertEqual(len(row), len(set(row.tolist())))
+
+        left, right, _ = self.index.add_and_pair(self.embeddings[:30], self.ids[:30], threshold=0.9)
+        pairs = list(zip(left.tolist(), right.tolist()))
+        self.assertEqual(len(pairs), len(set(pairs)))
+        self.assertEqual(600, len(self.index))
+        with self.assertRaises(ValueError):
+            self.index.add(self.embeddings[:2], [1, 1])
+
+    def test_remove(self):
+        self.assertEqual(3, self.index.remove([self.ids[0], self.ids[10], self.ids[20], 1]))
+        self.assertEqual(597, len(self.index))
+        found_ids, _ = self.index.search(self.embeddings[:30], 10, n_probe=8)
+        self.assertFalse(np.isin(found_ids, self.ids[[0, 10, 20]]).any())
+
+        # Appended vectors are found after removal compacted the lists
+        self.index.add(self.embeddings[[0, 10]], self.ids[[0, 10]])
+        self.assertEqual(599, len(self.index))
+        found_ids, _ = self.index.search(self.embeddings[[0, 10]], 1, n_probe=8)
+        self.assertEqual(self.ids[[0, 10]].tolist(), found_ids[:, 0].tolist())
+
+    def test_save(self):
+        with TemporaryDirectory() as tmp_dir:
+            index_path = path.join(tmp_dir, 'questions.idx')
+            self.index.save(index_path)
+            self.assertEqual(['questions.idx'], os.listdir(tmp_dir))
+
+            loaded = IVFFlatIndex.load(index_path)
+            self.assertEqual(600, len(loaded))
+            queries = self.embeddings[:20]
+            for expected, actual in zip(self.index.search(queries, 5), loaded.search(queries, 5)):
+                np.testing.assert_array_equal(expected, actual)
+            self.assertEqual(1, loaded.remove(self.ids[:1]))
+            loaded.add(self.embeddings[:2], self.ids[:2])
+            self.assertEqual(600, len(loaded))
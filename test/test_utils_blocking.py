@@ -0,0 +1,74 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import pandas as pd
+import numpy as np
+
+from utils.blocking import UNTAGGED_BLOCK, blocked_search, build_blocks, estimate_recall, read_blocked_pairs
+from utils.similarity import normalize_embeddings, read_similar_pairs
+
+
+class Test(TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(0)
+        self.ids = np.arange(120) * 2 + 1
+        self.embeddings = rnd.normal(size=(120, 8))
+        tags = ['music'] * 50 + ['sport'] * 50 + ['chess'] * 10
+        question_ids = list(self.ids[:50]) + list(self.ids[40:90]) + list(self.ids[85:95])
+        self.question_tags = pd.DataFrame({'question_id': question_ids, 'tag': tags})
+
+    def test_build_blocks(self):
+        blocks = build_blocks(self.question_tags, self.ids, min_block_size=20)
+        names = [b.name for b in blocks]
+        # Small tag is merged with the co-occurring one, untagged questions form the fallback block
+        self.assertEqual(['chess|sport', 'music', UNTAGGED_BLOCK], names)
+        self.assertEqual(self.ids[95:].tolist(), blocks[2].ids.tolist())
+        # Questions with both tags belong to both blocks
+        self.assertEqual(10, len(np.intersect1d(blocks[0].ids, blocks[1].ids)))
+
+    def test_blocked_search(self):
+        threshold = 0.4
+        blocks = build_blocks(self.question_tags, self.ids, min_block_size=20)
+        with TemporaryDirectory() as out_dir:
+            blocked_search(self.embeddings, self.ids, blocks, out_dir, threshold=threshold, n_jobs=2, silent=True)
+            found = set()
+            for left, right, _ in read_blocked_pairs(out_dir):
+                found.update(zip(left.tolist(), right.tolist()))
+
+        normed = normalize_embeddings(self.embeddings)
+        rows, cols = np.nonzero(np.triu(normed @ normed.T, k=1) >= threshold)
+        full = set(zip(self.ids[rows].tolist(), self.ids[cols].tolist()))
+        shared = {
+            (left, right) for left, right in full
+            if any(left in b.ids and right in b.ids for b in blocks)
+        }
+        self.assertEqual(shared, found)
+
+        report = estimate_recall(self.embeddings, self.ids, blocks, threshold, sample_size=len(self.ids))
+        # Every pair is counted from both sides
+        self.assertEqual(2 * len(full), report['n_pairs'])
+        self.assertAlmostEqual(len(shared) / len(full), report['recall'])
+
+    def test_read_blocked_pairs(self):
+        blocks = build_blocks(self.question_tags, self.ids, min_block_size=20)
+        for threshold, k in ((0.2, None), (None, 3)):
+            with TemporaryDirectory() as out_dir:
+                blocked_search(self.embeddings, self.ids, blocks, out_dir, threshold=threshold, k=k,
+                               block_size=8, n_jobs=2, silent=True)
+                chunks = list(read_blocked_pairs(out_dir, chunk_size=20))
+                # Reference: all pairs of all blocks in memory
+                pairs = pd.concat([
+                    pd.DataFrame({'left_id': left, 'right_id': right, 'similarity': sims})
+                    for block_i in range(len(blocks))
+                    for left, right, sims in read_similar_pairs(path.join(out_dir, f'block-{block_i:05d}'))
+                ])
+            pairs = pairs.sort_values(['left_id', 'similarity'], ascending=[True, False], kind='stable')
+            pairs = pairs.drop_duplicates(['left_id', 'right_id'])
+            if k is not None:
+                pairs = pairs.groupby('left_id').head(k)
+
+            self.assertGreater(len(chunks), 2)
+            left = np.concatenate([c[0] for c in chunks])
+            right = np.concatenate([c[1] for c in chunks])
+            self.assertTrue(np.all(np.diff(left) >= 0))
+            self.assertEqual(sorted(zip(pairs['left_id'], pairs['right_id'])), sorted(zip(left, right)))
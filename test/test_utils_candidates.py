@@ -0,0 +1,55 @@
+from unittest import TestCase
+import pandas as pd
+import numpy as np
+
+from utils.candidates import QuestionTable, _HashSet, iter_similarity_frames
+
+
+class NoComparator(object):
+    def batch(self, left_ids, right_ids):
+        return np.zeros(len(left_ids), dtype=bool)
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.questions = QuestionTable(pd.DataFrame({
+            'id': [30, 10, 20, 40],
+            'text': ['c', 'a', 'b', 'a'],
+            'url': ['u30', 'u10', 'u20', 'u40'],
+        }))
+
+    def test_question_table(self):
+        self.assertEqual([10, 20, 30, 40], self.questions.ids.tolist())
+        self.assertEqual([2, 0], self.questions.positions([30, 10]).tolist())
+        self.assertEqual('c', self.questions[30])
+        self.assertIn(40, self.questions)
+        self.assertNotIn(50, self.questions)
+        with self.assertRaises(KeyError):
+            self.questions.positions([10, 50])
+        with self.assertRaises(ValueError):
+            QuestionTable(pd.DataFrame({'id': [1, 1], 'text': ['a', 'b']}))
+
+    def test_drop_duplicates(self):
+        chunks = [
+            (np.array([10, 10]), np.array([20, 30]), np.array([0.9, 0.8])),
+            # The same pair in the other order and the same texts as (10, 20) by another id
+            (np.array([20, 40, 20]), np.array([10, 20, 30]), np.array([0.9, 0.9, 0.7])),
+        ]
+        frames = list(iter_similarity_frames(chunks, self.questions, NoComparator()))
+        pairs = pd.concat(frames)[['left_id', 'right_id']].to_numpy().tolist()
+        self.assertEqual([[10, 20], [10, 30], [20, 30]], pairs)
+        self.assertEqual(['u10', 'u10', 'u20'], pd.concat(frames)['left_url'].tolist())
+
+    def test_hash_set(self):
+        rnd = np.random.RandomState(0)
+        seen = _HashSet()
+        expected = set()
+        for _ in range(50):
+            values = np.unique(rnd.randint(0, 5000, size=100).astype(np.uint64))
+            new = ~seen.contains(values)
+            self.assertEqual([v not in expected for v in values.tolist()], new.tolist())
+            seen.add(values[new])
+            expected.update(values.tolist())
+        self.assertEqual(len(expected), len(seen))
+        # Runs have decreasing sizes, so there are O(log n) of them
+        self.assertLessEqual(len(seen.runs), int(np.log2(len(expected))) + 1)
@@ -0,0 +1,45 @@
+from unittest import TestCase
+import pandas as pd
+import numpy as np
+
+from utils.dedup import candidate_pairs, connected_components, dedup_questions, lsh_params, shingle_hashes
+
+
+class Test(TestCase):
+    def test_shingle_hashes(self):
+        self.assertTrue(np.array_equal(shingle_hashes('Почему небо голубое?'), shingle_hashes('почему  небо, голубое')))
+        self.assertEqual(1, len(shingle_hashes('да')))
+        self.assertEqual(1, len(shingle_hashes('')))
+
+    def test_components(self):
+        labels = connected_components(6, np.array([[4, 5], [1, 3], [3, 5]]))
+        self.assertEqual([0, 1, 2, 1, 1, 1], labels.tolist())
+
+        signatures = np.array([[1, 2, 3, 4], [1, 2, 9, 9], [7, 7, 3, 4], [5, 6, 7, 8]], dtype=np.uint32)
+        self.assertEqual([[0, 1], [0, 2]], candidate_pairs(signatures, 2, 2).tolist())
+
+    def test_candidate_pairs(self):
+        # All rows share the first band
+        signatures = np.stack([np.ones(5, dtype=np.uint32), np.arange(5, dtype=np.uint32)], axis=1)
+        self.assertEqual([[0, 1], [0, 2], [0, 3], [0, 4], [1, 2], [1, 3], [1, 4], [2, 3], [2, 4], [3, 4]],
+                         candidate_pairs(signatures, 2, 1).tolist())
+        # Members of a large bucket are linked in a chain
+        self.assertEqual([[0, 1], [1, 2], [2, 3], [3, 4]],
+                         candidate_pairs(signatures, 2, 1, small_bucket_size=4).tolist())
+
+    def test_dedup_questions(self):
+        bands, rows = lsh_params(0.8, 128)
+        self.assertLessEqual(bands * rows, 128)
+
+        questions = pd.DataFrame({
+            'id': [10, 3, 7, 5, 8],
+            'text': [
+                'Почему небо голубое днем?',
+                'Как научиться играть на гитаре самостоятельно?',
+                'Почему небо голубое днём?',
+                'Как научиться играть на гитаре самостоятельно',
+                'Сколько стоит билет на поезд до Москвы?',
+            ]
+        })
+        mapping = dedup_questions(questions, threshold=0.6)
+        self.assertEqual([7, 3, 7, 3, 8], mapping['canonical_id'].tolist())
@@ -0,0 +1,21 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+import numpy as np
+
+from utils.embedding_parallel import ParallelEmbedder
+
+
+class Test(TestCase):
+    def test_resume_params(self):
+        ids = np.arange(10)
+        with TemporaryDirectory() as work_dir:
+            manifest = ParallelEmbedder(work_dir, model_name='model/a', shard_size=4)._prepare(ids, 8)
+            self.assertEqual(manifest, ParallelEmbedder(work_dir, model_name='model/a', shard_size=4)._prepare(ids, 8))
+            # Rows of another job mustn't be mixed with the saved ones
+            for kwargs in ({'model_name': 'model/b', 'shard_size': 4},
+                           {'model_name': 'model/a', 'shard_size': 5},
+                           {'model_name': 'model/a', 'shard_size': 4, 'quantize': True}):
+                with self.assertRaises(ValueError):
+                    ParallelEmbedder(work_dir, **kwargs)._prepare(ids, 8)
+            with self.assertRaises(ValueError):
+                ParallelEmbedder(work_dir, model_name='model/a', shard_size=4)._prepare(ids + 1, 8)
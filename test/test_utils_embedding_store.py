@@ -0,0 +1,42 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import pickle
+import numpy as np
+
+from utils.embedding_store import EmbeddingStore
+
+
+class Test(TestCase):
+    def test_from_pickle(self):
+        rnd = np.random.RandomState(0)
+        embeddings = {int(q_id): rnd.normal(size=8) for q_id in rnd.choice(1000, 50, replace=False)}
+        with TemporaryDirectory() as tmp_dir:
+            pickle_path = path.join(tmp_dir, 'embeddings.pkl')
+            with open(pickle_path, 'wb') as f:
+                pickle.dump(embeddings, f)
+
+            EmbeddingStore.from_pickle(pickle_path, path.join(tmp_dir, 'store'))
+            store = EmbeddingStore(path.join(tmp_dir, 'store'))
+            self.assertEqual(len(embeddings), len(store))
+            self.assertEqual(sorted(embeddings.keys()), store.ids.tolist())
+            for q_id, emb in embeddings.items():
+                np.testing.assert_allclose(emb, store.get([q_id])[0], rtol=1e-6)
+
+    def test_append(self):
+        with TemporaryDirectory() as tmp_dir:
+            store = EmbeddingStore.create(tmp_dir, dim=4, dtype='float16')
+            self.assertEqual(2, store.append([10, 5], np.ones((2, 4))))
+            # Existing ids are skipped
+            self.assertEqual(1, store.append([5, 7], np.full((2, 4), 2.)))
+            with self.assertRaises(ValueError):
+                store.append([7], np.zeros((1, 4)), skip_existing=False)
+
+            store = EmbeddingStore(tmp_dir)
+            self.assertEqual([10, 5, 7], store.ids.tolist())
+            self.assertEqual(np.float16, store.embeddings.dtype)
+            np.testing.assert_array_equal([[2.] * 4, [1.] * 4], store.get([7, 5]))
+            self.assertIn(10, store)
+            self.assertNotIn(6, store)
+            with self.assertRaises(KeyError):
+                store.rows([6])
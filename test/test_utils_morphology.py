@@ -0,0 +1,95 @@
+from unittest import TestCase
+import pandas as pd
+
+from analysis.corpus_stats import Prop, analyze, corpus_stat, get_corpus_lemmas
+from utils.morphology import MorphCache, Parse, is_word
+
+
+class StubTag(object):
+    def __init__(self, pos, grammemes):
+        self.POS = pos
+        self.grammemes = frozenset(grammemes)
+
+    def __str__(self):
+        return ','.join(sorted(self.grammemes))
+
+
+class StubParse(object):
+    def __init__(self, normal_form, pos, grammemes):
+        self.normal_form = normal_form
+        self.tag = StubTag(pos, grammemes)
+
+
+class StubMorph(object):
+    """pymorphy2 analyzer with a fixed vocabulary, counts parse calls"""
+    vocabulary = {
+        'коты': ('кот', 'NOUN', {'NOUN', 'anim', 'plur', 'nomn'}),
+        'кошки': ('кошка', 'NOUN', {'NOUN', 'anim', 'plur', 'nomn'}),
+        'не': ('не', 'PRCL', {'PRCL'}),
+        'ни': ('ни', 'PRCL', {'PRCL'}),
+        'никогда': ('никогда', 'ADVB', {'ADVB'}),
+        'спят': ('спать', 'VERB', {'VERB', 'plur', 'pres'}),
+        'два': ('два', 'NUMR', {'NUMR', 'nomn'}),
+        '42': ('42', None, {'NUMB', 'intg'}),
+        'cat': ('cat', None, {'LATN'}),
+        '?': ('?', None, {'PNCT'}),
+    }
+
+    def __init__(self):
+        self.calls = 0
+
+    def parse(self, token):
+        self.calls += 1
+        return [StubParse(*self.vocabulary[token])]
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.morph = StubMorph()
+        self.cache = MorphCache(self.morph, cache_size=2, tokenize=str.split)
+
+    def test_parse(self):
+        self.assertEqual(Parse('кот', 'NOUN', frozenset({'NOUN', 'anim', 'plur', 'nomn'})), self.cache.parse('коты'))
+        self.cache.parse('коты')
+        self.assertEqual(1, self.morph.calls)
+        # Grammeme sets of equal tags are shared
+        self.assertIs(self.cache.parse('коты').tags, self.cache.parse('кошки').tags)
+        # LRU cache of 2 tokens evicts the least recently used one
+        self.cache.parse('спят')
+        self.cache.parse('коты')
+        self.assertEqual(4, self.morph.calls)
+
+    def test_lemmas(self):
+        tokens = ['коты', 'не', 'спят', '?']
+        self.assertEqual(['кот', 'не', 'спать'], self.cache.lemmas(tokens))
+        self.assertEqual(['кот', 'не', 'спать', '?'], self.cache.lemmas(tokens, skip_punct=False))
+        self.assertEqual({'NOUN', 'anim', 'plur', 'nomn', 'VERB', 'pres'}, self.cache.bag_of_tags(['коты', 'спят']))
+        self.assertTrue(is_word('коты'))
+        self.assertFalse(is_word('?'))
+
+    def test_analyze_column(self):
+        tokens, parsed = self.cache.analyze_column(['коты спят', 'кошки не спят', 'коты ?'])
+        self.assertEqual([['коты', 'спят'], ['кошки', 'не', 'спят'], ['коты', '?']], tokens.tolist())
+        self.assertEqual(['кот', 'спать'], [p.normal_form for p in parsed[0]])
+        # Every distinct token is parsed once, though the cache holds only 2 tokens
+        self.assertEqual(5, self.morph.calls)
+
+    def test_corpus_stats(self):
+        tokens = ['никогда', 'не', 'спят', '?']
+        self.assertEqual((3, Prop.NEGATION | Prop.DBL_NEGATION), analyze(tokens, self.cache.parse_many(tokens)))
+        tokens = ['два', 'cat', '42']
+        self.assertEqual((3, Prop.NUM_WORD | Prop.ENG | Prop.NUMBR), analyze(tokens, self.cache.parse_many(tokens)))
+        self.assertEqual(['кот', 'спать'], get_corpus_lemmas([self.cache.parse_many(['коты', '?', 'спят'])]))
+
+        df = pd.DataFrame({
+            'left_text': ['коты спят', 'коты не спят ?'],
+            'right_text': ['кошки спят', 'два cat'],
+            'class': [1, 0]
+        })
+        stats = corpus_stat(df, self.cache)
+        self.assertEqual(0.5, stats['NEGATION'])
+        self.assertEqual(0.5, stats['ENG'])
+        self.assertEqual(0., stats['GRND'])
+        self.assertEqual((2 + 3 + 2 + 2) / 4, stats['mean_len'])
+        self.assertEqual((0 + 1) / 2, stats['mean_diff'])
+        self.assertEqual(0.5, stats['pos_frac'])
@@ -0,0 +1,52 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+import numpy as np
+
+from utils.similarity import SimilaritySearch, normalize_embeddings, read_similar_pairs, ManifestMismatchError
+
+
+class Test(TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(0)
+        self.embeddings = rnd.normal(size=(230, 16))
+        self.ids = np.arange(230) * 3 + 7
+        normed = normalize_embeddings(self.embeddings)
+        self.sim = normed @ normed.T
+
+    def test_threshold(self):
+        threshold = 0.5
+        with TemporaryDirectory() as out_dir:
+            search = SimilaritySearch(self.embeddings, self.ids, block_size=64, col_block_size=50)
+            n_found = search.search(out_dir, threshold=threshold, n_jobs=3, silent=True)
+            found = set()
+            for left, right, _ in read_similar_pairs(out_dir):
+                found.update(zip(left.tolist(), right.tolist()))
+
+            # Second run has nothing to do
+            self.assertEqual(n_found, search.search(out_dir, threshold=threshold, silent=True))
+            with self.assertRaises(ManifestMismatchError):
+                search.search(out_dir, threshold=0.6, silent=True)
+
+        rows, cols = np.nonzero(np.triu(self.sim, k=1) >= threshold)
+        expected = set(zip(self.ids[rows].tolist(), self.ids[cols].tolist()))
+        self.assertEqual(expected, found)
+        self.assertEqual(len(expected), n_found)
+
+    def test_topk(self):
+        k = 5
+        search = SimilaritySearch(self.embeddings, self.ids, block_size=64, col_block_size=40)
+        left, right, sims = [], [], []
+        for block_i in range(search.n_blocks):
+            chunk = search.topk_block(block_i, k)
+            left.append(chunk[0])
+            right.append(chunk[1])
+            sims.append(chunk[2])
+        left = np.concatenate(left)
+        right = np.concatenate(right)
+
+        sim = self.sim.copy()
+        np.fill_diagonal(sim, -np.inf)
+        expected = np.argsort(-sim, axis=1)[:, :k]
+        for row in range(len(self.ids)):
+            found = set(right[left == self.ids[row]].tolist())
+            self.assertEqual(set(self.ids[expected[row]].tolist()), found)
@@ -0,0 +1,51 @@
+from unittest import TestCase
+import random
+
+from utils.text_distance import bounded_levenshtein, bag_distance, HeuristicComparator, filter_pairs
+
+from collections import Counter
+
+
+def full_levenshtein(left, right) -> int:
+    prev = list(range(len(right) + 1))
+    for i in range(1, len(left) + 1):
+        cur = [i] + [0] * len(right)
+        for j in range(1, len(right) + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (left[i - 1] != right[j - 1]))
+        prev = cur
+    return prev[-1]
+
+
+class Test(TestCase):
+    def test_bounded_levenshtein(self):
+        rnd = random.Random(0)
+        for _ in range(500):
+            left = ''.join(rnd.choice('абвг') for _ in range(rnd.randint(0, 12)))
+            right = ''.join(rnd.choice('абвг') for _ in range(rnd.randint(0, 12)))
+            max_dist = rnd.randint(0, 6)
+            dist = full_levenshtein(left, right)
+            self.assertEqual(min(dist, max_dist + 1), bounded_levenshtein(left, right, max_dist), (left, right))
+
+    def test_token_levenshtein(self):
+        self.assertEqual(1, bounded_levenshtein(['как', 'дела'], ['как', 'твои', 'дела'], 2))
+        self.assertEqual(3, bounded_levenshtein(['a'], ['b', 'c', 'd', 'e'], 2))
+
+    def test_bag_distance(self):
+        self.assertEqual(2, bag_distance(Counter('aab'), Counter('bcd')))
+        self.assertEqual(0, bag_distance(Counter('ab'), Counter('ba')))
+
+    def test_comparator(self):
+        texts = {
+            1: 'Как выучить английский язык?',
+            2: 'как выучить английский язык',
+            3: 'Как быстро выучить английский язык?',
+            4: 'Почему небо голубое?',
+        }
+        cmp = HeuristicComparator(texts, tokenize=str.split)
+        self.assertTrue(cmp(1, 2))
+        self.assertTrue(cmp(1, 3))
+        self.assertFalse(cmp(1, 4))
+        self.assertEqual(cmp(1, 3), cmp.texts_eq(texts[1], texts[3]))
+
+        mask = filter_pairs(texts, [1, 1, 2], [2, 4, 4], comparator=cmp)
+        self.assertEqual([False, True, True], mask.tolist())
@@ -0,0 +1,52 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from os import path
+import json
+import os
+import numpy as np
+
+from utils.token_cache import TokenCache, _tokenizer_dir
+
+
+class StubTokenizer(object):
+    """Token ids are character codes of words' first letters, fails on text 'fail'"""
+    name_or_path = 'stub/tokenizer'
+
+    def __call__(self, texts, **kwargs):
+        if 'fail' in texts:
+            raise RuntimeError('Tokenization failed')
+        return {'input_ids': [[ord(word[0]) for word in text.split()] for text in texts]}
+
+
+class Test(TestCase):
+    def test_build_and_extend(self):
+        tokenizer = StubTokenizer()
+        with TemporaryDirectory() as root:
+            cache = TokenCache.build(root, tokenizer, [30, 10], ['a b c', 'd'])
+            self.assertEqual([[ord('d')], [ord('a'), ord('b'), ord('c')]],
+                             [t.tolist() for t in cache.get_many([10, 30])])
+
+            cache = TokenCache.build(root, tokenizer, [20, 10], ['e f', 'not tokenized again'])
+            self.assertEqual(3, len(cache))
+            tokens, offsets = cache.ragged([20, 30, 10])
+            self.assertEqual([ord(c) for c in 'efabcd'], tokens.tolist())
+            self.assertEqual([0, 2, 5, 6], offsets.tolist())
+            self.assertEqual([2, 1], cache.lengths([20, 10]).tolist())
+            # Arrays of the previous build are removed
+            self.assertEqual(4, len(os.listdir(_tokenizer_dir(root, tokenizer.name_or_path))))
+
+            # Interrupted build leaves the previous cache consistent
+            with self.assertRaises(RuntimeError):
+                TokenCache.build(root, tokenizer, [40], ['fail'])
+            cache = TokenCache(root, tokenizer.name_or_path)
+            self.assertEqual(3, len(cache))
+            self.assertEqual([ord('e'), ord('f')], cache[20].tolist())
+            with self.assertRaises(KeyError):
+                cache.rows([40])
+
+            # Cache without build id is refused
+            meta_path = path.join(_tokenizer_dir(root, tokenizer.name_or_path), 'meta.json')
+            with open(meta_path, 'w') as f:
+                json.dump({'tokenizer_name': tokenizer.name_or_path}, f)
+            with self.assertRaises(ValueError):
+                TokenCache(root, tokenizer.name_or_path)
@@ -0,0 +1,162 @@
+"""
+Inter-annotator agreement of Toloka assignments.
+
+Vectorized replacement of ``fleiss_kappa_table``/``set_fleiss_kappa`` from corpus_stats notebook:
+answers are counted by one ``bincount`` over (pair, class) codes instead of ``groupby.apply`` per pair.
+"""
+import pandas as pd
+import numpy as np
+
+import argparse
+from typing import Sequence, Union
+
+ASSIGNMENT_COLUMNS = {
+    'INPUT:question_1_id': 'left_id',
+    'INPUT:question_2_id': 'right_id',
+    'OUTPUT:class': 'class',
+    'ASSIGNMENT:worker_id': 'worker_id'
+}
+
+
+def load_assignments(assignments: Union[str, pd.DataFrame], drop_errors: bool = True) -> pd.DataFrame:
+    """Non-golden answers with 'left_id', 'right_id', 'class', 'worker_id' columns
+
+    Args:
+        assignments: assignments TSV path or loaded DataFrame
+        drop_errors: drop answers, where one of questions is marked as inaccessible
+    """
+    if isinstance(assignments, str):
+        assignments = pd.read_csv(assignments, sep='\t')
+    ans = assignments[assignments['GOLDEN:class'].isna()]
+    if drop_errors:
+        for col in ('OUTPUT:q_1_error', 'OUTPUT:q_2_error'):
+            if col in ans.columns:
+                ans = ans[~ans[col].astype(bool)]
+    ans = ans[list(ASSIGNMENT_COLUMNS)].drop_duplicates()
+    return ans.rename(columns=ASSIGNMENT_COLUMNS).reset_index(drop=True)
+
+
+def pair_counts(ans: pd.DataFrame, categories: Sequence = (0, 1)) -> pd.DataFrame:
+    """Number of answers of every class for every question pair
+
+    Args:
+        ans: answers with 'left_id', 'right_id', 'class' columns
+        categories: answer classes, columns of the table are in this order
+
+    Returns:
+        DataFrame indexed by (left_id, right_id) with one count column per class and 'num_raters' column
+    """
+    pair_codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([ans['left_id'], ans['right_id']]))
+    class_codes = pd.Categorical(ans['class'], categories=categories).codes
+    valid = class_codes >= 0
+    k = len(categories)
+    counts = np.bincount(
+        pair_codes[valid] * k + class_codes[valid],
+        minlength=len(pairs) * k
+    ).reshape(len(pairs), k)
+
+    table = pd.DataFrame(counts, index=pairs, columns=list(categories))
+    table.index.names = ['left_id', 'right_id']
+    table['num_raters'] = counts.sum(axis=1)
+    return table
+
+
+def fleiss_kappa(table: np.ndarray) -> float:
+    """Fleiss' kappa of items rated by the same number of raters
+
+    Args:
+        table: matrix of shape (number of items, number of categories) with number of raters per category
+    """
+    table = np.asarray(table, dtype=np.float64)
+    n_items = table.shape[0]
+    n_raters = table.sum(axis=1)
+    if n_items == 0 or not np.all(n_raters == n_raters[0]) or n_raters[0] < 2:
+        raise ValueError('Every item must be rated by the same number of raters (at least 2)')
+    n = n_raters[0]
+
+    p_cat = table.sum(axis=0) / (n_items * n)
+    p_item = (np.sum(table ** 2, axis=1) - n) / (n * (n - 1))
+    p_mean = p_item.mean()
+    p_expected = np.sum(p_cat ** 2)
+    if p_expected == 1.:
+        return 1. if p_mean == 1. else float('nan')
+    return float((p_mean - p_expected) / (1 - p_expected))
+
+
+def set_fleiss_kappa(ans: pd.DataFrame, categories: Sequence = (0, 1), final_agg: bool = True
+                     ) -> Union[float, pd.DataFrame]:
+    """Fleiss' kappa of a set of pairs with different number of raters
+
+    Pairs are grouped by number of raters, kappa of groups is averaged with weights proportional to group sizes.
+
+    Args:
+        ans: answers with 'left_id', 'right_id', 'class' columns
+        categories: answer classes
+        final_agg: return weighted average, otherwise table with kappa of every group
+
+    Returns:
+        Weighted kappa or DataFrame with 'num_raters', 'fleiss_kappa', 'num_entities' columns
+    """
+    table = pair_counts(ans, categories)
+    table = table[table['num_raters'] >= 2]
+    counts = table[list(categories)].to_numpy()
+    num_raters = table['num_raters'].to_numpy()
+
+    rows = []
+    for n in np.unique(num_raters):
+        group = counts[num_raters == n]
+        rows.append((int(n), fleiss_kappa(group), len(group)))
+    aggregated = pd.DataFrame(rows, columns=['num_raters', 'fleiss_kappa', 'num_entities'])
+    if not final_agg:
+        return aggregated
+    if len(aggregated) == 0:
+        return float('nan')
+    w = aggregated['num_entities'].to_numpy(dtype=np.float64)
+    return float(np.sum(w / w.sum() * aggregated['fleiss_kappa'].to_numpy()))
+
+
+def worker_golden_accuracy(assignments: pd.DataFrame) -> pd.DataFrame:
+    """Accuracy of every worker on golden (control) tasks
+
+    Args:
+        assignments: raw assignments with 'ASSIGNMENT:worker_id', 'OUTPUT:class', 'GOLDEN:class' columns
+
+    Returns:
+        DataFrame indexed by worker id with 'n_golden', 'n_correct', 'accuracy' columns
+    """
+    golden = assignments[~assignments['GOLDEN:class'].isna()]
+    worker_codes, workers = pd.factorize(golden['ASSIGNMENT:worker_id'])
+    correct = (golden['OUTPUT:class'].to_numpy() == golden['GOLDEN:class'].to_numpy())
+    n_golden = np.bincount(worker_codes, minlength=len(workers))
+    n_correct = np.bincount(worker_codes, weights=correct, minlength=len(workers)).astype(np.int64)
+    result = pd.DataFrame({
+        'n_golden': n_golden,
+        'n_correct': n_correct,
+        'accuracy': n_correct / np.maximum(n_golden, 1)
+    }, index=pd.Index(workers, name='worker_id'))
+    return result.sort_values('accuracy')
+
+
+def agreement_report(assignments: pd.DataFrame, categories: Sequence = (0, 1)) -> str:
+    ans = load_assignments(assignments)
+    table = pair_counts(ans, categories)
+    workers = worker_golden_accuracy(assignments)
+    lines = [
+        f'Pairs: {len(table)}, answers: {len(ans)}, workers: {ans["worker_id"].nunique()}',
+        f'Fleiss kappa: {set_fleiss_kappa(ans, categories):.4f}',
+        f'Unanimous pairs: {np.mean(table[list(categories)].max(axis=1) == table["num_raters"]):.4f}',
+        f'Golden accuracy: {workers["n_correct"].sum() / max(workers["n_golden"].sum(), 1):.4f}',
+    ]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inter-annotator agreement of Toloka assignments')
+    parser.add_argument('assignments', help='Assignments TSV')
+    parser.add_argument('--workers', action='store_true', help='Print golden accuracy of every worker')
+    args = parser.parse_args()
+
+    raw = pd.read_csv(args.assignments, sep='\t')
+    print(agreement_report(raw))
+    if args.workers:
+        print(worker_golden_accuracy(raw).to_string())
@@ -0,0 +1,387 @@
+"""
+Approximate nearest neighbour search over question embeddings.
+
+IVF-flat index: embeddings are clustered by spherical k-means, and every query is compared
+only with embeddings from ``n_probe`` closest clusters. New questions can be added without
+retraining, so only new questions have to be paired with the existing corpus.
+
+Recall and speed in comparison with exact search can be measured with
+``python -m utils.ann --embeddings embeddings_store/``
+"""
+import numpy as np
+
+import argparse
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils.similarity import PairChunk, normalize_embeddings, merge_topk
+from utils.embedding_store import load_embeddings
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+N_LISTS = 1024
+N_PROBE = 16
+QUERY_BATCH_SIZE = 1024
+
+
+class IndexNotTrainedError(RuntimeError):
+    pass
+
+
+def spherical_kmeans(embeddings: np.ndarray, n_clusters: int, n_iter: int = 20,
+                     seed: int = 0, batch_size: int = 65536) -> np.ndarray:
+    """Cluster normalized embeddings by cosine similarity
+
+    Returns:
+        Normalized centroids matrix of shape (n_clusters, dim)
+    """
+    rnd = np.random.RandomState(seed)
+    n_clusters = min(n_clusters, len(embeddings))
+    centroids = embeddings[rnd.choice(len(embeddings), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        for start in range(0, len(embeddings), batch_size):
+            batch = embeddings[start:start + batch_size]
+            assignment = np.argmax(batch @ centroids.T, axis=1)
+            np.add.at(sums, assignment, batch)
+            counts += np.bincount(assignment, minlength=n_clusters)
+
+        empty = counts == 0
+        if empty.any():
+            # Reinitialize empty clusters by random points
+            sums[empty] = embeddings[rnd.choice(len(embeddings), int(empty.sum()), replace=False)]
+        centroids = normalize_embeddings(sums, dtype=embeddings.dtype)
+    return centroids
+
+
+class IVFFlatIndex(object):
+    """
+    Inverted file index with exact (flat) comparison inside probed clusters.
+    Cosine similarity is used, all vectors are L2-normalized on adding.
+
+    Every list is kept in buffers with spare capacity, which grows geometrically, so adding a few vectors
+    doesn't copy the whole list. Map of id to its list makes removal touch only lists of removed ids.
+    """
+    def __init__(self, n_lists: int = N_LISTS, n_probe: int = N_PROBE):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids = None
+        # Buffers of lists, only the first _list_sizes[i] rows are valid
+        self._list_ids = []
+        self._list_vectors = []
+        self._list_sizes = []
+        self._id_list = {}
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self.centroids is None else self.centroids.shape[1]
+
+    def __len__(self) -> int:
+        return len(self._id_list)
+
+    def _ids(self, list_i: int) -> np.ndarray:
+        return self._list_ids[list_i][:self._list_sizes[list_i]]
+
+    def _vectors(self, list_i: int) -> np.ndarray:
+        return self._list_vectors[list_i][:self._list_sizes[list_i]]
+
+    def _set_lists(self, list_ids: List[np.ndarray], list_vectors: List[np.ndarray]) -> None:
+        self._list_ids = list_ids
+        self._list_vectors = list_vectors
+        self._list_sizes = [len(ids) for ids in list_ids]
+        self._id_list = {}
+        for list_i, ids in enumerate(list_ids):
+            self._id_list.update(dict.fromkeys(ids.tolist(), list_i))
+
+    def _append(self, list_i: int, ids: np.ndarray, vectors: np.ndarray) -> None:
+        size = self._list_sizes[list_i]
+        new_size = size + len(ids)
+        capacity = len(self._list_ids[list_i])
+        if new_size > capacity:
+            capacity = max(new_size, 2 * capacity)
+            list_ids = np.empty(capacity, dtype=np.int64)
+            list_ids[:size] = self._list_ids[list_i][:size]
+            list_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            list_vectors[:size] = self._list_vectors[list_i][:size]
+            self._list_ids[list_i] = list_ids
+            self._list_vectors[list_i] = list_vectors
+        self._list_ids[list_i][size:new_size] = ids
+        self._list_vectors[list_i][size:new_size] = vectors
+        self._list_sizes[list_i] = new_size
+        self._id_list.update(dict.fromkeys(ids.tolist(), list_i))
+
+    def train(self, embeddings: np.ndarray, n_iter: int = 20, sample_size: int = 100_000, seed: int = 0) -> None:
+        """Compute cluster centroids on a random sample of embeddings"""
+        rnd = np.random.RandomState(seed)
+        if len(embeddings) > sample_size:
+            embeddings = embeddings[np.sort(rnd.choice(len(embeddings), sample_size, replace=False))]
+        embeddings = normalize_embeddings(embeddings)
+
+        self.centroids = spherical_kmeans(embeddings, self.n_lists, n_iter=n_iter, seed=seed)
+        self.n_lists = len(self.centroids)
+        dim = self.centroids.shape[1]
+        self._set_lists(
+            [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)],
+            [np.empty((0, dim), dtype=np.float32) for _ in range(self.n_lists)]
+        )
+
+    def _assign(self, vectors: np.ndarray, n_probe: int) -> np.ndarray:
+        sim = vectors @ self.centroids.T
+        n_probe = min(n_probe, self.n_lists)
+        if n_probe == 1:
+            return np.argmax(sim, axis=1)[:, None]
+        return np.argpartition(-sim, n_probe - 1, axis=1)[:, :n_probe]
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray) -> None:
+        """Add new questions to the index, vectors of already indexed ids are replaced
+
+        Raises:
+            ValueError: if ids are not unique
+        """
+        if not self.is_trained:
+            raise IndexNotTrainedError('Index must be trained before adding vectors')
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(np.unique(ids)) < len(ids):
+            raise ValueError('Added ids must be unique')
+        self.remove(ids)
+        vectors = normalize_embeddings(embeddings)
+        assignment = self._assign(vectors, 1)[:, 0]
+
+        order = np.argsort(assignment, kind='stable')
+        lists, starts = np.unique(assignment[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for list_i, start, end in zip(lists.tolist(), starts.tolist(), ends.tolist()):
+            rows = order[start:end]
+            self._append(list_i, ids[rows], vectors[rows])
+
+    def remove(self, ids: np.ndarray) -> int:
+        """Remove questions from the index, absent ids are ignored
+
+        Returns:
+            Number of removed vectors
+        """
+        removed = {}
+        for q_id in np.asarray(ids, dtype=np.int64).tolist():
+            list_i = self._id_list.pop(q_id, None)
+            if list_i is not None:
+                removed.setdefault(list_i, []).append(q_id)
+
+        for list_i, list_removed in removed.items():
+            keep = ~np.isin(self._ids(list_i), list_removed)
+            size = int(keep.sum())
+            # Kept rows are moved to the beginning of the buffers
+            self._list_ids[list_i][:size] = self._ids(list_i)[keep]
+            self._list_vectors[list_i][:size] = self._vectors(list_i)[keep]
+            self._list_sizes[list_i] = size
+        return sum(len(list_removed) for list_removed in removed.values())
+
+    def _probe_groups(self, queries: np.ndarray, n_probe: int) -> Dict[int, np.ndarray]:
+        probes = self._assign(queries, n_probe)
+        query_idx = np.repeat(np.arange(len(queries)), probes.shape[1])
+        lists = probes.ravel()
+        order = np.argsort(lists, kind='stable')
+        lists, starts = np.unique(lists[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        return {
+            list_i: query_idx[order[start:end]]
+            for list_i, start, end in zip(lists.tolist(), starts.tolist(), ends.tolist())
+        }
+
+    def search(self, queries: np.ndarray, k: int, n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Search k nearest neighbours
+
+        Args:
+            queries: query embeddings
+            k: number of neighbours
+            n_probe: number of probed clusters, ``self.n_probe`` by default
+
+        Returns:
+            Tuple of ids and similarities matrices of shape (len(queries), k), sorted by similarity.
+            Missing neighbours have id -1 and similarity -inf.
+        """
+        if not self.is_trained:
+            raise IndexNotTrainedError('Index must be trained before search')
+        queries = normalize_embeddings(queries)
+        best_val = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for list_i, query_idx in self._probe_groups(queries, n_probe or self.n_probe).items():
+            list_ids = self._ids(list_i)
+            if len(list_ids) == 0:
+                continue
+            sim = queries[query_idx] @ self._vectors(list_i).T
+            tile_k = min(k, sim.shape[1])
+            part = np.argpartition(-sim, tile_k - 1, axis=1)[:, :tile_k]
+            val, idx = merge_topk(
+                best_val[query_idx], best_ids[query_idx],
+                np.take_along_axis(sim, part, axis=1), list_ids[part],
+                k
+            )
+            best_val[query_idx] = val
+            best_ids[query_idx] = idx
+
+        order = np.argsort(-best_val, axis=1, kind='stable')
+        return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_val, order, axis=1)
+
+    def range_search(self, queries: np.ndarray, threshold: float,
+                     n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Search all neighbours with similarity >= threshold
+
+        Returns:
+            Tuple of query row numbers, neighbour ids and similarities
+        """
+        if not self.is_trained:
+            raise IndexNotTrainedError('Index must be trained before search')
+        queries = normalize_embeddings(queries)
+        rows, ids, sims = [], [], []
+        for list_i, query_idx in self._probe_groups(queries, n_probe or self.n_probe).items():
+            list_ids = self._ids(list_i)
+            if len(list_ids) == 0:
+                continue
+            sim = queries[query_idx] @ self._vectors(list_i).T
+            q_shift, v_shift = np.nonzero(sim >= threshold)
+            rows.append(query_idx[q_shift])
+            ids.append(list_ids[v_shift])
+            sims.append(sim[q_shift, v_shift])
+
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(rows), np.concatenate(ids), np.concatenate(sims)
+
+    def add_and_pair(self, embeddings: np.ndarray, ids: np.ndarray, threshold: float,
+                     n_probe: Optional[int] = None) -> PairChunk:
+        """Add new questions and find similar pairs, where at least one question is new
+
+        Returns:
+            (left_ids, right_ids, similarities) of found pairs, every pair is found once
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        self.add(embeddings, ids)
+        rows, right_ids, sims = self.range_search(embeddings, threshold, n_probe)
+        left_ids = ids[rows]
+
+        # Pairs of two new questions are found twice, pairs with itself are found once
+        is_new = np.isin(right_ids, ids)
+        mask = (left_ids != right_ids) & (~is_new | (left_ids < right_ids))
+        return left_ids[mask], right_ids[mask], sims[mask]
+
+    def save(self, file_path: str) -> None:
+        """Save index to file in ``.npz`` format, the file is replaced only after it is completely written"""
+        if not self.is_trained:
+            raise IndexNotTrainedError('Only trained index can be saved')
+        # File object is passed, so numpy doesn't append '.npz' extension to the path
+        with open(file_path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                n_probe=np.int64(self.n_probe),
+                centroids=self.centroids,
+                sizes=np.array(self._list_sizes, dtype=np.int64),
+                ids=np.concatenate([self._ids(list_i) for list_i in range(self.n_lists)]),
+                vectors=np.concatenate([self._vectors(list_i) for list_i in range(self.n_lists)]),
+            )
+        os.replace(file_path + '.tmp', file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'IVFFlatIndex':
+        with np.load(file_path, allow_pickle=False) as data:
+            index = cls(n_lists=len(data['centroids']), n_probe=int(data['n_probe']))
+            index.centroids = data['centroids']
+            bounds = np.cumsum(data['sizes'])[:-1]
+            index._set_lists(np.split(data['ids'], bounds), np.split(data['vectors'], bounds))
+        return index
+
+
+def exact_search(embeddings: np.ndarray, ids: np.ndarray, queries: np.ndarray, k: int,
+                 batch_size: int = QUERY_BATCH_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Brute force k nearest neighbours search, used as ground truth"""
+    embeddings = normalize_embeddings(embeddings)
+    queries = normalize_embeddings(queries)
+    ids = np.asarray(ids)
+    res_ids = np.empty((len(queries), k), dtype=ids.dtype)
+    res_sims = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        sim = queries[start:start + batch_size] @ embeddings.T
+        part = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        part_sim = np.take_along_axis(sim, part, axis=1)
+        order = np.argsort(-part_sim, axis=1)
+        res_ids[start:start + batch_size] = ids[np.take_along_axis(part, order, axis=1)]
+        res_sims[start:start + batch_size] = np.take_along_axis(part_sim, order, axis=1)
+    return res_ids, res_sims
+
+
+def recall_at_k(found_ids: np.ndarray, true_ids: np.ndarray) -> float:
+    """Fraction of true neighbours, which were found"""
+    hits = 0
+    for found, true in zip(found_ids, true_ids):
+        hits += len(np.intersect1d(found, true))
+    return hits / true_ids.size
+
+
+def benchmark(index: IVFFlatIndex, embeddings: np.ndarray, ids: np.ndarray, queries: np.ndarray,
+              k: int = 10, n_probes: Optional[List[int]] = None) -> List[Dict[str, float]]:
+    """Measure recall@k and throughput of the index against exact search
+
+    Returns:
+        One record per probed clusters number
+    """
+    start = time.perf_counter()
+    true_ids, _ = exact_search(embeddings, ids, queries, k)
+    exact_qps = len(queries) / (time.perf_counter() - start)
+
+    if n_probes is None:
+        n_probes = [index.n_probe]
+    records = []
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        found_ids = np.concatenate([
+            index.search(queries[i:i + QUERY_BATCH_SIZE], k, n_probe)[0]
+            for i in range(0, len(queries), QUERY_BATCH_SIZE)
+        ])
+        ann_qps = len(queries) / (time.perf_counter() - start)
+        records.append({
+            'n_probe': n_probe,
+            f'recall@{k}': recall_at_k(found_ids, true_ids),
+            'ann_qps': ann_qps,
+            'exact_qps': exact_qps,
+            'speedup': ann_qps / exact_qps
+        })
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build IVF index over question embeddings and measure its recall')
+    parser.add_argument('--embeddings', required=True, help='Embedding store directory or pickled {id: embedding} dict')
+    parser.add_argument('--index', help='Path to save built index (.npz)')
+    parser.add_argument('--n-lists', type=int, default=N_LISTS, help='Number of clusters')
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[N_PROBE], help='Numbers of probed clusters')
+    parser.add_argument('-k', type=int, default=10, help='Number of neighbours')
+    parser.add_argument('--n-queries', type=int, default=1000, help='Number of random queries for benchmark')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    q_ids, q_embeddings = load_embeddings(args.embeddings)
+    ivf = IVFFlatIndex(n_lists=args.n_lists, n_probe=args.n_probe[0])
+
+    t = time.perf_counter()
+    ivf.train(q_embeddings, seed=args.seed)
+    for batch_start in tqdm(range(0, len(q_ids), 65536), unit='batch', desc='Adding embeddings'):
+        ivf.add(q_embeddings[batch_start:batch_start + 65536], q_ids[batch_start:batch_start + 65536])
+    print(f'Index with {len(ivf)} vectors is built in {time.perf_counter() - t:.1f} s')
+    if args.index is not None:
+        ivf.save(args.index)
+
+    query_rows = np.random.RandomState(args.seed).choice(len(q_ids), min(args.n_queries, len(q_ids)), replace=False)
+    for record in benchmark(ivf, q_embeddings, q_ids, q_embeddings[query_rows], k=args.k, n_probes=args.n_probe):
+        print(', '.join(f'{key}: {val:.4f}' if isinstance(val, float) else f'{key}: {val}'
+                        for key, val in record.items()))
@@ -0,0 +1,22 @@
+"""
+Writing of small files (manifests, metadata, progress), which must never be seen half-written.
+
+Content is written into ``<file>.tmp`` and then atomically renamed over the target,
+so readers and resumed jobs see either the previous or the new version of the file.
+"""
+import json
+import os
+from typing import Optional
+
+
+def atomic_write_text(file_path: str, text: str) -> None:
+    """Write text into temporary file and replace the target with it"""
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, file_path)
+
+
+def atomic_write_json(file_path: str, obj, indent: Optional[int] = None) -> None:
+    """Write JSON into temporary file and replace the target with it"""
+    atomic_write_text(file_path, json.dumps(obj, indent=indent))
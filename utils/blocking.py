@@ -0,0 +1,331 @@
+"""
+Tag-aware blocking of similarity search.
+
+Every tag of ``question_tag`` relation defines a block of questions, tags with fewer than ``min_block_size``
+questions are merged with the tag they co-occur with most often, untagged questions form one fallback block.
+A question with several tags belongs to several (overlapping) blocks. Similarity search runs inside every
+block independently (blocks in parallel threads), so the number of compared pairs is the sum of squared
+block sizes instead of the square of corpus size. Recall of blocking is estimated by the full search
+for a sample of questions: a close pair is found iff both questions share a block.
+
+Example:
+    python -m utils.blocking embeddings/ All_questions_with_tags.csv blocked_pairs/ --threshold 0.85 --recall-sample 2000
+"""
+import pandas as pd
+import numpy as np
+
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from os import path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+try:
+    from threadpoolctl import threadpool_limits
+except ModuleNotFoundError:
+    threadpool_limits = None
+
+from utils.atomic_write import atomic_write_json
+from utils.similarity import (
+    PairChunk, SIM_BATCH_SIZE, SIMILARITY_THRESHOLD, SimilaritySearch, normalize_embeddings, read_similar_pairs
+)
+
+MIN_BLOCK_SIZE = 1000
+UNTAGGED_BLOCK = '<untagged>'
+TAG_SEPARATOR = '|'
+BLOCKS_NAME = 'blocks.json'
+PAIRS_CHUNK_SIZE = 100_000
+
+
+class Block(NamedTuple):
+    name: str
+    ids: np.ndarray
+
+
+def read_question_tags(file_path: str, sep: str = ';') -> pd.DataFrame:
+    """Question tags from questions CSV with 'id' and 'tags' columns (tags are joined by TAG_SEPARATOR)
+
+    Returns:
+        DataFrame with 'question_id' and 'tag' columns, one row per question tag
+    """
+    questions = pd.read_csv(file_path, sep=sep, usecols=['id', 'tags'], keep_default_na=False)
+    tags = questions['tags'].astype(str).str.split(TAG_SEPARATOR, regex=False)
+    result = pd.DataFrame({'question_id': questions['id'].repeat(tags.map(len)), 'tag': np.concatenate(tags.to_numpy())})
+    return result[result['tag'] != ''].reset_index(drop=True)
+
+
+def load_question_tags(db_url: str) -> pd.DataFrame:
+    """Question tags from ``question_tag`` relation of scraped database"""
+    from sqlalchemy import create_engine, select
+    from database.models import QuestionTag, Tag
+
+    engine = create_engine(db_url)
+    stmt = select(QuestionTag.c.question_id, Tag.tag).join(Tag, Tag.id == QuestionTag.c.tag_id)
+    with engine.connect() as conn:
+        return pd.DataFrame(conn.execute(stmt).all(), columns=['question_id', 'tag'])
+
+
+def build_blocks(question_tags: pd.DataFrame, ids: Sequence[int], min_block_size: int = MIN_BLOCK_SIZE
+                 ) -> List[Block]:
+    """Split questions into overlapping blocks by tags
+
+    Args:
+        question_tags: DataFrame with 'question_id' and 'tag' columns
+        ids: all question ids (questions without tags go to the fallback block)
+        min_block_size: tags with fewer questions are merged with the most co-occurring tag
+
+    Returns:
+        Blocks sorted by size (descending), ids of every block are sorted
+    """
+    ids = np.asarray(ids)
+    question_tags = question_tags[question_tags['question_id'].isin(ids)].drop_duplicates()
+    tag_codes, tag_names = pd.factorize(question_tags['tag'])
+    q_ids = question_tags['question_id'].to_numpy()
+
+    members: Dict[int, set] = {}
+    question_tag_codes: Dict[int, List[int]] = {}
+    for q_id, code in zip(q_ids.tolist(), tag_codes.tolist()):
+        members.setdefault(code, set()).add(q_id)
+        question_tag_codes.setdefault(q_id, []).append(code)
+
+    # Union-find over tags, small tags are merged in ascending order of size
+    parent = list(range(len(tag_names)))
+
+    def find(code: int) -> int:
+        while parent[code] != code:
+            parent[code] = parent[parent[code]]
+            code = parent[code]
+        return code
+
+    for code in sorted(members, key=lambda c: len(members[c])):
+        root = find(code)
+        if len(members[root]) >= min_block_size:
+            continue
+        co_occurrence = Counter(
+            find(other) for q_id in members[root] for other in question_tag_codes[q_id] if find(other) != root
+        )
+        if len(co_occurrence) == 0:
+            continue
+        target = co_occurrence.most_common(1)[0][0]
+        parent[root] = target
+        members[target] |= members.pop(root)
+
+    block_tags: Dict[int, List[str]] = {}
+    for code, name in enumerate(tag_names):
+        block_tags.setdefault(find(code), []).append(name)
+    blocks = [
+        Block(TAG_SEPARATOR.join(sorted(block_tags[root])), np.array(sorted(block_ids), dtype=ids.dtype))
+        for root, block_ids in members.items()
+    ]
+
+    untagged = np.setdiff1d(ids, q_ids)
+    if len(untagged) > 0:
+        blocks.append(Block(UNTAGGED_BLOCK, untagged))
+    return sorted(blocks, key=lambda b: -len(b.ids))
+
+
+def blocking_cost(blocks: Sequence[Block], n_questions: int) -> float:
+    """Share of compared pairs with blocking relative to the full search"""
+    full = n_questions * (n_questions - 1) / 2
+    blocked = sum(len(b.ids) * (len(b.ids) - 1) / 2 for b in blocks)
+    return blocked / max(full, 1)
+
+
+def _block_dir(out_dir: str, block_i: int) -> str:
+    return path.join(out_dir, f'block-{block_i:05d}')
+
+
+def blocked_search(embeddings: np.ndarray, ids: np.ndarray, blocks: Sequence[Block], out_dir: str,
+                   threshold: Optional[float] = SIMILARITY_THRESHOLD, k: Optional[int] = None,
+                   block_size: int = SIM_BATCH_SIZE, n_jobs: Optional[int] = None, silent: bool = False) -> int:
+    """Similarity search inside every block, blocks are processed by a thread pool
+
+    Results of every block are saved by ``SimilaritySearch.search`` into its own subdirectory,
+    so interrupted search is resumed block by block.
+
+    Returns:
+        Total number of found pairs (pairs found in several blocks are counted several times)
+    """
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    atomic_write_json(path.join(out_dir, BLOCKS_NAME), {
+        'threshold': threshold,
+        'k': k,
+        'blocks': [{'name': b.name, 'size': int(len(b.ids))} for b in blocks],
+    })
+
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    embeddings = normalize_embeddings(embeddings)
+
+    def job(block_i: int) -> int:
+        rows = order[np.searchsorted(sorted_ids, blocks[block_i].ids)]
+        search = SimilaritySearch(embeddings[rows], ids[rows], block_size=block_size, normalized=True)
+        return search.search(_block_dir(out_dir, block_i), threshold=threshold, k=k, n_jobs=1, silent=True)
+
+    # Every thread computes its own tiles, so BLAS shouldn't spawn threads too
+    if threadpool_limits is not None and n_jobs > 1:
+        limits = threadpool_limits(limits=1, user_api='blas')
+    else:
+        limits = nullcontext()
+
+    # The largest blocks are started first
+    with limits, ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        results = executor.map(job, range(len(blocks)))
+        if not silent:
+            results = tqdm(results, total=len(blocks), unit='block')
+        return sum(results)
+
+
+def _next_chunk(it: Iterator[PairChunk]) -> Optional[pd.DataFrame]:
+    for left, right, sims in it:
+        if len(left) > 0:
+            return pd.DataFrame({'left_id': left, 'right_id': right, 'similarity': sims})
+    return None
+
+
+def _merge_window(window: pd.DataFrame, k: Optional[int]) -> pd.DataFrame:
+    if k is None:
+        window = window.sort_values(['left_id', 'right_id'], kind='stable')
+        return window.drop_duplicates(['left_id', 'right_id'])
+    window = window.sort_values(['left_id', 'similarity'], ascending=[True, False], kind='stable')
+    window = window.drop_duplicates(['left_id', 'right_id'])
+    return window.groupby('left_id', sort=False).head(k)
+
+
+def _concat_chunk(frames: List[pd.DataFrame]) -> PairChunk:
+    pairs = pd.concat(frames, ignore_index=True)
+    return pairs['left_id'].to_numpy(), pairs['right_id'].to_numpy(), pairs['similarity'].to_numpy()
+
+
+def read_blocked_pairs(out_dir: str, chunk_size: int = PAIRS_CHUNK_SIZE) -> Iterator[PairChunk]:
+    """Pairs found in all blocks as (left_ids, right_ids, similarities) chunks ordered by left id
+
+    A pair found in several blocks is returned once (with left id < right id in threshold mode),
+    in k-NN mode k most similar neighbours over all blocks are kept for every question.
+
+    Ids of every block are sorted, so results of a block come in increasing ranges of left ids.
+    Blocks are merged by left id: pairs with left id up to the smallest last read left id of unfinished
+    blocks are complete, they are deduplicated and yielded, so only about one part per block is in memory.
+
+    Args:
+        out_dir: output directory of ``blocked_search``
+        chunk_size: approximate number of pairs in a chunk
+    """
+    with open(path.join(out_dir, BLOCKS_NAME)) as f:
+        info = json.load(f)
+    streams = [read_similar_pairs(_block_dir(out_dir, block_i)) for block_i in range(len(info['blocks']))]
+
+    # The last read left id of every unfinished block
+    heads: Dict[int, int] = {}
+    pending = []
+    for block_i, stream in enumerate(streams):
+        chunk = _next_chunk(stream)
+        if chunk is not None:
+            pending.append(chunk)
+            heads[block_i] = chunk['left_id'].max()
+
+    ready = []
+    n_ready = 0
+    while len(pending) > 0:
+        pairs = pd.concat(pending, ignore_index=True)
+        frontier = min(heads.values()) if len(heads) > 0 else None
+        if frontier is None:
+            pending = []
+        else:
+            complete = (pairs['left_id'] <= frontier).to_numpy()
+            pending = [pairs[~complete]]
+            pairs = pairs[complete]
+        if len(pairs) > 0:
+            ready.append(_merge_window(pairs, info['k']))
+            n_ready += len(ready[-1])
+        if n_ready >= chunk_size:
+            yield _concat_chunk(ready)
+            ready = []
+            n_ready = 0
+
+        for block_i in [b for b, head in heads.items() if head == frontier]:
+            chunk = _next_chunk(streams[block_i])
+            if chunk is None:
+                del heads[block_i]
+            else:
+                pending.append(chunk)
+                heads[block_i] = chunk['left_id'].max()
+    if n_ready > 0:
+        yield _concat_chunk(ready)
+
+
+def estimate_recall(embeddings: np.ndarray, ids: np.ndarray, blocks: Sequence[Block],
+                    threshold: float = SIMILARITY_THRESHOLD, sample_size: int = 1000, seed: int = 0,
+                    col_block_size: int = 16384) -> Dict[str, float]:
+    """Recall of blocked threshold search relative to the full search on a sample of questions
+
+    Returns:
+        'recall': share of close pairs of sampled questions, which share a block,
+        'n_pairs': number of close pairs of sampled questions in the full search,
+        'compared_share': share of compared pairs with blocking
+    """
+    embeddings = normalize_embeddings(embeddings)
+    rnd = np.random.RandomState(seed)
+    sample = rnd.choice(len(ids), size=min(sample_size, len(ids)), replace=False)
+
+    membership: Dict[int, set] = {}
+    for block_i, block in enumerate(blocks):
+        for q_id in block.ids.tolist():
+            membership.setdefault(q_id, set()).add(block_i)
+
+    n_pairs = 0
+    n_covered = 0
+    for col_start in range(0, len(ids), col_block_size):
+        sim = embeddings[sample] @ embeddings[col_start:col_start + col_block_size].T
+        row_i, col_i = np.nonzero(sim >= threshold)
+        col_i = col_i + col_start
+        not_self = sample[row_i] != col_i
+        for left, right in zip(ids[sample[row_i[not_self]]].tolist(), ids[col_i[not_self]].tolist()):
+            n_pairs += 1
+            n_covered += not membership.get(left, set()).isdisjoint(membership.get(right, set()))
+    return {
+        'recall': n_covered / n_pairs if n_pairs > 0 else 1.,
+        'n_pairs': n_pairs,
+        'compared_share': blocking_cost(blocks, len(ids)),
+    }
+
+
+if __name__ == '__main__':
+    from utils.embedding_store import load_embeddings
+
+    parser = argparse.ArgumentParser(description='Similarity search inside tag blocks')
+    parser.add_argument('embeddings', help='Embedding store directory or pickled embeddings dict')
+    parser.add_argument('tags', help="Questions CSV with 'id' and 'tags' columns or database url")
+    parser.add_argument('out_dir', help='Output directory')
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD, help='Similarity threshold')
+    parser.add_argument('--k', type=int, help='Search k nearest neighbours inside blocks')
+    parser.add_argument('--min-block-size', type=int, default=MIN_BLOCK_SIZE, help='Smaller tags are merged')
+    parser.add_argument('--n-jobs', type=int, help='Number of threads')
+    parser.add_argument('--recall-sample', type=int, default=0, help='Questions sampled for recall estimation')
+    args = parser.parse_args()
+
+    q_ids, emb = load_embeddings(args.embeddings)
+    if '://' in args.tags:
+        q_tags = load_question_tags(args.tags)
+    else:
+        q_tags = read_question_tags(args.tags)
+    question_blocks = build_blocks(q_tags, q_ids, args.min_block_size)
+    print(f'{len(question_blocks)} blocks, the largest has {len(question_blocks[0].ids)} questions, '
+          f'{blocking_cost(question_blocks, len(q_ids)):.2%} of pairs are compared')
+    if args.recall_sample > 0:
+        report = estimate_recall(emb, q_ids, question_blocks, args.threshold, args.recall_sample)
+        print(f'Estimated recall: {report["recall"]:.4f} on {report["n_pairs"]} pairs')
+    n_found = blocked_search(emb, q_ids, question_blocks, args.out_dir, args.threshold, args.k,
+                             n_jobs=args.n_jobs)
+    print(f'{n_found} pairs are found')
@@ -0,0 +1,227 @@
+"""
+Construction of candidate pairs table from similar question ids.
+
+Replacement of ``construct_similarity_dataframe`` from the candidates selection notebook.
+Question texts and urls are resolved with one vectorized lookup per chunk of pairs,
+and resulting rows are streamed to the output instead of being accumulated in memory.
+"""
+import pandas as pd
+import numpy as np
+
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Tuple, Union, TextIO
+
+from utils.text_distance import HeuristicComparator
+
+PairChunk = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+SIM_COLUMNS = ['left_id', 'left_text', 'left_url', 'right_id', 'right_text', 'right_url', 'similarity']
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+class QuestionTable(object):
+    """
+    Questions table indexed by question id.
+    Lookup of many ids is a single binary search over sorted id array.
+    """
+    def __init__(self, questions_df: pd.DataFrame):
+        """
+        Args:
+            questions_df: DataFrame with 'id', 'text' and (optionally) 'url' columns
+        """
+        order = np.argsort(questions_df['id'].to_numpy(), kind='stable')
+        self.ids = questions_df['id'].to_numpy()[order]
+        if len(self.ids) > 1 and (self.ids[1:] == self.ids[:-1]).any():
+            raise ValueError('Question ids must be unique')
+
+        self.texts = questions_df['text'].to_numpy(dtype=object)[order]
+        if 'url' in questions_df.columns:
+            self.urls = questions_df['url'].to_numpy(dtype=object)[order]
+        else:
+            self.urls = np.full(len(self.ids), '', dtype=object)
+
+    @classmethod
+    def from_csv(cls, path: str, sep: str = ';') -> 'QuestionTable':
+        return cls(pd.read_csv(path, sep=sep, usecols=lambda col: col in ('id', 'text', 'url')))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, q_id: int) -> bool:
+        pos = np.searchsorted(self.ids, q_id)
+        return pos < len(self.ids) and self.ids[pos] == q_id
+
+    def __getitem__(self, q_id: int) -> str:
+        return self.texts[self.positions([q_id])[0]]
+
+    def positions(self, ids: Union[np.ndarray, Iterable[int]]) -> np.ndarray:
+        """Get rows of given question ids
+
+        Raises:
+            KeyError: if some id is absent in the table
+        """
+        ids = np.asarray(ids)
+        pos = np.searchsorted(self.ids, ids)
+        pos_clipped = np.minimum(pos, len(self.ids) - 1)
+        missing = (pos >= len(self.ids)) | (self.ids[pos_clipped] != ids)
+        if missing.any():
+            raise KeyError(f'Unknown question ids: {ids[missing][:10].tolist()}')
+        return pos
+
+
+def chunk_pairs(it: Iterable[Tuple[int, int, float]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[PairChunk]:
+    """Group (left_id, right_id, similarity) tuples into array chunks"""
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if len(chunk) == 0:
+            return
+        left_ids, right_ids, sims = zip(*chunk)
+        yield (
+            np.asarray(left_ids, dtype=np.int64),
+            np.asarray(right_ids, dtype=np.int64),
+            np.asarray(sims, dtype=np.float64)
+        )
+
+
+def _pair_hashes(left_text: np.ndarray, right_text: np.ndarray) -> np.ndarray:
+    # order agnostic hash of texts pair, the same idea as in QuestionPairBase
+    left_hash = pd.util.hash_array(left_text.astype(object), categorize=False)
+    right_hash = pd.util.hash_array(right_text.astype(object), categorize=False)
+    return left_hash ^ right_hash
+
+
+class _HashSet(object):
+    """
+    Set of uint64 hashes stored as sorted runs of decreasing sizes (like LSM tree).
+    Membership is a binary search per run, a run is merged only with runs of at least its size,
+    so every hash is copied O(log n) times instead of on every insertion. Memory is 8 bytes per hash.
+    """
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(values), dtype=bool)
+        for run in self.runs:
+            pos = np.minimum(np.searchsorted(run, values), len(run) - 1)
+            found |= run[pos] == values
+        return found
+
+    def add(self, values: np.ndarray) -> None:
+        """Add sorted unique values absent in the set"""
+        run = values
+        while len(self.runs) > 0 and len(self.runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([self.runs.pop(), run]), kind='mergesort')
+        if len(run) > 0:
+            self.runs.append(run)
+
+
+def iter_similarity_frames(
+        chunks: Iterable[PairChunk],
+        questions: QuestionTable,
+        comparator: Optional[HeuristicComparator] = None,
+        drop_duplicates: bool = True
+        ) -> Iterator[pd.DataFrame]:
+    """Resolve similar question ids into candidate pairs tables
+
+    Args:
+        chunks: iterable of (left_ids, right_ids, similarities) arrays
+        questions: table with question texts
+        comparator: pairs of almost the same questions are dropped using this comparator.
+            If None, default ``HeuristicComparator`` over questions texts is used
+        drop_duplicates: drop pairs with the same texts as already yielded ones
+            (hashes of yielded text pairs are kept, 8 bytes per pair)
+
+    Yields:
+        DataFrames with columns from ``SIM_COLUMNS``
+    """
+    if comparator is None:
+        comparator = HeuristicComparator(questions)
+    seen = _HashSet()
+
+    for left_ids, right_ids, sims in chunks:
+        left_ids = np.asarray(left_ids)
+        right_ids = np.asarray(right_ids)
+        sims = np.asarray(sims)
+        if len(left_ids) == 0:
+            continue
+
+        # There are some pairs with too similar text
+        keep = ~comparator.batch(left_ids, right_ids)
+        left_ids, right_ids, sims = left_ids[keep], right_ids[keep], sims[keep]
+
+        left_pos = questions.positions(left_ids)
+        right_pos = questions.positions(right_ids)
+        left_text = questions.texts.take(left_pos)
+        right_text = questions.texts.take(right_pos)
+
+        if drop_duplicates:
+            hashes = _pair_hashes(left_text, right_text)
+            hashes, first_idx = np.unique(hashes, return_index=True)
+            new = ~seen.contains(hashes)
+            seen.add(hashes[new])
+
+            idx = np.sort(first_idx[new])
+            left_ids, right_ids, sims = left_ids[idx], right_ids[idx], sims[idx]
+            left_pos, right_pos = left_pos[idx], right_pos[idx]
+            left_text, right_text = left_text[idx], right_text[idx]
+
+        if len(left_ids) == 0:
+            continue
+        yield pd.DataFrame({
+            'left_id': left_ids,
+            'left_text': left_text,
+            'left_url': questions.urls.take(left_pos),
+            'right_id': right_ids,
+            'right_text': right_text,
+            'right_url': questions.urls.take(right_pos),
+            'similarity': sims
+        }, columns=SIM_COLUMNS)
+
+
+def write_similarity_csv(
+        chunks: Iterable[PairChunk],
+        questions: QuestionTable,
+        out: Union[str, TextIO],
+        sep: str = ';',
+        comparator: Optional[HeuristicComparator] = None
+        ) -> int:
+    """Stream candidate pairs table to CSV file
+
+    Returns:
+        Number of written pairs
+    """
+    close = False
+    if isinstance(out, str):
+        out = open(out, 'w', encoding='UTF-8', newline='')
+        close = True
+
+    n_written = 0
+    try:
+        for df in iter_similarity_frames(chunks, questions, comparator):
+            df.to_csv(out, sep=sep, index=False, header=(n_written == 0))
+            n_written += len(df)
+        if n_written == 0:
+            pd.DataFrame(columns=SIM_COLUMNS).to_csv(out, sep=sep, index=False)
+    finally:
+        if close:
+            out.close()
+    return n_written
+
+
+def construct_similarity_dataframe(
+        it: Iterable[Tuple[int, int, float]],
+        questions: Union[QuestionTable, pd.DataFrame],
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+        ) -> pd.DataFrame:
+    """In-memory version for small pair sets (e.g. similarity bins), sorted by similarity"""
+    if isinstance(questions, pd.DataFrame):
+        questions = QuestionTable(questions)
+    frames = list(iter_similarity_frames(chunk_pairs(it, chunk_size), questions))
+    if len(frames) == 0:
+        return pd.DataFrame(columns=SIM_COLUMNS)
+    sim_df = pd.concat(frames, ignore_index=True)
+    return sim_df.sort_values(by=['similarity'], ascending=False).reset_index(drop=True)
@@ -0,0 +1,249 @@
+"""
+Near-duplicate questions collapsing by MinHash/LSH over character shingles.
+
+Questions are grouped when the estimated Jaccard similarity of their character shingle sets reaches
+the threshold. Every group is represented by its smallest question id, only canonical questions
+have to be embedded and paired, duplicates are mapped to them by ``canonical_ids.csv``.
+
+Example:
+    python -m utils.dedup filtered_questions.csv dedup/ --threshold 0.8
+"""
+import pandas as pd
+import numpy as np
+
+import argparse
+import os
+import re
+import time
+from os import path
+from typing import Iterable, List, Sequence, Tuple
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+THRESHOLD = 0.8
+# Texts hashed at once: permuted shingle hashes take (shingles in chunk) x NUM_PERM x 8 bytes
+CHUNK_SIZE = 1_000
+PAIRS_CHUNK_SIZE = 100_000
+# All pairs of LSH buckets up to this size are verified, members of larger buckets are linked in a chain
+SMALL_BUCKET_SIZE = 32
+SEED = 0
+
+_MERSENNE_31 = np.uint64((1 << 31) - 1)
+_HASH_BASE = np.uint64(1_000_003)
+_non_word = re.compile(r'[\W_]+')
+
+
+def normalize_text(text: str) -> str:
+    """Lower case words separated by single spaces"""
+    return _non_word.sub(' ', text.lower()).strip()
+
+
+def shingle_hashes(text: str, k: int = SHINGLE_SIZE) -> np.ndarray:
+    """Unique 64-bit polynomial hashes of character k-grams of normalized text
+
+    Texts shorter than k are represented by one shingle.
+    """
+    codes = np.frombuffer(normalize_text(text).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) <= k:
+        k = max(len(codes), 1)
+        if len(codes) == 0:
+            codes = np.zeros(1, dtype=np.uint64)
+    n = len(codes) - k + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        # Unsigned overflow is multiplication modulo 2**64
+        hashes = hashes * _HASH_BASE + codes[j:j + n]
+    return np.unique(_mix64(hashes))
+
+
+def _mix64(h: np.ndarray) -> np.ndarray:
+    """Finalizer of MurmurHash3, every input bit affects high bits of the result"""
+    h = h ^ (h >> np.uint64(33))
+    h = h * np.uint64(0xff51afd7ed558ccd)
+    h = h ^ (h >> np.uint64(33))
+    h = h * np.uint64(0xc4ceb9fe1a85ec53)
+    return h ^ (h >> np.uint64(33))
+
+
+class MinHasher(object):
+    """
+    MinHash signatures with universal hash functions ``(a * x + b) mod (2**31 - 1)``
+    """
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rnd = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        # a, b, x < 2**31 keep a * x + b inside uint64
+        self.a = rnd.randint(1, int(_MERSENNE_31), size=num_perm).astype(np.uint64)
+        self.b = rnd.randint(0, int(_MERSENNE_31), size=num_perm).astype(np.uint64)
+
+    def signatures(self, shingle_sets: Sequence[np.ndarray]) -> np.ndarray:
+        """Signature matrix of shape (number of sets, num_perm), every set must be non-empty"""
+        lengths = np.array([len(s) for s in shingle_sets], dtype=np.int64)
+        if len(lengths) == 0:
+            return np.zeros((0, self.num_perm), dtype=np.uint32)
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        x = np.concatenate(shingle_sets) % _MERSENNE_31
+        permuted = (x[:, None] * self.a[None, :] + self.b[None, :]) % _MERSENNE_31
+        return np.minimum.reduceat(permuted, offsets, axis=0).astype(np.uint32)
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """Number of bands and rows per band, threshold of which ``(1 / bands) ** (1 / rows)`` is the closest"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        err = abs((1. / bands) ** (1. / rows) - threshold)
+        if best is None or err < best[0]:
+            best = (err, bands, rows)
+    return best[1], best[2]
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int, rows: int,
+                    small_bucket_size: int = SMALL_BUCKET_SIZE) -> np.ndarray:
+    """Pairs of rows sharing a bucket in at least one band
+
+    All pairs of buckets with at most ``small_bucket_size`` rows are returned. Members of larger buckets
+    are paired only with the next member in row order, so their number of pairs stays linear.
+    This is an approximation: if a member in the middle of such chain fails verification,
+    its neighbours are not linked through this band, though they may still meet in other bands.
+
+    Returns:
+        Array of shape (number of pairs, 2) with unique pairs, the left row is the smaller one
+    """
+    n = len(signatures)
+    pairs = []
+    for band in range(bands):
+        band_sig = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = band_sig.view(np.dtype((np.void, band_sig.dtype.itemsize * rows))).ravel()
+        # Stable sort keeps rows of a bucket in increasing order
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        new_bucket = np.ones(n, dtype=bool)
+        new_bucket[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        bucket = np.cumsum(new_bucket) - 1
+        bucket_size = np.bincount(bucket)[bucket]
+
+        # Rows of buckets with more than one row
+        shared = bucket_size > 1
+        order, bucket, small = order[shared], bucket[shared], bucket_size[shared] <= small_bucket_size
+        for shift in range(1, min(small_bucket_size, len(order))):
+            linked = bucket[:-shift] == bucket[shift:]
+            if shift > 1:
+                linked &= small[shift:]
+            if not linked.any():
+                break
+            pairs.append(np.stack([order[:-shift][linked], order[shift:][linked]], axis=1))
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def connected_components(n: int, edges: np.ndarray) -> np.ndarray:
+    """Smallest node index of the component of every node"""
+    labels = np.arange(n)
+    if len(edges) == 0:
+        return labels
+    left, right = edges[:, 0], edges[:, 1]
+    while True:
+        prev = labels.copy()
+        link = np.minimum(labels[left], labels[right])
+        np.minimum.at(labels, left, link)
+        np.minimum.at(labels, right, link)
+        # Pointer jumping
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(prev, labels):
+            return labels
+
+
+def find_duplicates(texts: Sequence[str], threshold: float = THRESHOLD, shingle_size: int = SHINGLE_SIZE,
+                    num_perm: int = NUM_PERM, chunk_size: int = CHUNK_SIZE, seed: int = SEED,
+                    silent: bool = True) -> np.ndarray:
+    """Group near-duplicate texts
+
+    Candidates from LSH buckets are verified by the share of equal MinHash values.
+
+    Args:
+        texts: texts to deduplicate
+        threshold: minimal estimated Jaccard similarity of shingle sets of duplicates
+        shingle_size: number of characters in a shingle
+        num_perm: length of MinHash signature
+        chunk_size: number of texts hashed at once
+        seed: seed of hash functions
+
+    Returns:
+        Position of the group representative (its first text) for every text
+    """
+    hasher = MinHasher(num_perm, seed)
+    signatures = np.zeros((len(texts), num_perm), dtype=np.uint32)
+    start = time.perf_counter()
+    for i in range(0, len(texts), chunk_size):
+        chunk = [shingle_hashes(text, shingle_size) for text in texts[i:i + chunk_size]]
+        signatures[i:i + len(chunk)] = hasher.signatures(chunk)
+        if not silent:
+            print(f'{i + len(chunk)}/{len(texts)} signatures computed', end='\r')
+    if not silent:
+        print(f'\nSignatures are computed in {time.perf_counter() - start:.1f} s')
+
+    bands, rows = lsh_params(threshold, num_perm)
+    pairs = candidate_pairs(signatures[:, :bands * rows], bands, rows)
+    similar = np.zeros(len(pairs), dtype=bool)
+    for i in range(0, len(pairs), PAIRS_CHUNK_SIZE):
+        left, right = pairs[i:i + PAIRS_CHUNK_SIZE, 0], pairs[i:i + PAIRS_CHUNK_SIZE, 1]
+        similar[i:i + PAIRS_CHUNK_SIZE] = np.mean(signatures[left] == signatures[right], axis=1) >= threshold
+    if not silent:
+        print(f'{len(pairs)} LSH candidates ({bands} bands x {rows} rows), {similar.sum()} verified')
+    return connected_components(len(texts), pairs[similar])
+
+
+def canonical_ids(ids: Sequence[int], representatives: np.ndarray) -> np.ndarray:
+    """Smallest question id of every group"""
+    ids = np.asarray(ids)
+    smallest = np.full(len(ids), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(smallest, representatives, ids)
+    return smallest[representatives]
+
+
+def dedup_questions(questions: pd.DataFrame, threshold: float = THRESHOLD, shingle_size: int = SHINGLE_SIZE,
+                    num_perm: int = NUM_PERM, silent: bool = True) -> pd.DataFrame:
+    """Mapping of question ids to canonical ids
+
+    Args:
+        questions: DataFrame with 'id' and 'text' columns
+
+    Returns:
+        DataFrame with 'id' and 'canonical_id' columns
+    """
+    representatives = find_duplicates(questions['text'].tolist(), threshold, shingle_size, num_perm, silent=silent)
+    return pd.DataFrame({
+        'id': questions['id'].to_numpy(),
+        'canonical_id': canonical_ids(questions['id'].to_numpy(), representatives)
+    })
+
+
+def expand_to_duplicates(canonical: Iterable[int], mapping: pd.DataFrame) -> List[int]:
+    """All question ids of groups with given canonical ids"""
+    return mapping.loc[mapping['canonical_id'].isin(set(canonical)), 'id'].tolist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collapse near-duplicate questions')
+    parser.add_argument('questions', help="CSV file (';' separated) with 'id' and 'text' columns")
+    parser.add_argument('out_dir', help='Directory for canonical_ids.csv and canonical_questions.csv')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Jaccard similarity of duplicates')
+    parser.add_argument('--shingle-size', type=int, default=SHINGLE_SIZE, help='Characters in a shingle')
+    parser.add_argument('--num-perm', type=int, default=NUM_PERM, help='Length of MinHash signature')
+    args = parser.parse_args()
+
+    questions_df = pd.read_csv(args.questions, sep=';')
+    mapping_df = dedup_questions(questions_df, args.threshold, args.shingle_size, args.num_perm, silent=False)
+    is_canonical = (mapping_df['id'] == mapping_df['canonical_id']).to_numpy()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    mapping_df.to_csv(path.join(args.out_dir, 'canonical_ids.csv'), sep=';', index=False)
+    questions_df[is_canonical].to_csv(path.join(args.out_dir, 'canonical_questions.csv'), sep=';', index=False)
+    print(f'{len(questions_df)} questions, {is_canonical.sum()} canonical '
+          f'({1 - is_canonical.mean():.2%} are duplicates)')
@@ -0,0 +1,265 @@
+"""
+Sentence embeddings of questions on CPU.
+
+Replacement of the embedding part of the candidates selection notebook.
+Questions are tokenized once by the fast tokenizer, sorted by length and grouped into batches
+by number of tokens (including padding) instead of number of questions.
+Embeddings are mean-pooled in the same way as in the notebook and appended to ``EmbeddingStore``,
+questions which are already in the store are skipped, so the process can be restarted at any moment.
+
+Example:
+    python -m utils.embedding questions.csv embeddings_store/ --threads 16 --quantize
+"""
+import pandas as pd
+import numpy as np
+import torch
+from torch import nn
+from transformers import AutoModel, AutoTokenizer
+
+import argparse
+import os
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from utils.embedding_store import EmbeddingStore
+from utils.token_cache import TokenCache
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+MODEL_NAME = 'DeepPavlov/rubert-base-cased-sentence'
+MAX_TOKENS = 8192
+MAX_BATCH_SIZE = 256
+MAX_LENGTH = 512
+FLUSH_EVERY = 16
+
+
+def token_budget_batches(lengths: Sequence[int],
+                         max_tokens: int = MAX_TOKENS,
+                         max_batch_size: int = MAX_BATCH_SIZE) -> List[np.ndarray]:
+    """Group sequences into batches with bounded number of tokens after padding
+
+    Sequences are sorted by length, so padding inside a batch is minimal.
+
+    Args:
+        lengths: lengths of sequences
+        max_tokens: upper bound of ``batch_size * max_length_in_batch``
+        max_batch_size: upper bound of batch size
+
+    Returns:
+        List of arrays with sequence indexes
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # Lengths are sorted, so the last sequence is the longest one
+        too_many_tokens = (end - start) * lengths[order[end - 1]] > max_tokens
+        if end - start > max_batch_size or (too_many_tokens and end - start > 1):
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def pad_batch(token_ids: Sequence[Sequence[int]], pad_index: int) -> Tuple[torch.LongTensor, torch.Tensor]:
+    """Pad token id lists into tensor
+
+    Returns:
+        Tuple of tokens tensor and float mask
+    """
+    lengths = torch.tensor([len(ids) for ids in token_ids], dtype=torch.long)
+    tokens = torch.full((len(token_ids), int(lengths.max())), pad_index, dtype=torch.long)
+    for i, ids in enumerate(token_ids):
+        tokens[i, :len(ids)] = torch.as_tensor(ids, dtype=torch.long)
+    mask = (torch.arange(tokens.size(1))[None, :] < lengths[:, None]).float()
+    return tokens, mask
+
+
+def set_torch_threads(n_threads: Optional[int]) -> None:
+    if n_threads is None:
+        return
+    torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Inter-op threads can be set only before any parallel work
+        pass
+
+
+class SentenceEncoder(object):
+    """
+    Transformer encoder with mean-pooling of token embeddings.
+    The same maner as in original Sentence-BERT work.
+    """
+    def __init__(self,
+                 model_name: str = MODEL_NAME,
+                 n_threads: Optional[int] = None,
+                 quantize: bool = False,
+                 max_length: int = MAX_LENGTH):
+        """
+        Args:
+            model_name: HuggingFace model name
+            n_threads: number of torch intra-op threads, torch default if None
+            quantize: apply dynamic int8 quantization to linear layers
+            max_length: questions are truncated to this number of tokens
+        """
+        set_torch_threads(n_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        self.pad_index = self.tokenizer.convert_tokens_to_ids(self.tokenizer.pad_token)
+        self.cls_index = self.tokenizer.convert_tokens_to_ids(self.tokenizer.cls_token)
+        self.max_length = max_length
+
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    @property
+    def dim(self) -> int:
+        return self.model.config.hidden_size
+
+    def tokenize(self, texts: Sequence[str]) -> List[List[int]]:
+        """Tokenize all texts by one call of fast tokenizer
+
+        Only [CLS] token is added like in the notebook (HuggingFaceField with init_token),
+        so embeddings are consistent with previously computed ones.
+        """
+        encoded = self.tokenizer(
+            list(texts),
+            add_special_tokens=False,
+            truncation=True,
+            max_length=self.max_length - 1,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return [[self.cls_index] + ids for ids in encoded['input_ids']]
+
+    def tokens_from_cache(self, token_cache: TokenCache, ids: Sequence[int]) -> List[List[int]]:
+        """The same as ``tokenize``, but token ids are taken from pre-built cache"""
+        if token_cache.tokenizer_name != self.tokenizer.name_or_path:
+            raise ValueError(f'Token cache is built by another tokenizer ({token_cache.tokenizer_name})')
+        return [[self.cls_index] + tokens[:self.max_length - 1].tolist() for tokens in token_cache.get_many(ids)]
+
+    @torch.no_grad()
+    def encode_tokens(self, token_ids: Sequence[Sequence[int]]) -> np.ndarray:
+        """Embed one batch of tokenized questions"""
+        tokens, mask = pad_batch(token_ids, self.pad_index)
+        output = self.model(
+            tokens,
+            attention_mask=mask,
+            output_hidden_states=False,
+            return_dict=True
+        )
+        token_embeddings = output['last_hidden_state']
+        sent_embeddings = torch.sum(token_embeddings * mask.unsqueeze(-1), dim=1)
+        sent_embeddings = sent_embeddings / torch.sum(mask, dim=1, keepdim=True)
+        return sent_embeddings.numpy()
+
+    def iter_encode(self, token_ids: Sequence[Sequence[int]],
+                    max_tokens: int = MAX_TOKENS,
+                    max_batch_size: int = MAX_BATCH_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Embed tokenized questions by token budget batches
+
+        Yields:
+            Tuple of indexes of questions in ``token_ids`` and their embeddings
+        """
+        lengths = [len(ids) for ids in token_ids]
+        for batch in token_budget_batches(lengths, max_tokens, max_batch_size):
+            yield batch, self.encode_tokens([token_ids[i] for i in batch])
+
+    def encode(self, texts: Sequence[str], max_tokens: int = MAX_TOKENS) -> np.ndarray:
+        """Embed questions, order of embeddings corresponds to order of texts"""
+        token_ids = self.tokenize(texts)
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+        for batch, embeddings in self.iter_encode(token_ids, max_tokens):
+            result[batch] = embeddings
+        return result
+
+
+def embed_questions(encoder: SentenceEncoder,
+                    ids: Sequence[int], texts: Sequence[str],
+                    store: EmbeddingStore,
+                    max_tokens: int = MAX_TOKENS,
+                    flush_every: int = FLUSH_EVERY,
+                    token_cache: Optional[TokenCache] = None,
+                    silent: bool = False) -> int:
+    """Embed questions, which are not in the store yet, and append them to the store
+
+    Args:
+        encoder: sentence encoder
+        ids: question ids
+        texts: question texts
+        store: embeddings store
+        max_tokens: tokens budget of one batch
+        flush_every: embeddings are written to the store after this number of batches
+        token_cache: if given, questions aren't tokenized, token ids are taken from the cache
+        silent: don't show progress bar
+
+    Returns:
+        Number of embedded questions
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    todo = np.nonzero(~store.contains(ids))[0]
+    if len(todo) == 0:
+        return 0
+    if token_cache is None:
+        token_ids = encoder.tokenize([texts[i] for i in todo])
+    else:
+        token_ids = encoder.tokens_from_cache(token_cache, ids[todo])
+
+    n_done = 0
+    buf_idx, buf_emb = [], []
+    start = time.perf_counter()
+    it = encoder.iter_encode(token_ids, max_tokens)
+    if not silent:
+        it = tqdm(it, total=len(token_budget_batches([len(t) for t in token_ids], max_tokens)), unit='batch')
+    for batch, embeddings in it:
+        buf_idx.append(batch)
+        buf_emb.append(embeddings)
+        if len(buf_idx) >= flush_every:
+            n_done += store.append(ids[todo[np.concatenate(buf_idx)]], np.concatenate(buf_emb))
+            buf_idx, buf_emb = [], []
+    if len(buf_idx) > 0:
+        n_done += store.append(ids[todo[np.concatenate(buf_idx)]], np.concatenate(buf_emb))
+
+    if not silent:
+        elapsed = time.perf_counter() - start
+        print(f'{n_done} questions are embedded in {elapsed:.1f} s ({n_done / max(elapsed, 1e-9):.1f} questions/s)')
+    return n_done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute sentence embeddings of questions on CPU')
+    parser.add_argument('questions', help="CSV file (';' separated) with 'id' and 'text' columns")
+    parser.add_argument('store', help='Embedding store directory, created if not exists')
+    parser.add_argument('--model', default=MODEL_NAME, help='HuggingFace model name')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='Number of torch threads')
+    parser.add_argument('--max-tokens', type=int, default=MAX_TOKENS, help='Tokens budget of one batch')
+    parser.add_argument('--quantize', action='store_true', help='Use dynamic int8 quantization')
+    parser.add_argument('--dtype', choices=('float32', 'float16'), default='float32', help='Store dtype')
+    parser.add_argument('--token-cache', help='Root directory of token cache')
+    args = parser.parse_args()
+
+    questions = pd.read_csv(args.questions, sep=';', usecols=['id', 'text'])
+    sentence_encoder = SentenceEncoder(args.model, n_threads=args.threads, quantize=args.quantize)
+    emb_store = EmbeddingStore.open_or_create(args.store, sentence_encoder.dim, dtype=args.dtype)
+    cache = None
+    if args.token_cache is not None:
+        cache = TokenCache.build(
+            args.token_cache, sentence_encoder.tokenizer,
+            questions['id'].to_numpy(), questions['text'].tolist()
+        )
+    embed_questions(
+        sentence_encoder,
+        questions['id'].to_numpy(), questions['text'].tolist(),
+        emb_store,
+        max_tokens=args.max_tokens,
+        token_cache=cache
+    )
@@ -0,0 +1,269 @@
+"""
+Data-parallel sentence embeddings over several CPU processes.
+
+One torch process can't load all cores of a big machine, so questions are split into shards
+of contiguous id ranges, and shards are processed by a pool of worker processes.
+Every worker has a fixed number of torch threads (and its own CPU cores, if affinity is supported)
+and writes embeddings directly into a shared memory-mapped matrix.
+The coordinator records finished shards in a manifest, so only unfinished shards are recomputed
+after restart. When all shards are done, embeddings are moved into ``EmbeddingStore``.
+
+Example:
+    python -m utils.embedding_parallel questions.csv embeddings_store/ --workers 8 --threads-per-worker 8
+"""
+import pandas as pd
+import numpy as np
+from transformers import AutoConfig
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path
+from typing import List, Optional, Sequence
+
+from utils.atomic_write import atomic_write_json
+from utils.embedding import SentenceEncoder, MODEL_NAME, MAX_TOKENS
+from utils.embedding_store import EmbeddingStore
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+SHARD_SIZE = 4096
+_MANIFEST_NAME = 'shards.json'
+_MATRIX_NAME = 'embeddings.bin'
+_IDS_NAME = 'ids.npy'
+
+# Worker process state
+_encoder = None
+_matrix = None
+
+
+def _init_worker(model_name: str, n_threads: int, quantize: bool,
+                 matrix_path: str, shape: tuple, counter, pin_cpus: bool) -> None:
+    global _encoder, _matrix
+    worker_i = None
+    with counter.get_lock():
+        worker_i = counter.value
+        counter.value += 1
+
+    if pin_cpus and hasattr(os, 'sched_setaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+        cpus = available[worker_i * n_threads:(worker_i + 1) * n_threads]
+        if len(cpus) > 0:
+            os.sched_setaffinity(0, cpus)
+
+    _encoder = SentenceEncoder(model_name, n_threads=n_threads, quantize=quantize)
+    _matrix = np.memmap(matrix_path, dtype=np.float32, mode='r+', shape=shape)
+
+
+def _embed_shard(shard_i: int, start: int, texts: List[str], max_tokens: int) -> int:
+    token_ids = _encoder.tokenize(texts)
+    for batch, embeddings in _encoder.iter_encode(token_ids, max_tokens):
+        _matrix[start + batch] = embeddings
+    _matrix.flush()
+    return shard_i
+
+
+class ParallelEmbedder(object):
+    """
+    Coordinator of data-parallel embedding.
+    State is kept in ``work_dir``: ids of questions, shared output matrix and manifest of finished shards.
+    """
+    def __init__(self, work_dir: str, model_name: str = MODEL_NAME,
+                 n_workers: int = 1, threads_per_worker: Optional[int] = None,
+                 quantize: bool = False, pin_cpus: bool = True,
+                 shard_size: int = SHARD_SIZE, max_tokens: int = MAX_TOKENS):
+        """
+        Args:
+            work_dir: directory for intermediate state
+            model_name: HuggingFace model name
+            n_workers: number of worker processes
+            threads_per_worker: torch threads of one worker, all cores are divided equally by default
+            quantize: use dynamic int8 quantization in workers
+            pin_cpus: bind every worker to its own CPU cores (Linux only)
+            shard_size: number of questions in one shard
+            max_tokens: tokens budget of one batch
+        """
+        self.work_dir = work_dir
+        self.model_name = model_name
+        self.n_workers = n_workers
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+        self.threads_per_worker = threads_per_worker
+        self.quantize = quantize
+        self.pin_cpus = pin_cpus
+        self.shard_size = shard_size
+        self.max_tokens = max_tokens
+
+    def _manifest_path(self) -> str:
+        return path.join(self.work_dir, _MANIFEST_NAME)
+
+    def load_manifest(self) -> Optional[dict]:
+        if not path.isfile(self._manifest_path()):
+            return None
+        with open(self._manifest_path()) as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        atomic_write_json(self._manifest_path(), manifest)
+
+    def _prepare(self, ids: np.ndarray, dim: int) -> dict:
+        manifest = self.load_manifest()
+        if manifest is not None:
+            saved_ids = np.load(path.join(self.work_dir, _IDS_NAME))
+            # Shard indices refer to row ranges of shard_size, rows of another model (or of the same model
+            # with another quantization) mustn't be mixed
+            if (not np.array_equal(saved_ids, ids) or manifest['dim'] != dim
+                    or manifest['shard_size'] != self.shard_size or manifest['model_name'] != self.model_name
+                    or manifest.get('quantize') != self.quantize):
+                raise ValueError(f'{self.work_dir} contains state of another embedding job')
+            return manifest
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        np.save(path.join(self.work_dir, _IDS_NAME), ids)
+        matrix = np.memmap(path.join(self.work_dir, _MATRIX_NAME), dtype=np.float32, mode='w+',
+                           shape=(max(len(ids), 1), dim))
+        del matrix
+        manifest = {
+            'model_name': self.model_name,
+            'quantize': self.quantize,
+            'dim': dim,
+            'n_questions': int(len(ids)),
+            'shard_size': self.shard_size,
+            'done_shards': []
+        }
+        self._save_manifest(manifest)
+        return manifest
+
+    def run(self, ids: Sequence[int], texts: Sequence[str], dim: int, silent: bool = False) -> np.ndarray:
+        """Embed all questions using worker pool
+
+        Args:
+            ids: question ids, questions are sorted by id and split into shards
+            texts: question texts
+            dim: embedding size of the model
+            silent: don't show progress bar
+
+        Returns:
+            Memory map of embeddings matrix in order of sorted ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        manifest = self._prepare(ids, dim)
+        shape = (max(len(ids), 1), dim)
+
+        done = set(manifest['done_shards'])
+        n_shards = (len(ids) + self.shard_size - 1) // self.shard_size
+        todo = [i for i in range(n_shards) if i not in done]
+
+        if len(todo) > 0:
+            ctx = mp.get_context('spawn')
+            counter = ctx.Value('i', 0)
+            with ProcessPoolExecutor(
+                    max_workers=min(self.n_workers, len(todo)),
+                    mp_context=ctx,
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.threads_per_worker, self.quantize,
+                              path.join(self.work_dir, _MATRIX_NAME), shape, counter, self.pin_cpus)
+            ) as executor:
+                futures = []
+                for shard_i in todo:
+                    start = shard_i * self.shard_size
+                    end = min(start + self.shard_size, len(ids))
+                    shard_texts = [texts[i] for i in order[start:end]]
+                    futures.append(executor.submit(_embed_shard, shard_i, start, shard_texts, self.max_tokens))
+
+                results = as_completed(futures)
+                if not silent:
+                    results = tqdm(results, total=n_shards, initial=len(done), unit='shard')
+                for future in results:
+                    manifest['done_shards'].append(future.result())
+                    self._save_manifest(manifest)
+
+        return np.memmap(path.join(self.work_dir, _MATRIX_NAME), dtype=np.float32, mode='r', shape=shape)[:len(ids)]
+
+    def finalize(self, store: EmbeddingStore, remove_work_dir: bool = True) -> int:
+        """Move embeddings of finished job into the store
+
+        Returns:
+            Number of added embeddings
+        """
+        manifest = self.load_manifest()
+        if manifest is None:
+            return 0
+        n_shards = (manifest['n_questions'] + manifest['shard_size'] - 1) // manifest['shard_size']
+        if len(set(manifest['done_shards'])) < n_shards:
+            raise RuntimeError('Embedding job is not finished yet')
+
+        ids = np.load(path.join(self.work_dir, _IDS_NAME))
+        matrix = np.memmap(path.join(self.work_dir, _MATRIX_NAME), dtype=np.float32, mode='r',
+                           shape=(max(len(ids), 1), manifest['dim']))
+        n_added = 0
+        for start in range(0, len(ids), self.shard_size):
+            n_added += store.append(ids[start:start + self.shard_size], matrix[start:start + self.shard_size])
+        del matrix
+        if remove_work_dir:
+            shutil.rmtree(self.work_dir)
+        return n_added
+
+
+def embed_questions_parallel(ids: Sequence[int], texts: Sequence[str], store_path: str,
+                             work_dir: Optional[str] = None, model_name: str = MODEL_NAME,
+                             n_workers: int = 1, threads_per_worker: Optional[int] = None,
+                             quantize: bool = False, dtype: str = 'float32',
+                             shard_size: int = SHARD_SIZE, silent: bool = False) -> int:
+    """Embed questions, which are not in the store yet, by several processes
+
+    Returns:
+        Number of added embeddings
+    """
+    if work_dir is None:
+        work_dir = store_path.rstrip('/\\') + '.work'
+    ids = np.asarray(ids, dtype=np.int64)
+
+    embedder = ParallelEmbedder(work_dir, model_name, n_workers, threads_per_worker, quantize,
+                                shard_size=shard_size)
+    dim = AutoConfig.from_pretrained(model_name).hidden_size
+
+    store = EmbeddingStore.open_or_create(store_path, dim, dtype=dtype)
+    if embedder.load_manifest() is None:
+        # New job contains only questions, which are absent in the store
+        todo = np.nonzero(~store.contains(ids))[0]
+    else:
+        # Continue interrupted job with the same set of questions
+        saved = np.load(path.join(work_dir, _IDS_NAME))
+        todo = np.nonzero(np.isin(ids, saved))[0]
+    if len(todo) == 0:
+        return 0
+
+    embedder.run(ids[todo], [texts[i] for i in todo], dim, silent=silent)
+    return embedder.finalize(store)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute sentence embeddings of questions by several processes')
+    parser.add_argument('questions', help="CSV file (';' separated) with 'id' and 'text' columns")
+    parser.add_argument('store', help='Embedding store directory, created if not exists')
+    parser.add_argument('--work-dir', help='Directory for intermediate state, <store>.work by default')
+    parser.add_argument('--model', default=MODEL_NAME, help='HuggingFace model name')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--threads-per-worker', type=int, help='Torch threads of one worker')
+    parser.add_argument('--quantize', action='store_true', help='Use dynamic int8 quantization')
+    parser.add_argument('--dtype', choices=('float32', 'float16'), default='float32', help='Store dtype')
+    args = parser.parse_args()
+
+    questions = pd.read_csv(args.questions, sep=';', usecols=['id', 'text'])
+    n = embed_questions_parallel(
+        questions['id'].to_numpy(), questions['text'].tolist(), args.store,
+        work_dir=args.work_dir, model_name=args.model,
+        n_workers=args.workers, threads_per_worker=args.threads_per_worker,
+        quantize=args.quantize, dtype=args.dtype
+    )
+    print(f'{n} questions are embedded')
@@ -0,0 +1,204 @@
+"""
+On-disk storage of question embeddings.
+
+Store is a directory with three files:
+    * ``embeddings.bin`` - raw row-major matrix (float32 or float16), opened as memory map
+    * ``ids.npy`` - question ids in rows order
+    * ``meta.json`` - embedding size and dtype
+
+Unlike pickled ``{id: embedding}`` dict, the store is opened instantly, doesn't copy embeddings
+into memory and supports appending new embeddings.
+"""
+import numpy as np
+
+import argparse
+import json
+import os
+from os import path
+from typing import Iterable, Optional, Tuple, Union
+
+from utils.atomic_write import atomic_write_json
+from utils.similarity import load_pickled_embeddings
+
+_DATA_NAME = 'embeddings.bin'
+_IDS_NAME = 'ids.npy'
+_META_NAME = 'meta.json'
+_SUPPORTED_DTYPES = ('float32', 'float16')
+
+
+class EmbeddingStore(object):
+    """
+    Memory mapped embeddings matrix with id -> row index
+    """
+    def __init__(self, root: str):
+        """Open existing store
+
+        Args:
+            root: store directory
+        """
+        self.root = root
+        with open(path.join(root, _META_NAME)) as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.dtype = np.dtype(meta['dtype'])
+        # ids file is replaced only after embeddings are written, so it defines number of valid rows
+        self.ids = np.load(path.join(root, _IDS_NAME))
+        self._count = len(self.ids)
+        self._embeddings = None
+        self._sorted_ids = None
+        self._sorted_rows = None
+
+    @classmethod
+    def create(cls, root: str, dim: int, dtype: Union[str, np.dtype] = 'float32') -> 'EmbeddingStore':
+        """Create new empty store"""
+        dtype = np.dtype(dtype)
+        if dtype.name not in _SUPPORTED_DTYPES:
+            raise ValueError(f'Unsupported dtype {dtype.name}, use one of {_SUPPORTED_DTYPES}')
+        os.makedirs(root, exist_ok=True)
+        if path.isfile(path.join(root, _META_NAME)):
+            raise FileExistsError(f'Embedding store already exists in {root}')
+
+        open(path.join(root, _DATA_NAME), 'wb').close()
+        np.save(path.join(root, _IDS_NAME), np.empty(0, dtype=np.int64))
+        _write_meta(root, {'dim': int(dim), 'dtype': dtype.name})
+        return cls(root)
+
+    @classmethod
+    def open_or_create(cls, root: str, dim: int, dtype: Union[str, np.dtype] = 'float32') -> 'EmbeddingStore':
+        if path.isfile(path.join(root, _META_NAME)):
+            store = cls(root)
+            if store.dim != dim:
+                raise ValueError(f'Embedding store {root} contains embeddings of size {store.dim}, not {dim}')
+            return store
+        return cls.create(root, dim, dtype)
+
+    @classmethod
+    def from_pickle(cls, pickle_path: str, root: str, dtype: Union[str, np.dtype] = 'float32') -> 'EmbeddingStore':
+        """Convert ``{id: embedding}`` dict pickled by the candidates selection notebook"""
+        ids, embeddings = load_pickled_embeddings(pickle_path)
+        store = cls.create(root, embeddings.shape[1], dtype)
+        store.append(ids, embeddings)
+        return store
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, q_id: int) -> bool:
+        return bool(self.contains([q_id])[0])
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Read-only memory map of embeddings matrix, slicing doesn't copy data"""
+        if self._embeddings is None:
+            if self._count == 0:
+                self._embeddings = np.empty((0, self.dim), dtype=self.dtype)
+            else:
+                self._embeddings = np.memmap(
+                    path.join(self.root, _DATA_NAME),
+                    dtype=self.dtype, mode='r',
+                    shape=(self._count, self.dim)
+                )
+        return self._embeddings
+
+    def _build_index(self) -> None:
+        if self._sorted_ids is None:
+            self._sorted_rows = np.argsort(self.ids, kind='stable')
+            self._sorted_ids = self.ids[self._sorted_rows]
+
+    def contains(self, ids: Iterable[int]) -> np.ndarray:
+        """Boolean mask of ids presented in the store"""
+        self._build_index()
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.zeros(ids.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, ids), len(self._sorted_ids) - 1)
+        return self._sorted_ids[pos] == ids
+
+    def rows(self, ids: Iterable[int]) -> np.ndarray:
+        """Rows of given question ids
+
+        Raises:
+            KeyError: if some id is absent in the store
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        mask = self.contains(ids)
+        if not mask.all():
+            raise KeyError(f'Unknown question ids: {ids[~mask][:10].tolist()}')
+        return self._sorted_rows[np.searchsorted(self._sorted_ids, ids)]
+
+    def get(self, ids: Iterable[int], dtype: Optional[Union[str, np.dtype]] = None) -> np.ndarray:
+        """Copy embeddings of given question ids into memory"""
+        result = np.asarray(self.embeddings[self.rows(ids)])
+        if dtype is not None:
+            result = result.astype(dtype, copy=False)
+        return result
+
+    def append(self, ids: Iterable[int], embeddings: np.ndarray, skip_existing: bool = True) -> int:
+        """Add new embeddings to the store
+
+        Args:
+            ids: question ids
+            embeddings: corresponding embeddings
+            skip_existing: silently skip ids, which are already in the store. If False, ValueError is raised
+
+        Returns:
+            Number of added embeddings
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim or len(embeddings) != len(ids):
+            raise ValueError(f'Expected embeddings matrix of shape ({len(ids)}, {self.dim})')
+
+        _, first = np.unique(ids, return_index=True)
+        if len(first) < len(ids):
+            raise ValueError('ids must be unique')
+        exists = self.contains(ids)
+        if exists.any():
+            if not skip_existing:
+                raise ValueError(f'Ids are already in the store: {ids[exists][:10].tolist()}')
+            ids = ids[~exists]
+            embeddings = embeddings[~exists]
+        if len(ids) == 0:
+            return 0
+
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(path.join(self.root, _DATA_NAME), 'r+b') as f:
+            # Drop tail of interrupted append
+            f.truncate(self._count * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+
+        new_ids = np.concatenate([self.ids, ids])
+        tmp_ids_path = path.join(self.root, 'ids.tmp.npy')
+        np.save(tmp_ids_path, new_ids)
+        os.replace(tmp_ids_path, path.join(self.root, _IDS_NAME))
+
+        self.ids = new_ids
+        self._count = len(new_ids)
+        self._embeddings = None
+        self._sorted_ids = None
+        self._sorted_rows = None
+        return len(ids)
+
+
+def load_embeddings(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Load question ids and embeddings either from store directory or from pickled dict"""
+    if path.isdir(file_path):
+        store = EmbeddingStore(file_path)
+        return store.ids, store.embeddings
+    return load_pickled_embeddings(file_path)
+
+
+def _write_meta(root: str, meta: dict) -> None:
+    atomic_write_json(path.join(root, _META_NAME), meta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert pickled embeddings dict to embedding store')
+    parser.add_argument('pickle_path', help='Path to embeddings.pkl')
+    parser.add_argument('store_path', help='Directory of the new store')
+    parser.add_argument('--dtype', choices=_SUPPORTED_DTYPES, default='float32')
+    args = parser.parse_args()
+
+    converted = EmbeddingStore.from_pickle(args.pickle_path, args.store_path, dtype=args.dtype)
+    print(f'{len(converted)} embeddings of size {converted.dim} are saved to {args.store_path}')
@@ -0,0 +1,97 @@
+"""
+Memoized morphological analysis by pymorphy2.
+
+Word frequencies follow Zipf's law, so a small LRU cache of ``token -> (lemma, POS, grammemes)``
+removes almost all ``MorphAnalyzer.parse`` calls on a corpus.
+Grammeme sets are interned: every distinct tag is represented by one shared frozenset.
+"""
+import pandas as pd
+import pymorphy2
+
+from functools import lru_cache
+from string import punctuation
+from typing import Callable, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from utils.nltk_resources import word_tokenize
+
+CACHE_SIZE = 2**18
+PUNCT_SET = frozenset(punctuation)
+
+
+class Parse(NamedTuple):
+    normal_form: str
+    pos: Optional[str]
+    tags: FrozenSet[str]
+
+
+def russian_tokenize(text: str) -> List[str]:
+    return word_tokenize(text, language='russian')
+
+
+def is_word(token: str) -> bool:
+    """Token doesn't contain punctuation"""
+    return len(set(token) & PUNCT_SET) == 0
+
+
+class MorphCache(object):
+    """
+    Most probable pymorphy2 parse of a token with LRU memoization
+    """
+    def __init__(self, morph: Optional[pymorphy2.MorphAnalyzer] = None,
+                 cache_size: int = CACHE_SIZE,
+                 tokenize: Callable[[str], List[str]] = russian_tokenize):
+        """
+        Args:
+            morph: pymorphy2 analyzer, new one is created if None
+            cache_size: maximum number of memoized tokens
+            tokenize: text tokenizer
+        """
+        self.morph = morph if morph is not None else pymorphy2.MorphAnalyzer()
+        self.tokenize = tokenize
+        self._tag_sets = {}
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def _parse(self, token: str) -> Parse:
+        p = self.morph.parse(token)[0]
+        tag = str(p.tag)
+        tags = self._tag_sets.get(tag)
+        if tags is None:
+            tags = frozenset(p.tag.grammemes)
+            self._tag_sets[tag] = tags
+        return Parse(p.normal_form, p.tag.POS, tags)
+
+    def parse_many(self, tokens: Iterable[str]) -> List[Parse]:
+        return [self.parse(token) for token in tokens]
+
+    def lemmas(self, tokens: Iterable[str], skip_punct: bool = True) -> List[str]:
+        """Normal forms of tokens (punctuation is dropped by default)"""
+        parsed = self.parse_many(tokens)
+        return [p.normal_form for p in parsed if not (skip_punct and 'PNCT' in p.tags)]
+
+    def bag_of_tags(self, tokens: Iterable[str]) -> Set[str]:
+        """Union of grammemes of all tokens"""
+        result = set()
+        for p in self.parse_many(tokens):
+            result |= p.tags
+        return result
+
+    def analyze_column(self, texts: Iterable[str]) -> Tuple[pd.Series, pd.Series]:
+        """Tokenize and parse every text of a column in one pass
+
+        Every distinct token is parsed once, regardless of the cache size.
+
+        Returns:
+            Series of token lists and Series of parse lists
+        """
+        texts = pd.Series(texts)
+        tokens = texts.map(self.tokenize)
+        unique = {}
+        for text_tokens in tokens:
+            for token in text_tokens:
+                if token not in unique:
+                    unique[token] = self.parse(token)
+        parsed = tokens.map(lambda text_tokens: [unique[token] for token in text_tokens])
+        return tokens, parsed
+
+    def cache_info(self):
+        return self.parse.cache_info()
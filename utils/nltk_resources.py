@@ -0,0 +1,36 @@
+"""
+NLTK data, which is downloaded on the first use instead of module import.
+"""
+from nltk import data as nltk_data
+from nltk import download as nltk_download
+from nltk import word_tokenize as nltk_word_tokenize
+
+from typing import List
+
+# NLTK 3.8.2+ reads Punkt parameters from 'punkt_tab' instead of pickled 'punkt' models
+try:
+    from nltk.tokenize import PunktTokenizer
+    PUNKT_RESOURCE = 'punkt_tab'
+except ImportError:
+    PUNKT_RESOURCE = 'punkt'
+
+_punkt_ready = False
+
+
+def ensure_punkt() -> None:
+    """Download Punkt sentence tokenizer models, if they aren't installed yet"""
+    global _punkt_ready
+    if _punkt_ready:
+        return
+    try:
+        nltk_data.find(f'tokenizers/{PUNKT_RESOURCE}')
+    except LookupError:
+        nltk_download(PUNKT_RESOURCE, quiet=True)
+    _punkt_ready = True
+
+
+def word_tokenize(text: str, language: str = 'english', preserve_line: bool = False) -> List[str]:
+    """``nltk.word_tokenize``, which downloads Punkt models on the first call"""
+    if not preserve_line:
+        ensure_punkt()
+    return nltk_word_tokenize(text, language=language, preserve_line=preserve_line)
@@ -0,0 +1,323 @@
+"""
+All-pairs cosine similarity search over question embeddings on CPU.
+
+Replacement of the blocked similarity loop from the candidates selection notebook.
+Embeddings are normalized once, similarity is computed by row blocks in a thread pool
+(numpy matmul releases GIL) and close pairs are extracted with vectorized numpy operations.
+Every finished row block is saved as a separate parquet part, and the list of finished blocks
+is kept in a manifest file, so interrupted search can be resumed.
+"""
+import pandas as pd
+import numpy as np
+
+import json
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from os import path
+from typing import Iterator, Optional, Tuple
+
+from utils.atomic_write import atomic_write_json
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+try:
+    from threadpoolctl import threadpool_limits
+except ModuleNotFoundError:
+    threadpool_limits = None
+
+PairChunk = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+SIM_BATCH_SIZE = 1024
+SIM_COL_BATCH_SIZE = 16384
+SIMILARITY_THRESHOLD = 0.85
+MANIFEST_NAME = 'manifest.json'
+
+
+class ManifestMismatchError(ValueError):
+    pass
+
+
+def normalize_embeddings(embeddings: np.ndarray, dtype=np.float32, eps: float = 1e-8) -> np.ndarray:
+    """L2-normalize embeddings row-wise
+
+    Args:
+        embeddings: matrix with embeddings in rows
+        dtype: resulting data type
+        eps: lower bound of norm to avoid division by zero
+
+    Returns:
+        New matrix with normalized rows
+    """
+    result = np.array(embeddings, dtype=dtype, copy=True)
+    norms = np.linalg.norm(result, axis=1, keepdims=True)
+    np.maximum(norms, eps, out=norms)
+    result /= norms
+    return result
+
+
+def merge_topk(best_val: np.ndarray, best_idx: np.ndarray,
+               val: np.ndarray, idx: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge two sets of top-k candidates row-wise (rows of result are not sorted)"""
+    val = np.concatenate([best_val, val], axis=1)
+    idx = np.concatenate([best_idx, idx], axis=1)
+    if val.shape[1] > k:
+        part = np.argpartition(-val, k - 1, axis=1)[:, :k]
+        val = np.take_along_axis(val, part, axis=1)
+        idx = np.take_along_axis(idx, part, axis=1)
+    return val, idx
+
+
+class SimilaritySearch(object):
+    """
+    Blocked cosine similarity search.
+    Similarity matrix is never materialized, only (block_size x col_block_size) tiles of it.
+    """
+    def __init__(self,
+                 embeddings: np.ndarray,
+                 ids: Optional[np.ndarray] = None,
+                 block_size: int = SIM_BATCH_SIZE,
+                 col_block_size: int = SIM_COL_BATCH_SIZE,
+                 normalized: bool = False):
+        """
+        Args:
+            embeddings: matrix with question embeddings in rows
+            ids: question ids corresponding to rows, row numbers are used if not given
+            block_size: number of rows processed by one job
+            col_block_size: number of columns in one similarity tile
+            normalized: pass True, if embeddings are already L2-normalized float32
+        """
+        if normalized:
+            self.embeddings = embeddings
+        else:
+            self.embeddings = normalize_embeddings(embeddings)
+        if ids is None:
+            ids = np.arange(len(embeddings))
+        self.ids = np.asarray(ids)
+        if len(self.ids) != len(self.embeddings):
+            raise ValueError('Number of ids differs from number of embeddings')
+
+        self.block_size = block_size
+        self.col_block_size = col_block_size
+
+    @property
+    def n_blocks(self) -> int:
+        return (len(self.embeddings) + self.block_size - 1) // self.block_size
+
+    def _block_bounds(self, block_i: int) -> Tuple[int, int]:
+        start = block_i * self.block_size
+        return start, min(start + self.block_size, len(self.embeddings))
+
+    def threshold_block(self, block_i: int, threshold: float = SIMILARITY_THRESHOLD) -> PairChunk:
+        """Find pairs with similarity >= threshold, which left question is in a given row block.
+        Only upper triangle of similarity matrix is considered, so every pair is found once.
+        """
+        start, end = self._block_bounds(block_i)
+        rows = self.embeddings[start:end]
+        left, right, sims = [], [], []
+        for col_start in range(start, len(self.embeddings), self.col_block_size):
+            col_end = min(col_start + self.col_block_size, len(self.embeddings))
+            sim = rows @ self.embeddings[col_start:col_end].T
+            if col_start < end:
+                # Tile intersects diagonal, drop pairs with itself and lower triangle
+                row_idx = np.arange(start, end)[:, None]
+                col_idx = np.arange(col_start, col_end)[None, :]
+                sim[col_idx <= row_idx] = -np.inf
+
+            row_shift, col_shift = np.nonzero(sim >= threshold)
+            sims.append(sim[row_shift, col_shift])
+            left.append(row_shift + start)
+            right.append(col_shift + col_start)
+
+        return self._to_chunk(left, right, sims)
+
+    def topk_block(self, block_i: int, k: int, min_similarity: Optional[float] = None) -> PairChunk:
+        """Find k nearest neighbours for every question in a given row block
+
+        Args:
+            block_i: row block number
+            k: number of neighbours
+            min_similarity: neighbours with lower similarity are dropped
+        """
+        start, end = self._block_bounds(block_i)
+        rows = self.embeddings[start:end]
+        best_val = np.empty((end - start, 0), dtype=rows.dtype)
+        best_idx = np.empty((end - start, 0), dtype=np.int64)
+
+        for col_start in range(0, len(self.embeddings), self.col_block_size):
+            col_end = min(col_start + self.col_block_size, len(self.embeddings))
+            sim = rows @ self.embeddings[col_start:col_end].T
+            if col_start < end and start < col_end:
+                # Question isn't a neighbour of itself
+                diag = np.arange(max(start, col_start), min(end, col_end))
+                sim[diag - start, diag - col_start] = -np.inf
+
+            tile_k = min(k, sim.shape[1])
+            part = np.argpartition(-sim, tile_k - 1, axis=1)[:, :tile_k]
+            best_val, best_idx = merge_topk(
+                best_val, best_idx,
+                np.take_along_axis(sim, part, axis=1), part + col_start,
+                k
+            )
+
+        row_idx = np.broadcast_to(np.arange(start, end)[:, None], best_idx.shape)
+        mask = np.isfinite(best_val)
+        if min_similarity is not None:
+            mask &= best_val >= min_similarity
+        return self._to_chunk([row_idx[mask]], [best_idx[mask]], [best_val[mask]])
+
+    def _to_chunk(self, left, right, sims) -> PairChunk:
+        left = np.concatenate(left) if len(left) > 0 else np.empty(0, dtype=np.int64)
+        right = np.concatenate(right) if len(right) > 0 else np.empty(0, dtype=np.int64)
+        sims = np.concatenate(sims) if len(sims) > 0 else np.empty(0, dtype=np.float32)
+        return self.ids[left], self.ids[right], sims.astype(np.float32, copy=False)
+
+    def search(self,
+               out_dir: str,
+               threshold: Optional[float] = SIMILARITY_THRESHOLD,
+               k: Optional[int] = None,
+               n_jobs: Optional[int] = None,
+               silent: bool = False) -> int:
+        """Search similar pairs over all blocks and save them to ``out_dir``
+
+        Already finished blocks (according to manifest in ``out_dir``) are skipped.
+
+        Args:
+            out_dir: directory for parquet parts and manifest
+            threshold: similarity threshold (in k-NN mode it is a minimal neighbour similarity)
+            k: if given, k nearest neighbours are searched for every question instead of all close pairs
+            n_jobs: number of threads, all CPU cores are used by default
+            silent: don't show progress bar
+
+        Returns:
+            Total number of found pairs
+        """
+        if threshold is None and k is None:
+            raise ValueError('Either threshold or k must be given')
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+
+        params = {
+            'n_questions': int(len(self.ids)),
+            'dim': int(self.embeddings.shape[1]),
+            'block_size': int(self.block_size),
+            'threshold': threshold,
+            'k': k,
+            'first_id': int(self.ids[0]) if len(self.ids) > 0 else None,
+            'last_id': int(self.ids[-1]) if len(self.ids) > 0 else None,
+        }
+        manifest = load_manifest(out_dir, params)
+        done = set(manifest['done_blocks'])
+        todo = [i for i in range(self.n_blocks) if i not in done]
+
+        def job(block_i: int) -> int:
+            if k is None:
+                left_ids, right_ids, sims = self.threshold_block(block_i, threshold)
+            else:
+                left_ids, right_ids, sims = self.topk_block(block_i, k, threshold)
+            # Part is written by the worker, so only n_jobs blocks of pairs are in memory at once
+            _write_part(out_dir, block_i, left_ids, right_ids, sims)
+            return len(sims)
+
+        # Every thread computes its own tiles, so BLAS shouldn't spawn threads too
+        if threadpool_limits is not None and n_jobs > 1:
+            limits = threadpool_limits(limits=1, user_api='blas')
+        else:
+            limits = nullcontext()
+
+        with limits, ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {executor.submit(job, block_i): block_i for block_i in todo}
+            finished = as_completed(futures)
+            if not silent:
+                finished = tqdm(finished, total=self.n_blocks, initial=len(done), unit='block')
+            for future in finished:
+                manifest['n_found'] += future.result()
+                manifest['done_blocks'].append(futures[future])
+                _save_manifest(out_dir, manifest)
+
+        return manifest['n_found']
+
+
+def _save_manifest(out_dir: str, manifest: dict) -> None:
+    atomic_write_json(path.join(out_dir, MANIFEST_NAME), manifest)
+
+
+def load_manifest(out_dir: str, params: Optional[dict] = None) -> dict:
+    """Load manifest of similarity search results or create a new one
+
+    Raises:
+        ManifestMismatchError: if existing manifest was created with different parameters
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = path.join(out_dir, MANIFEST_NAME)
+    if not path.isfile(manifest_path):
+        if params is None:
+            raise FileNotFoundError(f'No similarity search manifest in {out_dir}')
+        manifest = {'params': params, 'done_blocks': [], 'n_found': 0}
+        _save_manifest(out_dir, manifest)
+        return manifest
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if params is not None and manifest['params'] != params:
+        raise ManifestMismatchError(
+            f'Results in {out_dir} were computed with different parameters: {manifest["params"]}'
+        )
+    return manifest
+
+
+def _part_path(out_dir: str, block_i: int) -> str:
+    return path.join(out_dir, f'part-{block_i:06d}.parquet')
+
+
+def _write_part(out_dir: str, block_i: int,
+                left_ids: np.ndarray, right_ids: np.ndarray, sims: np.ndarray) -> None:
+    part_path = _part_path(out_dir, block_i)
+    pd.DataFrame({
+        'left_id': left_ids,
+        'right_id': right_ids,
+        'similarity': sims
+    }).to_parquet(part_path + '.tmp', index=False)
+    os.replace(part_path + '.tmp', part_path)
+
+
+def read_similar_pairs(out_dir: str) -> Iterator[PairChunk]:
+    """Read results of finished blocks as (left_ids, right_ids, similarities) chunks"""
+    manifest = load_manifest(out_dir)
+    for block_i in sorted(manifest['done_blocks']):
+        df = pd.read_parquet(_part_path(out_dir, block_i))
+        yield df['left_id'].to_numpy(), df['right_id'].to_numpy(), df['similarity'].to_numpy()
+
+
+def load_pickled_embeddings(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Load ``{id: embedding}`` dict pickled by the candidates selection notebook
+
+    Returns:
+        Sorted question ids and float32 matrix with corresponding embeddings
+    """
+    with open(file_path, 'rb') as f:
+        questions_embeddings = pickle.load(f)
+
+    ids = np.array(sorted(questions_embeddings.keys()), dtype=np.int64)
+    emb_dim = next(iter(questions_embeddings.values())).shape[0]
+    embeddings = np.empty((len(ids), emb_dim), dtype=np.float32)
+    for i, sent_id in enumerate(ids.tolist()):
+        embeddings[i] = np.asarray(questions_embeddings[sent_id])
+    return ids, embeddings
+
+
+def mine_similar_pairs(embeddings: np.ndarray, ids: np.ndarray, out_dir: str,
+                       threshold: Optional[float] = SIMILARITY_THRESHOLD,
+                       k: Optional[int] = None,
+                       block_size: int = SIM_BATCH_SIZE,
+                       n_jobs: Optional[int] = None,
+                       silent: bool = False) -> int:
+    """Shortcut for ``SimilaritySearch(embeddings, ids, block_size).search(...)``"""
+    return SimilaritySearch(embeddings, ids, block_size=block_size).search(
+        out_dir, threshold=threshold, k=k, n_jobs=n_jobs, silent=silent
+    )
@@ -0,0 +1,223 @@
+"""
+Cheap lexical comparison of question pairs.
+
+Reimplementation of the ``cmp_heuristic`` and ``LevCharCmp`` rules from the candidates selection notebook.
+Edit distances are computed only inside a band of width ``max_dist`` and stop as soon as the threshold
+is exceeded, so the answer "is the distance <= k" costs O(k * n) instead of O(n * m).
+"""
+import numpy as np
+
+from collections import Counter
+from typing import Callable, Hashable, List, Mapping, Optional, Sequence, Tuple
+
+from utils.nltk_resources import word_tokenize
+
+CHAR_DIST_THRESHOLD = 4
+BAG_DIST_THRESHOLD = 2
+TOKEN_DIST_THRESHOLD = 2
+LEV_CHAR_CMP_THRESHOLD = 5
+
+
+def bounded_levenshtein(left: Sequence[Hashable], right: Sequence[Hashable], max_dist: int) -> int:
+    """Levenshtein distance which is exact only up to a given bound
+
+    Both strings and token lists are accepted.
+
+    Args:
+        left: first sequence
+        right: second sequence
+        max_dist: distance bound
+
+    Returns:
+        Exact distance if it doesn't exceed ``max_dist``, otherwise ``max_dist + 1``
+    """
+    if max_dist < 0:
+        raise ValueError('max_dist must be non-negative')
+    if left == right:
+        return 0
+
+    # Common prefix and suffix don't affect the distance
+    n_left, n_right = len(left), len(right)
+    start = 0
+    while start < n_left and start < n_right and left[start] == right[start]:
+        start += 1
+    while n_left > start and n_right > start and left[n_left - 1] == right[n_right - 1]:
+        n_left -= 1
+        n_right -= 1
+    left = left[start:n_left]
+    right = right[start:n_right]
+
+    if len(left) > len(right):
+        left, right = right, left
+    n, m = len(left), len(right)
+    over = max_dist + 1
+    if m - n > max_dist:
+        return over
+    if n == 0:
+        return m
+
+    prev = [min(j, over) for j in range(m + 1)]
+    for i in range(1, n + 1):
+        # Only cells with |i - j| <= max_dist may have distance within the bound
+        lo = max(1, i - max_dist)
+        hi = min(m, i + max_dist)
+        cur = [over] * (m + 1)
+        row_min = over
+        if lo == 1:
+            cur[0] = min(i, over)
+            row_min = cur[0]
+
+        char = left[i - 1]
+        for j in range(lo, hi + 1):
+            val = prev[j - 1] + (char != right[j - 1])
+            if prev[j] + 1 < val:
+                val = prev[j] + 1
+            if cur[j - 1] + 1 < val:
+                val = cur[j - 1] + 1
+            if val > over:
+                val = over
+            cur[j] = val
+            if val < row_min:
+                row_min = val
+
+        if row_min > max_dist:
+            # Every path goes through this row, so the distance can't decrease anymore
+            return over
+        prev = cur
+    return min(prev[m], over)
+
+
+def bag_distance(left: Counter, right: Counter) -> int:
+    """Bag (multiset) distance, the same as ``textdistance.bag``"""
+    return max(sum((left - right).values()), sum((right - left).values()))
+
+
+def lev_char_eq(left: str, right: str, max_dist: int = LEV_CHAR_CMP_THRESHOLD) -> bool:
+    """Heuristic of ``LevCharCmp`` comparator: questions are equal if they differ in a few characters"""
+    return bounded_levenshtein(left, right, max_dist) <= max_dist
+
+
+class HeuristicComparator(object):
+    """
+    Questions comparator with the same semantics as ``cmp_heuristic``.
+    Lowercased text, tokens and bag of tokens are computed once per question id.
+    """
+    def __init__(self,
+                 texts: Mapping[int, str],
+                 tokenize: Callable[[str], List[str]] = word_tokenize,
+                 char_threshold: int = CHAR_DIST_THRESHOLD,
+                 bag_threshold: int = BAG_DIST_THRESHOLD,
+                 token_threshold: int = TOKEN_DIST_THRESHOLD):
+        """
+        Args:
+            texts: mapping from question id to question text
+            tokenize: function, which splits lowercased text into tokens
+            char_threshold: questions are equal, if character Levenshtein distance doesn't exceed it
+            bag_threshold: questions are different, if bag of tokens distance exceeds it
+            token_threshold: questions are equal, if token Levenshtein distance doesn't exceed it
+        """
+        self.texts = texts
+        self.tokenize = tokenize
+        self.char_threshold = char_threshold
+        self.bag_threshold = bag_threshold
+        self.token_threshold = token_threshold
+        self._lower = {}
+        self._tokens = {}
+
+    def _get_lower(self, q_id: int) -> str:
+        lower = self._lower.get(q_id, None)
+        if lower is None:
+            lower = self.texts[q_id].lower()
+            self._lower[q_id] = lower
+        return lower
+
+    def _get_tokens(self, q_id: int) -> Tuple[Tuple[str, ...], Counter]:
+        cached = self._tokens.get(q_id, None)
+        if cached is None:
+            tokens = tuple(self.tokenize(self._get_lower(q_id)))
+            cached = (tokens, Counter(tokens))
+            self._tokens[q_id] = cached
+        return cached
+
+    def clear_cache(self) -> None:
+        self._lower.clear()
+        self._tokens.clear()
+
+    def texts_eq(self, left: str, right: str) -> bool:
+        """Compare two raw texts without caching"""
+        left = left.lower()
+        right = right.lower()
+        if bounded_levenshtein(left, right, self.char_threshold) <= self.char_threshold:
+            return True
+
+        tok_left = self.tokenize(left)
+        tok_right = self.tokenize(right)
+        if bag_distance(Counter(tok_left), Counter(tok_right)) > self.bag_threshold:
+            return False
+        return bounded_levenshtein(tok_left, tok_right, self.token_threshold) <= self.token_threshold
+
+    def __call__(self, left_id: int, right_id: int) -> bool:
+        """Compare two questions by their ids
+
+        Returns:
+            True if questions are almost the same, False otherwise
+        """
+        left = self._get_lower(left_id)
+        right = self._get_lower(right_id)
+        if bounded_levenshtein(left, right, self.char_threshold) <= self.char_threshold:
+            # Two questions are very close (as symbol sequence)
+            return True
+
+        tok_left, bag_left = self._get_tokens(left_id)
+        tok_right, bag_right = self._get_tokens(right_id)
+        # Bag distance is a lower bound of token Levenshtein distance, so it's checked first
+        if bag_distance(bag_left, bag_right) > self.bag_threshold:
+            return False
+        return bounded_levenshtein(tok_left, tok_right, self.token_threshold) <= self.token_threshold
+
+    def batch(self, left_ids: Sequence[int], right_ids: Sequence[int]) -> np.ndarray:
+        """Compare many question pairs
+
+        Args:
+            left_ids: ids of the first questions in pairs
+            right_ids: ids of the second questions in pairs
+
+        Returns:
+            Boolean array, True for pairs of almost the same questions
+        """
+        left_ids = np.asarray(left_ids)
+        right_ids = np.asarray(right_ids)
+        if left_ids.shape != right_ids.shape:
+            raise ValueError('left_ids and right_ids must have the same shape')
+
+        result = np.empty(left_ids.shape, dtype=bool)
+        for i, (left_id, right_id) in enumerate(zip(left_ids.tolist(), right_ids.tolist())):
+            result[i] = self(left_id, right_id)
+        return result
+
+
+def cmp_heuristic(left: str, right: str) -> bool:
+    """Compare two questions, using several heuristics (see ``HeuristicComparator``)"""
+    return _default_comparator.texts_eq(left, right)
+
+
+def filter_pairs(texts: Mapping[int, str],
+                 left_ids: Sequence[int], right_ids: Sequence[int],
+                 comparator: Optional[HeuristicComparator] = None) -> np.ndarray:
+    """Select pairs of questions, which are not almost the same
+
+    Args:
+        texts: mapping from question id to question text
+        left_ids: ids of the first questions in pairs
+        right_ids: ids of the second questions in pairs
+        comparator: comparator to use, new ``HeuristicComparator`` is created if not given
+
+    Returns:
+        Boolean mask of pairs to keep
+    """
+    if comparator is None:
+        comparator = HeuristicComparator(texts)
+    return ~comparator.batch(left_ids, right_ids)
+
+
+_default_comparator = HeuristicComparator({})
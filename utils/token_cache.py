@@ -0,0 +1,218 @@
+"""
+On-disk cache of tokenized questions.
+
+Questions are tokenized once by the batched fast tokenizer, and token ids are saved
+as a ragged array: one flat ``int32`` array with all tokens and an array of offsets.
+Special tokens are not stored, so the same cache serves both single question layout
+([CLS] question) and question pair layout ([CLS] left [SEP] right [SEP]).
+
+Cache of each tokenizer is stored in a separate subdirectory of the cache root:
+    * ``tokens-<build>.npy`` - concatenated token ids
+    * ``offsets-<build>.npy`` - start of every question in ``tokens`` (plus total length at the end)
+    * ``ids-<build>.npy`` - question ids in rows order
+    * ``meta.json`` - tokenizer name and id of the current build
+
+Every build writes new array files and then atomically replaces ``meta.json``,
+so an interrupted build leaves the previous arrays in use as a consistent set.
+"""
+import pandas as pd
+import numpy as np
+from transformers import AutoTokenizer
+
+import argparse
+import json
+import os
+import re
+import uuid
+from os import path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from utils.atomic_write import atomic_write_json
+
+try:
+    from tqdm.auto import tqdm
+except ModuleNotFoundError:
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+
+TOKENIZE_BATCH_SIZE = 10000
+
+
+def _tokenizer_dir(root: str, tokenizer_name: str) -> str:
+    return path.join(root, re.sub(r'[^\w.-]+', '__', tokenizer_name))
+
+
+def _array_path(cache_dir: str, name: str, build: str) -> str:
+    return path.join(cache_dir, f'{name}-{build}.npy')
+
+
+class TokenCache(object):
+    """
+    Token ids of questions by question id for one tokenizer
+    """
+    def __init__(self, root: str, tokenizer_name: str, mmap: bool = True):
+        """Open existing cache
+
+        Args:
+            root: cache root directory
+            tokenizer_name: name of HuggingFace tokenizer
+            mmap: open token arrays as memory map
+        """
+        self.dir = _tokenizer_dir(root, tokenizer_name)
+        with open(path.join(self.dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['tokenizer_name'] != tokenizer_name:
+            raise ValueError(f'Cache in {self.dir} belongs to tokenizer {meta["tokenizer_name"]}')
+        if 'build' not in meta:
+            raise ValueError(f'Cache in {self.dir} has no build id, remove it and build again')
+        self.tokenizer_name = tokenizer_name
+        self.build_id = meta['build']
+
+        mmap_mode = 'r' if mmap else None
+        self.tokens = np.load(_array_path(self.dir, 'tokens', self.build_id), mmap_mode=mmap_mode)
+        self.offsets = np.load(_array_path(self.dir, 'offsets', self.build_id))
+        self.ids = np.load(_array_path(self.dir, 'ids', self.build_id))
+        self._sorted_rows = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._sorted_rows]
+
+    @classmethod
+    def exists(cls, root: str, tokenizer_name: str) -> bool:
+        return path.isfile(path.join(_tokenizer_dir(root, tokenizer_name), 'meta.json'))
+
+    @classmethod
+    def build(cls, root: str, tokenizer, ids: Sequence[int], texts: Sequence[str],
+              batch_size: int = TOKENIZE_BATCH_SIZE, silent: bool = True) -> 'TokenCache':
+        """Tokenize questions and create (or extend) the cache
+
+        Questions, which are already in the cache, are not tokenized again.
+
+        Args:
+            root: cache root directory
+            tokenizer: HuggingFace tokenizer (fast one is recommended)
+            ids: question ids
+            texts: question texts
+            batch_size: number of questions passed to tokenizer at once
+            silent: don't show progress bar
+        """
+        tokenizer_name = tokenizer.name_or_path
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(np.unique(ids)) < len(ids):
+            raise ValueError('Question ids must be unique')
+
+        old_tokens = np.empty(0, dtype=np.int32)
+        old_offsets = np.zeros(1, dtype=np.int64)
+        old_ids = np.empty(0, dtype=np.int64)
+        if cls.exists(root, tokenizer_name):
+            old = cls(root, tokenizer_name, mmap=False)
+            old_tokens, old_offsets, old_ids = old.tokens, old.offsets, old.ids
+            new = ~old.contains(ids)
+            ids = ids[new]
+            texts = [texts[i] for i in np.nonzero(new)[0]]
+
+        chunks = [old_tokens]
+        lengths = [np.diff(old_offsets)]
+        it = range(0, len(ids), batch_size)
+        if not silent:
+            it = tqdm(it, unit='batch', desc='Tokenization')
+        for start in it:
+            encoded = tokenizer(
+                list(texts[start:start + batch_size]),
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )['input_ids']
+            lengths.append(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+            chunks.append(np.fromiter((tok for seq in encoded for tok in seq), dtype=np.int32))
+
+        lengths = np.concatenate(lengths)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        cache_dir = _tokenizer_dir(root, tokenizer_name)
+        os.makedirs(cache_dir, exist_ok=True)
+        build = uuid.uuid4().hex
+        for name, arr in (('tokens', np.concatenate(chunks)),
+                          ('offsets', offsets),
+                          ('ids', np.concatenate([old_ids, ids]))):
+            np.save(_array_path(cache_dir, name, build), arr)
+        # Switching meta.json to the new build is the only step visible to readers
+        atomic_write_json(path.join(cache_dir, 'meta.json'), {'tokenizer_name': tokenizer_name, 'build': build})
+
+        current = {path.basename(_array_path(cache_dir, name, build)) for name in ('tokens', 'offsets', 'ids')}
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith('.npy') and file_name not in current:
+                os.remove(path.join(cache_dir, file_name))
+        return cls(root, tokenizer_name)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, q_id: int) -> bool:
+        return bool(self.contains([q_id])[0])
+
+    def __getitem__(self, q_id: int) -> np.ndarray:
+        row = self.rows([q_id])[0]
+        return self.tokens[self.offsets[row]:self.offsets[row + 1]]
+
+    def contains(self, ids: Iterable[int]) -> np.ndarray:
+        """Boolean mask of ids presented in the cache"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.zeros(ids.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, ids), len(self._sorted_ids) - 1)
+        return self._sorted_ids[pos] == ids
+
+    def rows(self, ids: Iterable[int]) -> np.ndarray:
+        """Rows of given question ids
+
+        Raises:
+            KeyError: if some id is absent in the cache
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        mask = self.contains(ids)
+        if not mask.all():
+            raise KeyError(f'Questions are not tokenized: {ids[~mask][:10].tolist()}')
+        return self._sorted_rows[np.searchsorted(self._sorted_ids, ids)]
+
+    def lengths(self, ids: Optional[Iterable[int]] = None) -> np.ndarray:
+        """Number of tokens of given questions (of all questions, if ids are not given)"""
+        lengths = np.diff(self.offsets)
+        if ids is None:
+            return lengths
+        return lengths[self.rows(ids)]
+
+    def get_many(self, ids: Iterable[int]) -> List[np.ndarray]:
+        """Token ids of several questions"""
+        return [self.tokens[self.offsets[row]:self.offsets[row + 1]] for row in self.rows(ids).tolist()]
+
+    def ragged(self, ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Token ids of given questions as a new ragged array
+
+        Returns:
+            Tuple of flat tokens array and offsets array
+        """
+        rows = self.rows(ids)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Index of every token in the flat array of the cache
+        flat_idx = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return np.asarray(self.tokens[flat_idx]), offsets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tokenize questions and save them into the token cache')
+    parser.add_argument('questions', help="CSV file (';' separated) with 'id' and 'text' columns")
+    parser.add_argument('cache', help='Cache root directory')
+    parser.add_argument('--tokenizer', nargs='+', required=True, help='HuggingFace tokenizer names')
+    args = parser.parse_args()
+
+    questions = pd.read_csv(args.questions, sep=';', usecols=['id', 'text'])
+    for name in args.tokenizer:
+        cache = TokenCache.build(
+            args.cache, AutoTokenizer.from_pretrained(name, use_fast=True),
+            questions['id'].to_numpy(), questions['text'].tolist(),
+            silent=False
+        )
+        print(f'{name}: {len(cache)} questions, {len(cache.tokens)} tokens')